@@ -1,11 +1,5 @@
 import { NextRequest, NextResponse } from "next/server";
-import { spawn } from "child_process";
-import { writeFile, readFile, unlink } from "fs/promises";
-import path from "path";
-import { CoredocDocument } from "@/types/document";
-
-const TEMP_DIR = "/tmp";
-const PYTHON_SCRIPT = path.join(process.cwd(), "coredoc-processor", "coredoc.py");
+import { getProcessorPool, JobTimeoutError, PoolBusyError } from "@/lib/processor-pool";
 
 export async function POST(request: NextRequest) {
   try {
@@ -22,22 +16,8 @@ export async function POST(request: NextRequest) {
         );
       }
       
-      // Save text to temporary file
-      const tempInputPath = path.join(TEMP_DIR, `input-${Date.now()}.txt`);
-      const tempOutputPath = path.join(TEMP_DIR, `output-${Date.now()}.json`);
-      
-      await writeFile(tempInputPath, text, "utf-8");
-      
-      // Process with Python script
-      const result = await processPythonScript(tempInputPath, tempOutputPath);
-      
-      // Read output
-      const outputContent = await readFile(tempOutputPath, "utf-8");
-      const document = JSON.parse(outputContent) as CoredocDocument;
-      
-      // Cleanup
-      await unlink(tempInputPath);
-      await unlink(tempOutputPath);
+      // Process with a warm Python worker
+      const document = await getProcessorPool().process(text);
       
       return NextResponse.json({ document });
       
@@ -53,15 +33,9 @@ export async function POST(request: NextRequest) {
         );
       }
       
-      // Save uploaded file
       const bytes = await file.arrayBuffer();
       const buffer = Buffer.from(bytes);
       
-      const tempInputPath = path.join(TEMP_DIR, `upload-${Date.now()}-${file.name}`);
-      const tempOutputPath = path.join(TEMP_DIR, `output-${Date.now()}.json`);
-      
-      await writeFile(tempInputPath, buffer);
-      
       // Process based on file type
       let processedText = "";
       
@@ -83,19 +57,8 @@ export async function POST(request: NextRequest) {
         );
       }
       
-      // Save processed text
-      await writeFile(tempInputPath, processedText, "utf-8");
-      
-      // Process with Python script
-      const result = await processPythonScript(tempInputPath, tempOutputPath, file.name);
-      
-      // Read output
-      const outputContent = await readFile(tempOutputPath, "utf-8");
-      const document = JSON.parse(outputContent) as CoredocDocument;
-      
-      // Cleanup
-      await unlink(tempInputPath);
-      await unlink(tempOutputPath);
+      // Process with a warm Python worker
+      const document = await getProcessorPool().process(processedText, file.name);
       
       return NextResponse.json({ document });
     }
@@ -106,40 +69,24 @@ export async function POST(request: NextRequest) {
     );
     
   } catch (error) {
+    if (error instanceof PoolBusyError) {
+      return NextResponse.json(
+        { error: "Processor is busy. Please try again shortly." },
+        { status: 503, headers: { "Retry-After": "5" } }
+      );
+    }
+    
+    if (error instanceof JobTimeoutError) {
+      return NextResponse.json(
+        { error: "Processing timed out" },
+        { status: 504 }
+      );
+    }
+    
     console.error("Processing error:", error);
     return NextResponse.json(
       { error: "Processing failed" },
       { status: 500 }
     );
   }
-}
-
-function processPythonScript(inputPath: string, outputPath: string, title?: string): Promise<void> {
-  return new Promise((resolve, reject) => {
-    const args = [PYTHON_SCRIPT, inputPath, "-o", outputPath];
-    
-    if (title) {
-      args.push("-t", title);
-    }
-    
-    const pythonProcess = spawn("python3", args);
-    
-    let stderr = "";
-    
-    pythonProcess.stderr.on("data", (data) => {
-      stderr += data.toString();
-    });
-    
-    pythonProcess.on("close", (code) => {
-      if (code !== 0) {
-        reject(new Error(`Python script failed: ${stderr}`));
-      } else {
-        resolve();
-      }
-    });
-    
-    pythonProcess.on("error", (error) => {
-      reject(error);
-    });
-  });
 }
\ No newline at end of file
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Corpus linking benchmark
+
+Builds seeded synthetic corpora of Coredoc documents, keeping only what
+CorpusLinker reads: chunk ids and keywords drawn from a Zipf-distributed
+vocabulary. Times indexing and link selection and reports the memory
+held by the index. Time per chunk should stay roughly flat as the corpus grows.
+
+A small corpus is first linked with unbounded postings and compared with
+a brute-force pairwise scoring of every chunk; the script exits with
+status 1 if they differ.
+
+Usage:
+    python benchmarks/bench_corpus_links.py [--chunks 10k 100k] [--chunks-per-document 100]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from coredoc import CorpusLinker
+from run_benchmarks import parse_size
+
+
+def generate_corpus(chunks: int, chunks_per_document: int, vocabulary: int = 50000,
+                    seed: int = 0) -> List[Dict]:
+    """Documents of chunks with ten keywords each, from a Zipf-distributed vocabulary"""
+    rng = random.Random(seed)
+    terms = [f"term{index}" for index in range(vocabulary)]
+    cumulative = []
+    total = 0.0
+    for rank in range(1, vocabulary + 1):
+        total += 1 / rank
+        cumulative.append(total)
+    
+    documents = []
+    for start in range(0, chunks, chunks_per_document):
+        document = {'chunks': []}
+        for index in range(min(chunks_per_document, chunks - start)):
+            keywords = rng.choices(terms, cum_weights=cumulative, k=10)
+            document['chunks'].append({
+                'id': f"chunk_{index}",
+                'keywords': [{'term': term, 'importance_score': round(rng.uniform(0.01, 0.1), 4)}
+                             for term in keywords]
+            })
+        documents.append(document)
+    return documents
+
+
+def brute_force_links(documents: List[Dict], top_k: int) -> List[Dict]:
+    """Score every pair of chunks from different documents"""
+    document_frequency = Counter()
+    chunks = []
+    for number, document in enumerate(documents):
+        seen = set()
+        for chunk in document['chunks']:
+            weights = {}
+            for keyword in chunk['keywords']:
+                term = keyword['term'].lower()
+                weights[term] = max(weights.get(term, 0.0), keyword['importance_score'])
+            chunks.append((f"doc{number}", chunk['id'], weights))
+            seen.update(weights)
+        document_frequency.update(seen)
+    
+    idf = {term: math.log((1 + len(documents)) / (1 + df)) + 1 for term, df in document_frequency.items()}
+    
+    results = []
+    for index, (document, chunk_id, weights) in enumerate(chunks):
+        scored = []
+        for other, (other_document, other_id, other_weights) in enumerate(chunks):
+            if other_document == document:
+                continue
+            shared = [term for term in weights if term in other_weights and document_frequency[term] > 1]
+            if shared:
+                score = sum(weights[term] * other_weights[term] * idf[term] ** 2 for term in shared)
+                scored.append((-score, other, other_document, other_id))
+        if scored:
+            scored.sort()
+            results.append({
+                'document': document,
+                'chunk': chunk_id,
+                'links': [(other_document, other_id, round(-score, 6)) for score, _, other_document, other_id in scored[:top_k]]
+            })
+    return results
+
+
+def check(top_k: int) -> bool:
+    documents = generate_corpus(600, 30, vocabulary=400, seed=1)
+    linker = CorpusLinker(top_k=top_k, max_postings=10 ** 9)
+    for number, document in enumerate(documents):
+        linker.add_document(f"doc{number}", document)
+    
+    actual = [{
+        'document': record['document'],
+        'chunk': record['chunk'],
+        'links': [(link['target_document'], link['target_page_id'], link['score']) for link in record['links']]
+    } for record in linker.iter_links()]
+    return actual == brute_force_links(documents, top_k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cross-document linking of a corpus')
+    parser.add_argument('--chunks', type=parse_size, nargs='+', default=[parse_size(s) for s in ('10k', '100k')])
+    parser.add_argument('--chunks-per-document', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--max-postings', type=int, default=32)
+    
+    args = parser.parse_args()
+    
+    same = check(args.top_k)
+    print(f"brute-force check: {'same' if same else 'DIFFERENT'}")
+    
+    print(f"{'chunks':>9} {'index s':>9} {'link s':>9} {'us/chunk':>9} {'index MiB':>9} {'links':>9}")
+    for size in args.chunks:
+        documents = generate_corpus(size, args.chunks_per_document)
+        
+        start = time.perf_counter()
+        linker = CorpusLinker(top_k=args.top_k, max_postings=args.max_postings)
+        for number, document in enumerate(documents):
+            linker.add_document(f"doc{number}", document)
+        indexed = time.perf_counter()
+        links = sum(len(record['links']) for record in linker.iter_links())
+        finished = time.perf_counter()
+        
+        # Tracing slows allocation-heavy code down, so memory is measured in a second pass
+        tracemalloc.start()
+        linker = CorpusLinker(top_k=args.top_k, max_postings=args.max_postings)
+        for number, document in enumerate(documents):
+            linker.add_document(f"doc{number}", document)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        
+        print(f"{size:>9} {indexed - start:>9.2f} {finished - indexed:>9.2f} "
+              f"{(finished - start) / size * 1e6:>9.1f} {peak / 2 ** 20:>9.1f} {links:>9}")
+    
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate chunk detection benchmark
+
+Builds seeded chunk texts where a share of chunks are copies of a few
+boilerplate blocks with some of their words replaced. Checks MinHashIndex
+against exact Jaccard similarity of the word shingles on a small set:
+copies clearly above the threshold must be found, and texts clearly
+below it must not be collapsed. Then times indexing growing numbers of
+chunks and reports the memory held by the index, and runs the
+duplicates=minhash stage on a synthetic document full of boilerplate.
+
+Exits with status 1 if the accuracy check fails.
+
+Usage:
+    python benchmarks/bench_duplicates.py [--chunks 10k 100k] [--threshold 0.9]
+"""
+
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+import tracemalloc
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from coredoc import CoredocProcessor, MinHashIndex
+from run_benchmarks import parse_size
+
+WORD = re.compile(r'\w+')
+
+# Share of words replaced in each copy of a boilerplate block
+EDIT_RATES = [0.0, 0.005, 0.02, 0.1, 0.3]
+
+
+def generate_chunks(count: int, duplicate_share: float = 0.3, seed: int = 0) -> Tuple[List[str], List[int]]:
+    """Chunk texts, and for each the boilerplate block it copies or -1"""
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+                  for _ in range(20000)]
+    
+    def words(length: int) -> List[str]:
+        return [rng.choice(vocabulary) for _ in range(length)]
+    
+    blocks = [words(rng.randint(80, 250)) for _ in range(50)]
+    
+    texts = []
+    sources = []
+    for _ in range(count):
+        if rng.random() < duplicate_share:
+            block = rng.randrange(len(blocks))
+            rate = rng.choice(EDIT_RATES)
+            copy = [rng.choice(vocabulary) if rng.random() < rate else word for word in blocks[block]]
+            texts.append(' '.join(copy))
+            sources.append(block)
+        else:
+            texts.append(' '.join(words(rng.randint(80, 250))))
+            sources.append(-1)
+    return texts, sources
+
+
+def shingles(text: str, size: int) -> set:
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def check(threshold: float, margin: float = 0.05) -> Tuple[int, int, int]:
+    """Missed clear duplicates, wrongly collapsed texts, and clear duplicates in total"""
+    texts, _ = generate_chunks(1500, seed=1)
+    index = MinHashIndex(threshold)
+    sets = [shingles(text, index.shingle_size) for text in texts]
+    
+    canonical = []
+    missed = wrong = clear = 0
+    for number, signature in enumerate(index.signatures(texts)):
+        match = index.add(number, signature)
+        best = max((jaccard(sets[number], sets[other]) for other in canonical), default=0.0)
+        
+        if best >= threshold + margin:
+            clear += 1
+            missed += match is None
+        if match is not None and jaccard(sets[number], sets[match[0]]) < threshold - margin:
+            wrong += 1
+        if match is None:
+            canonical.append(number)
+    return missed, wrong, clear
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark near-duplicate chunk detection')
+    parser.add_argument('--chunks', type=parse_size, nargs='+', default=[parse_size(s) for s in ('10k', '100k')])
+    parser.add_argument('--threshold', type=float, default=0.9)
+    
+    args = parser.parse_args()
+    
+    missed, wrong, clear = check(args.threshold)
+    passed = missed <= clear * 0.02 and wrong == 0
+    print(f"exact Jaccard check: {clear} clear duplicates, {missed} missed, {wrong} wrongly collapsed"
+          f" - {'ok' if passed else 'FAILED'}")
+    
+    print(f"{'chunks':>9} {'seconds':>9} {'us/chunk':>9} {'index MiB':>9} {'duplicates':>10}")
+    for size in args.chunks:
+        texts, _ = generate_chunks(size)
+        
+        start = time.perf_counter()
+        index = MinHashIndex(args.threshold)
+        duplicates = sum(index.add(number, signature) is not None
+                         for number, signature in enumerate(index.signatures(texts)))
+        seconds = time.perf_counter() - start
+        
+        # Tracing slows allocation-heavy code down, so memory is measured in a second pass
+        tracemalloc.start()
+        index = MinHashIndex(args.threshold)
+        for number, signature in enumerate(index.signatures(texts)):
+            index.add(number, signature)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del index
+        
+        print(f"{size:>9} {seconds:>9.2f} {seconds / size * 1e6:>9.1f} {memory / 2 ** 20:>9.1f} {duplicates:>10}")
+    
+    # A document whose sections repeat boilerplate
+    texts, _ = generate_chunks(2000, duplicate_share=0.5, seed=2)
+    document = ''.join(f"# Section {number}\n\n{text}.\n\n" for number, text in enumerate(texts))
+    print(f"\n{'duplicates':<12} {'chunks':>7} {'stage s':>9} {'links s':>9} {'links':>7}")
+    for stage in ('off', 'minhash'):
+        processor = CoredocProcessor(stages={'duplicates': stage, 'keywords': 'regex'},
+                                     duplicate_threshold=args.threshold)
+        chunks = processor.pipeline['chunks'](processor.pipeline['sections'](processor.pipeline['clean'](document)))
+        
+        start = time.perf_counter()
+        chunks = processor.pipeline['duplicates'](chunks)
+        deduplicated = time.perf_counter()
+        chunks = processor.pipeline['links'](processor.pipeline['keywords'](chunks))
+        linked = time.perf_counter()
+        
+        links = sum(len(chunk.links) for chunk in chunks)
+        print(f"{stage:<12} {len(chunks):>7} {deduplicated - start:>9.3f} {linked - deduplicated:>9.3f} {links:>7}")
+    
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Output format size and speed benchmark
+
+Processes the example documents and a seeded synthetic document, with
+boilerplate sections repeated so that collapsed duplicates are covered,
+and writes each with every output format and compression. Reports the
+size of each output relative to the source text, and the time to write
+and load it. load_document() must return exactly the document of the
+default JSON output for every format; the script exits with status 1 if
+it does not.
+
+Usage:
+    python benchmarks/bench_formats.py [--files examples/*.txt] [--size 1m]
+"""
+
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+from typing import Dict, Iterator, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from coredoc import COMPRESSIONS, OUTPUT_FORMATS, CoredocProcessor, load_document, write_document
+from run_benchmarks import parse_size
+from synthetic import generate_document
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                        'standalone-processor', 'examples', '*.txt')
+
+
+def with_boilerplate(text: str, copies: int = 20) -> str:
+    """text followed by repeated copies of its first section"""
+    sections = text.split('\n\n#')
+    boilerplate = '\n\n#' + sections[1] if len(sections) > 1 else '\n\n' + text[:2000]
+    return text + boilerplate * copies
+
+
+def fresh(records: List[Dict]) -> Iterator[Dict]:
+    """The records again, with a header that collecting the document has not changed"""
+    return iter([dict(records[0])] + records[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the size and speed of the output formats')
+    parser.add_argument('--files', nargs='*', default=sorted(glob.glob(EXAMPLES)),
+                        help='Text files to process (default: the standalone examples)')
+    parser.add_argument('--size', type=parse_size, default=parse_size('1m'),
+                        help='Size of the synthetic document')
+    
+    args = parser.parse_args()
+    
+    corpora = []
+    for filename in args.files:
+        with open(filename, 'r', encoding='utf-8') as f:
+            corpora.append((os.path.basename(filename), f.read()))
+    corpora.append((f"synthetic-{args.size}", with_boilerplate(generate_document(args.size, seed=0))))
+    
+    processor = CoredocProcessor(stages={'keywords': 'regex', 'duplicates': 'minhash'})
+    
+    failed = False
+    for name, text in corpora:
+        records = list(processor.iter_document(text, name))
+        print(f"\n{name}: {len(text.encode('utf-8'))} bytes of text, {len(records) - 1} chunks")
+        print(f"{'format':<10} {'compress':<9} {'bytes':>10} {'x text':>7} {'write ms':>9} {'load ms':>9}  result")
+        
+        expected = None
+        for output_format in OUTPUT_FORMATS:
+            for compression in (None,) + COMPRESSIONS:
+                out = io.BytesIO()
+                start = time.perf_counter()
+                write_document(fresh(records), out, output_format, compression)
+                written = time.perf_counter()
+                document = load_document(io.BytesIO(out.getvalue()))
+                loaded = time.perf_counter()
+                
+                if expected is None:
+                    expected = document
+                same = document == expected
+                failed = failed or not same
+                
+                size = len(out.getvalue())
+                print(f"{output_format:<10} {compression or '-':<9} {size:>10} {size / len(text.encode('utf-8')):>7.2f} "
+                      f"{(written - start) * 1000:>9.1f} {(loaded - written) * 1000:>9.1f}  "
+                      f"{'same' if same else 'DIFFERENT'}")
+        
+        # Reading one chunk of a large document without decoding the others
+        out = io.BytesIO()
+        write_document(fresh(records), out, 'msgpack', 'zstd')
+        start = time.perf_counter()
+        document = load_document(io.BytesIO(out.getvalue()), lazy=True)
+        chunk = document['chunks'][len(document['chunks']) // 2]
+        print(f"lazy msgpack+zstd load and one chunk: {(time.perf_counter() - start) * 1000:.1f} ms"
+              f" ({'same' if chunk == expected['chunks'][len(document['chunks']) // 2] else 'DIFFERENT'})")
+    
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
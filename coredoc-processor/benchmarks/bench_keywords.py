@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Keyword extraction scaling benchmark
+
+Times CoredocProcessor._extract_keywords on seeded synthetic chunks of
+growing size. With one-pass statistics the time per character should stay
+roughly flat as chunks grow.
+
+Usage:
+    python benchmarks/bench_keywords.py [--sizes 2000 20000 200000] [--repeat 3]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from coredoc import CoredocProcessor
+
+
+def make_chunk(size: int, seed: int = 0) -> str:
+    """Build a chunk of about size characters with words and capitalized phrases"""
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+                  for _ in range(max(50, size // 40))]
+    
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(vocabulary)
+        if rng.random() < 0.3:
+            word = word.capitalize()
+        if rng.random() < 0.08:
+            word += '.'
+        words.append(word)
+        length += len(word) + 1
+    
+    return ' '.join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark keyword extraction against chunk size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000, 200000])
+    parser.add_argument('--repeat', type=int, default=3)
+    
+    args = parser.parse_args()
+    
+    processor = CoredocProcessor()
+    
+    print(f"{'chars':>10} {'seconds':>10} {'us/char':>10}")
+    for size in args.sizes:
+        text = make_chunk(size)
+        best = min(_time(processor, text) for _ in range(args.repeat))
+        print(f"{len(text):>10} {best:>10.4f} {best / len(text) * 1e6:>10.3f}")
+
+
+def _time(processor: CoredocProcessor, text: str) -> float:
+    start = time.perf_counter()
+    processor._extract_keywords(text)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    main()
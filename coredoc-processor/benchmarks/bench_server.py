@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Processing server load benchmark
+
+Starts standalone-processor/serve.py on a temporary documents folder and
+sends bursts of concurrent uploads of a seeded synthetic document. Reports
+how many uploads were accepted and how many were turned away with 503,
+the response time of both, and the time until every accepted job finished.
+Status requests made while the workers are busy are timed as well, since
+admission control should keep them fast under load.
+
+Exits with status 1 if an accepted job fails, if a request gets any other
+answer than 202 or 503, or if more uploads are accepted than the workers
+and queue hold.
+
+Usage:
+    python benchmarks/bench_server.py [--clients 8 64] [--workers 2] [--queue 8] [--size 100k]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from run_benchmarks import parse_size
+from synthetic import generate_document
+
+SERVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'standalone-processor', 'serve.py')
+
+
+def request(url: str, data: bytes = None) -> Tuple[int, Dict, float]:
+    """Status, JSON body and seconds taken by one request"""
+    start = time.perf_counter()
+    headers = {'Content-Type': 'text/plain'} if data is not None else {}
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=60) as f:
+            status, body = f.status, f.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    return status, json.loads(body), time.perf_counter() - start
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(base: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            request(base + '/api/health')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def burst(base: str, clients: int, text: bytes, capacity: int) -> bool:
+    """Send clients concurrent uploads, wait for the accepted ones and print a row"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        responses = list(pool.map(lambda _: request(base + '/api/jobs', text), range(clients)))
+        
+        # Status requests while the workers are busy
+        probes = [seconds for _, _, seconds in pool.map(lambda _: request(base + '/api/health'), range(20))]
+    
+    accepted = [body['processing_id'] for status, body, _ in responses if status == 202]
+    refused = sum(status == 503 for status, _, _ in responses)
+    passed = len(accepted) + refused == clients and len(accepted) <= capacity
+    
+    for job_id in accepted:
+        while True:
+            _, status, _ = request(f"{base}/api/jobs/{job_id}")
+            if status['status'] in ('completed', 'failed'):
+                passed = passed and status['status'] == 'completed'
+                break
+            time.sleep(0.05)
+    finished = time.perf_counter() - start
+    
+    def milliseconds(code: int) -> str:
+        times = [seconds for status, _, seconds in responses if status == code]
+        return f"{statistics.median(times) * 1000:.1f}" if times else '-'
+    
+    print(f"{clients:>8} {len(accepted):>9} {refused:>8} {milliseconds(202):>9} {milliseconds(503):>9} "
+          f"{max(probes) * 1000:>9.1f} {finished:>9.2f}  {'ok' if passed else 'FAILED'}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the processing server under concurrent uploads')
+    parser.add_argument('--clients', type=int, nargs='+', default=[8, 64])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--queue', type=int, default=8)
+    parser.add_argument('--size', type=parse_size, default=parse_size('100k'),
+                        help='Characters in each uploaded document')
+    
+    args = parser.parse_args()
+    
+    text = generate_document(args.size, seed=0).encode('utf-8')
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    
+    with tempfile.TemporaryDirectory() as documents:
+        server = subprocess.Popen([sys.executable, SERVE, '--host', '127.0.0.1', '--port', str(port),
+                                   '--documents', documents, '--workers', str(args.workers),
+                                   '--queue', str(args.queue), '--skip-initial'],
+                                  stdout=subprocess.DEVNULL)
+        try:
+            wait_until_up(base)
+            print(f"{'clients':>8} {'accepted':>9} {'refused':>8} {'202 ms':>9} {'503 ms':>9} "
+                  f"{'health ms':>9} {'seconds':>9}")
+            passed = all([burst(base, clients, text, args.workers + args.queue) for clients in args.clients])
+        finally:
+            server.terminate()
+            server.wait()
+    
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
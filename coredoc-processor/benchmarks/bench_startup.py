@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Processor startup benchmark
+
+Times importing coredoc and constructing a CoredocProcessor in fresh
+interpreters, which is the cold-start cost paid by the CLI and by every
+new worker. NLTK should not be loaded by either step.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PROCESSOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import coredoc
+imported = time.perf_counter()
+coredoc.CoredocProcessor()
+constructed = time.perf_counter()
+print(imported - start, constructed - imported, 'nltk' in sys.modules)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark coredoc import and processor construction')
+    parser.add_argument('--runs', type=int, default=10)
+    
+    args = parser.parse_args()
+    
+    import_times = []
+    construct_times = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], cwd=PROCESSOR_DIR,
+                                capture_output=True, text=True, check=True).stdout.split()
+        import_times.append(float(output[0]))
+        construct_times.append(float(output[1]))
+        nltk_loaded = output[2] == 'True'
+    
+    print(f"import coredoc:      {statistics.median(import_times) * 1000:8.2f} ms (median of {args.runs})")
+    print(f"CoredocProcessor():  {statistics.median(construct_times) * 1000:8.2f} ms")
+    print(f"NLTK imported:       {'yes' if nltk_loaded else 'no'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Batch TF-IDF keyword benchmark
+
+Compares the per-chunk keyword stages ('reference', 'regex') with the
+batch TF-IDF stages ('tfidf', 'tfidf-regex') on seeded synthetic documents
+with thousands of chunks. For each stage it reports the time taken and
+the share of keyword slots held by terms found in more than half of the
+chunks, which are the terms that say least about any one chunk.
+
+The batch stage is first checked against a plain per-chunk computation of
+the same scores on the example documents and small synthetic ones; the
+script exits with status 1 if they differ.
+
+Usage:
+    python benchmarks/bench_tfidf.py [--sizes 1m 5m] [--repeat 3]
+"""
+
+import argparse
+import copy
+import glob
+import math
+import os
+import sys
+import time
+from collections import Counter
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from coredoc import Chunk, CoredocProcessor, alnum_word_tokenize
+from run_benchmarks import parse_size
+from synthetic import generate_document
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                        'standalone-processor', 'examples', '*.txt')
+
+STAGES = ['reference', 'regex', 'tfidf', 'tfidf-regex']
+
+
+def expected_keywords(processor: CoredocProcessor, chunks: List[Chunk], limit: int = 10) -> List[List]:
+    """TF-IDF keywords of each chunk, computed chunk by chunk in plain Python"""
+    vocabulary = {}
+    names = {}
+    candidates = []
+    for chunk in chunks:
+        lowered = chunk.content.lower()
+        words = []
+        for token in alnum_word_tokenize(lowered):
+            vocabulary.setdefault(token, len(vocabulary))
+            if token.isalnum() and token not in processor.stop_words and len(token) > 3:
+                words.append(token)
+        counts = Counter(words)
+        
+        phrases = processor._extract_noun_phrases(chunk.content)
+        weights = {}
+        for phrase, count in processor._count_phrases(lowered, phrases).items():
+            if count:
+                vocabulary.setdefault(phrase, len(vocabulary))
+                weights[phrase] = count * len(phrase.split())
+        for phrase in phrases:
+            names.setdefault(phrase.lower(), phrase)
+        
+        positions = {}
+        for index, word in enumerate(words):
+            positions.setdefault(word, []).append(index)
+        candidates.append((len(words), counts, weights, positions))
+    
+    document_frequency = Counter()
+    for _, counts, weights, _ in candidates:
+        document_frequency.update(set(counts) | set(weights))
+    
+    results = []
+    for word_count, counts, weights, positions in candidates:
+        scored = [(term, count) for term, count in counts.items() if count > 1]
+        scored += list(weights.items())
+        keywords = []
+        for term, count in scored:
+            idf = math.log((1 + len(chunks)) / (1 + document_frequency[term])) + 1
+            keywords.append((-(count / max(word_count, 1) * idf), vocabulary[term], term))
+        keywords.sort()
+        results.append([(names.get(term, term), -score, positions.get(term, []) if term not in weights else [])
+                        for score, _, term in keywords[:limit]])
+    return results
+
+
+def matches(expected: List[List], chunks: List[Chunk]) -> bool:
+    for keywords, chunk in zip(expected, chunks):
+        if len(keywords) != len(chunk.keywords):
+            return False
+        for (term, score, positions), keyword in zip(keywords, chunk.keywords):
+            if (term != keyword.term or not math.isclose(score, keyword.importance_score, rel_tol=1e-12)
+                    or positions != list(keyword.positions)):
+                return False
+    return True
+
+
+def ubiquitous_share(chunks: List[Chunk]) -> float:
+    """Share of keyword slots held by words found in more than half of the chunks"""
+    document_frequency = Counter()
+    for chunk in chunks:
+        document_frequency.update(set(alnum_word_tokenize(chunk.content.lower())))
+    
+    slots = [keyword.term for chunk in chunks for keyword in chunk.keywords]
+    common = sum(1 for term in slots if document_frequency[term] > len(chunks) / 2)
+    return common / len(slots) if slots else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the batch TF-IDF keyword stages')
+    parser.add_argument('--sizes', type=parse_size, nargs='+', default=[parse_size(s) for s in ('1m', '5m')],
+                        help='Sizes of the synthetic documents')
+    parser.add_argument('--repeat', type=int, default=3)
+    
+    args = parser.parse_args()
+    
+    processors = {stage: CoredocProcessor(stages={'keywords': stage}) for stage in STAGES}
+    batch = processors['tfidf-regex']
+    
+    corpora = []
+    for filename in sorted(glob.glob(EXAMPLES)):
+        with open(filename, 'r', encoding='utf-8') as f:
+            corpora.append(f.read())
+    corpora += [generate_document(20000, 'mixed', density, seed) for seed, density in enumerate([0.05, 0.2, 0.5])]
+    
+    same = True
+    for text in corpora:
+        chunks = batch.pipeline['chunks'](batch.pipeline['sections'](batch.pipeline['clean'](text)))
+        same = same and matches(expected_keywords(batch, chunks), batch.pipeline['keywords'](chunks))
+    print(f"per-chunk check: {'same' if same else 'DIFFERENT'}")
+    
+    print(f"{'size':>9} {'chunks':>7} {'stage':<12} {'seconds':>9} {'ubiquitous':>10} {'links':>7}")
+    for size in args.sizes:
+        text = generate_document(size, 'markdown', 0.1, seed=0)
+        reference = processors['reference']
+        chunks = reference.pipeline['chunks'](reference.pipeline['sections'](reference.pipeline['clean'](text)))
+        
+        for stage in STAGES:
+            processor = processors[stage]
+            best = float('inf')
+            for _ in range(args.repeat):
+                work = copy.deepcopy(chunks)
+                start = time.perf_counter()
+                processor.pipeline['keywords'](work)
+                best = min(best, time.perf_counter() - start)
+            
+            linked = processor.pipeline['links'](work)
+            links = sum(len(chunk.links) for chunk in linked)
+            print(f"{size:>9} {len(chunks):>7} {stage:<12} {best:>9.3f} {ubiquitous_share(work):>10.1%} {links:>7}")
+    
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
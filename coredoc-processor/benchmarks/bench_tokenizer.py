@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Tokenizer backend equivalence check and benchmark
+
+Compares alnum_word_tokenize(), used by the 'regex' keywords stage, with
+the alphanumeric tokens of nltk.word_tokenize() on the example documents,
+on seeded synthetic documents, on a document of punctuation-heavy
+sentences whose sentence breaks Punkt decides from the text around a
+period, and on a document of abbreviations the English Punkt model knows.
+The keywords of every chunk must match as well. Reports the speed of both
+keyword stages and exits with status 1 on any difference.
+
+Run it with the NLTK version and data the processor is deployed with; an
+untrained Punkt model, which knows no abbreviations, is reported.
+
+Usage:
+    python benchmarks/bench_tokenizer.py [--files examples/*.txt] [--sizes 100k 1m] [--repeat 3]
+"""
+
+import argparse
+import copy
+import difflib
+import glob
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from coredoc import Chunk, CoredocProcessor, alnum_word_tokenize, _punkt_model, _word_tokenizer
+from run_benchmarks import parse_size
+from synthetic import HEADING_STYLES, generate_document
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                        'standalone-processor', 'examples', '*.txt')
+
+# Numbers, initials and sentence ends next to punctuation, brackets and quotes
+PUNCTUATION_CASES = [
+    "The report was published in 2024. , and revised later.",
+    "Revenue grew in 2024.; costs fell in 2025.",
+    "See appendix x. , which lists the data.",
+    "Version 2. 5 items changed.",
+    "It ended in 2024.! Then a new phase began.",
+    "Was it 2024.? Nobody remembers.",
+    "Measured at 3.5. ) The next value is lower.",
+    "He said 'stop.' then left.",
+    'She wrote "done." and closed the file.',
+    "(See figure 4.) The results follow.",
+    "Item a. : the first option.",
+    "Results for 2024. - preliminary.",
+    'In 1999. "quoted" text follows.',
+    'The end. " Next quote starts.',
+    "The end. ) trailing bracket.",
+    "Options: a. b. c. and more.",
+    "Values 1. 2. 3. are listed.",
+    "Call at 5 p.m. tomorrow.",
+    "Total: 42. (approx.) the rest.",
+    "Step 3.: configure the model.",
+    "Year 2024.' quoted year.",
+    "Chapter v. ... continued text.",
+    "In 2024. [1] cited work.",
+    "Grade b. ! surprising.",
+]
+
+# Abbreviations, initials and collocations of the English Punkt model, which keep a period attached
+ABBREVIATION_CASES = [
+    "Dr. Smith reviewed the results.",
+    "Several formats, e.g. CSV and JSON, are supported.",
+    "The model, i.e. the trained network, is saved.",
+    "It takes approx. two hours to finish.",
+    "Mr. Jones and Mrs. Jones arrived.",
+    "The music of J. S. Bach was played.",
+    "The meeting is on Jan. 5 at noon.",
+    "Call at 5 p.m. and ask for the office.",
+    "Apples, pears, etc. were sold.",
+    "The U.S. team won the match.",
+    "Room No. 5 is on the left.",
+    "The value rose ... Then it fell.",
+    "See the report by Prof. Lee et al. for details.",
+    "Smith vs. Jones was decided in 1998.",
+    "Founded in the 19th c. in a small town.",
+    "Figures are in Sept. reports.",
+    "St. Louis is a city.",
+    "Ask Dr. smith, not Dr. Brown.",
+    "The etc. Nobody knows.",
+    "Mt. Everest is high.",
+]
+
+
+def case_document(cases: List[str], paragraphs: int = 40, seed: int = 0) -> str:
+    """Sections of shuffled test sentences"""
+    rng = random.Random(seed)
+    sections = []
+    for number in range(paragraphs):
+        sentences = rng.sample(cases, len(cases))
+        sections.append(f"# Section {number + 1}\n\n" + ' '.join(sentences))
+    return '\n\n'.join(sections)
+
+
+def token_differences(text: str, limit: int = 5) -> List[str]:
+    """Describe where the two tokenizers disagree on text"""
+    lowered = text.lower()
+    expected = [token for token in _word_tokenizer()(lowered) if token.isalnum()]
+    actual = alnum_word_tokenize(lowered)
+    
+    differences = []
+    matcher = difflib.SequenceMatcher(None, expected, actual, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            differences.append(f"{tag} at token {i1}: nltk {expected[max(0, i1 - 2):i2 + 2]} "
+                               f"regex {actual[max(0, j1 - 2):j2 + 2]}")
+    return differences[:limit]
+
+
+def time_keywords(processor: CoredocProcessor, chunks: List[Chunk], repeat: int) -> float:
+    """Best time of the processor's keywords stage over copies of chunks"""
+    best = float('inf')
+    for _ in range(repeat):
+        work = copy.deepcopy(chunks)
+        start = time.perf_counter()
+        processor.pipeline['keywords'](work)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the regex tokenizer backend against NLTK')
+    parser.add_argument('--files', nargs='*', default=sorted(glob.glob(EXAMPLES)),
+                        help='Text files to compare (default: the standalone examples)')
+    parser.add_argument('--sizes', type=parse_size, nargs='+', default=[parse_size('100k')],
+                        help='Sizes of the synthetic documents, one per heading style')
+    parser.add_argument('--repeat', type=int, default=3)
+    
+    args = parser.parse_args()
+    
+    corpora = []
+    for filename in args.files:
+        with open(filename, 'r', encoding='utf-8') as f:
+            corpora.append((os.path.basename(filename), f.read()))
+    for size in args.sizes:
+        for style in HEADING_STYLES:
+            corpora.append((f"synthetic-{style}-{size}", generate_document(size, style, 0.1, seed=0)))
+    corpora.append(('punctuation', case_document(PUNCTUATION_CASES)))
+    corpora.append(('abbreviations', case_document(ABBREVIATION_CASES)))
+    
+    params = _punkt_model().params
+    if params.abbrev_types:
+        print(f"Punkt model: {len(params.abbrev_types)} abbreviations, {len(params.collocations)} collocations")
+    else:
+        print("Punkt model: untrained, so abbreviations are not checked; install the NLTK punkt data")
+    
+    reference = CoredocProcessor(stages={'keywords': 'reference'})
+    regex = CoredocProcessor(stages={'keywords': 'regex'})
+    
+    failed = False
+    print(f"{'corpus':<32} {'chunks':>7} {'nltk s':>9} {'regex s':>9} {'speedup':>8}  result")
+    for name, text in corpora:
+        chunks = reference.pipeline['chunks'](reference.pipeline['sections'](reference.pipeline['clean'](text)))
+        
+        differences = token_differences(text)
+        expected = [chunk.keywords for chunk in reference.pipeline['keywords'](copy.deepcopy(chunks))]
+        actual = [chunk.keywords for chunk in regex.pipeline['keywords'](copy.deepcopy(chunks))]
+        same = not differences and expected == actual
+        failed = failed or not same
+        
+        nltk_seconds = time_keywords(reference, chunks, args.repeat)
+        regex_seconds = time_keywords(regex, chunks, args.repeat)
+        print(f"{name:<32} {len(chunks):>7} {nltk_seconds:>9.4f} {regex_seconds:>9.4f} "
+              f"{nltk_seconds / regex_seconds:>7.1f}x  {'same' if same else 'DIFFERENT'}")
+        for line in differences:
+            print(f"    {line}")
+    
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Coredoc pipeline benchmark suite
+
+Runs the CoredocProcessor pipeline stage by stage over seeded synthetic
+documents and records wall time and tracemalloc peak memory for each stage.
+Results are written as JSON so they can be kept as baselines and compared
+later, for example reference stages against alternative implementations.
+
+Usage:
+    python benchmarks/run_benchmarks.py run -o results.json [--sizes 10k 100k 1m]
+                                            [--styles markdown caps] [--densities 0.05 0.2]
+                                            [--stages keywords=reference,links=off]
+    python benchmarks/run_benchmarks.py compare baseline.json results.json [--threshold 0.15]
+
+compare exits with status 1 when any stage is slower or uses more memory
+than the baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from coredoc import CoredocProcessor, collect_document, parse_stage_config
+from synthetic import HEADING_STYLES, generate_document
+
+# Pipeline stages in the order they run; summaries are timed within chunks
+STAGES = ['clean', 'sections', 'chunks', 'duplicates', 'keywords', 'links', 'structure']
+
+# Differences below these are treated as noise by compare
+MIN_SECONDS = 0.005
+MIN_BYTES = 64 * 1024
+
+
+def parse_size(value: str) -> int:
+    """Parse sizes such as 10k, 1m or 2500"""
+    units = {'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def run_stages(processor: CoredocProcessor, text: str, trace_memory: bool) -> Dict:
+    """Run the pipeline once, measuring every stage"""
+    stages = {}
+    value = text
+    # Before Python 3.9 there is no reset_peak(), so only the memory a stage keeps is recorded
+    resets_peak = hasattr(tracemalloc, 'reset_peak')
+    
+    for stage in STAGES:
+        if trace_memory:
+            if resets_peak:
+                tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        
+        start = time.perf_counter()
+        if stage == 'structure':
+            value = collect_document(processor.pipeline[stage](value, 'Benchmark Document'))
+        else:
+            value = processor.pipeline[stage](value)
+        seconds = time.perf_counter() - start
+        
+        stages[stage] = {'seconds': seconds}
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stages[stage]['peak_bytes'] = max((peak if resets_peak else current) - before, 0)
+    
+    stages['_chunk_count'] = len(value['chunks'])
+    return stages
+
+
+def run_case(processor: CoredocProcessor, size: int, style: str, density: float,
+             seed: int, repeat: int) -> Dict:
+    """Benchmark one document: best time of repeat runs, then one traced run for memory"""
+    text = generate_document(size, style, density, seed)
+    
+    timings = [run_stages(processor, text, trace_memory=False) for _ in range(repeat)]
+    
+    tracemalloc.start()
+    try:
+        memory = run_stages(processor, text, trace_memory=True)
+    finally:
+        tracemalloc.stop()
+    
+    stages = {}
+    for stage in STAGES:
+        stages[stage] = {
+            'seconds': min(timing[stage]['seconds'] for timing in timings),
+            'peak_bytes': memory[stage]['peak_bytes'],
+        }
+    
+    return {
+        'case': f"{style}-{size}-d{density}",
+        'size': len(text),
+        'heading_style': style,
+        'keyword_density': density,
+        'chunks': memory['_chunk_count'],
+        'total_seconds': sum(stage['seconds'] for stage in stages.values()),
+        'stages': stages,
+    }
+
+
+def command_run(args):
+    processor = CoredocProcessor(stages=args.stages)
+    
+    results = []
+    for size in args.sizes:
+        for style in args.styles:
+            for density in args.densities:
+                result = run_case(processor, size, style, density, args.seed, args.repeat)
+                results.append(result)
+                print(f"{result['case']:<32} {result['chunks']:>7} chunks {result['total_seconds']:>10.3f} s",
+                      file=sys.stderr)
+    
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'stages': processor.stage_config,
+        },
+        'results': results,
+    }
+    
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    
+    print(f"Results saved to: {args.output}", file=sys.stderr)
+
+
+def compare_reports(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """Describe every stage that regressed by more than threshold"""
+    regressions = []
+    baseline_cases = {result['case']: result for result in baseline['results']}
+    
+    for result in current['results']:
+        base = baseline_cases.get(result['case'])
+        if base is None:
+            continue
+        
+        for stage in STAGES:
+            if stage not in base['stages'] or stage not in result['stages']:
+                continue
+            old, new = base['stages'][stage], result['stages'][stage]
+            
+            for metric, floor in (('seconds', MIN_SECONDS), ('peak_bytes', MIN_BYTES)):
+                if new[metric] - old[metric] > floor and new[metric] > old[metric] * (1 + threshold):
+                    ratio = new[metric] / old[metric] if old[metric] else float('inf')
+                    regressions.append(f"{result['case']} {stage} {metric}: "
+                                       f"{old[metric]:.4g} -> {new[metric]:.4g} ({ratio:.2f}x)")
+    
+    return regressions
+
+
+def command_compare(args):
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+    
+    regressions = compare_reports(baseline, current, args.threshold)
+    
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    
+    if regressions:
+        sys.exit(1)
+    print("No regressions found.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Coredoc pipeline stage by stage')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    run_parser = subparsers.add_parser('run', help='Run the benchmark suite')
+    run_parser.add_argument('-o', '--output', default='benchmark-results.json', help='Results JSON file path')
+    run_parser.add_argument('--sizes', type=parse_size, nargs='+', default=[parse_size(s) for s in ('10k', '100k', '1m')],
+                            help='Document sizes in characters, e.g. 10k 1m 100m')
+    run_parser.add_argument('--styles', nargs='+', choices=HEADING_STYLES, default=HEADING_STYLES)
+    run_parser.add_argument('--densities', type=float, nargs='+', default=[0.05, 0.2],
+                            help='Share of words drawn from the shared topic vocabulary')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case; the fastest is kept')
+    run_parser.add_argument('--stages', type=parse_stage_config, default={},
+                            help='Stage implementations to benchmark, e.g. keywords=reference,links=off')
+    run_parser.set_defaults(handler=command_run)
+    
+    compare_parser = subparsers.add_parser('compare', help='Compare results against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.15,
+                                help='Allowed relative slowdown or memory growth per stage')
+    compare_parser.set_defaults(handler=command_compare)
+    
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
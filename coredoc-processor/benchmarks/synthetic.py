@@ -0,0 +1,91 @@
+"""
+Seeded synthetic documents for the Coredoc benchmarks
+
+generate_document() builds reproducible text of a requested size with a
+chosen heading style and keyword density, so benchmark runs on different
+machines and commits process exactly the same input.
+"""
+
+import random
+import string
+from typing import List
+
+HEADING_STYLES = ['markdown', 'caps', 'numbered', 'roman', 'mixed']
+
+ROMAN_NUMERALS = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X']
+
+
+def _make_vocabulary(rng: random.Random, size: int, min_length: int, max_length: int) -> List[str]:
+    return [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(min_length, max_length)))
+            for _ in range(size)]
+
+
+def _heading(rng: random.Random, style: str, index: int, topic: List[str]) -> str:
+    """Heading line for section number index in the given style"""
+    if style == 'mixed':
+        style = rng.choice(HEADING_STYLES[:-1])
+    
+    title = ' '.join(rng.choice(topic) for _ in range(rng.randint(1, 3)))
+    
+    if style == 'markdown':
+        return '#' * rng.randint(1, 3) + ' ' + title.capitalize()
+    if style == 'caps':
+        return title.upper()
+    if style == 'numbered':
+        return f"{index + 1}. {title.capitalize()}"
+    return f"{ROMAN_NUMERALS[index % len(ROMAN_NUMERALS)]}. {title.capitalize()}"
+
+
+def generate_document(size: int, heading_style: str = 'markdown', keyword_density: float = 0.1,
+                      seed: int = 0, section_size: int = 3000) -> str:
+    """Generate about size characters of text.
+    
+    keyword_density is the share of words drawn from a small topic
+    vocabulary shared by all sections, which is what creates keyword links.
+    The rest comes from a large filler vocabulary. Sections of roughly
+    section_size characters are introduced by headings in heading_style.
+    """
+    if heading_style not in HEADING_STYLES:
+        raise ValueError(f"Unknown heading style: {heading_style}")
+    
+    rng = random.Random(seed)
+    topic = _make_vocabulary(rng, 40, 5, 10)
+    filler = _make_vocabulary(rng, 5000, 2, 9)
+    phrases = [f"{rng.choice(topic).capitalize()} {rng.choice(topic).capitalize()}" for _ in range(20)]
+    
+    parts = []
+    length = 0
+    section = 0
+    
+    while length < size:
+        heading = _heading(rng, heading_style, section, topic)
+        parts.append(heading + '\n\n')
+        length += len(heading) + 2
+        section += 1
+        
+        section_end = min(size, length + section_size)
+        while length < section_end:
+            sentence = []
+            for _ in range(rng.randint(6, 20)):
+                roll = rng.random()
+                if roll < keyword_density:
+                    sentence.append(rng.choice(topic))
+                elif roll < keyword_density * 1.2:
+                    sentence.append(rng.choice(phrases))
+                else:
+                    sentence.append(rng.choice(filler))
+            # Only the first letter is raised, keeping capitalized phrases intact
+            sentence[0] = sentence[0][:1].upper() + sentence[0][1:]
+            text = ' '.join(sentence) + '. '
+            parts.append(text)
+            length += len(text)
+            
+            # Paragraph breaks
+            if rng.random() < 0.15:
+                parts.append('\n\n')
+                length += 2
+        
+        parts.append('\n\n')
+        length += 2
+    
+    return ''.join(parts)
@@ -4,122 +4,1306 @@ Coredoc Document Processor
 
 This script implements the Coredoc algorithm to transform linear documents
 into hierarchical, interconnected knowledge graphs.
+
+It is also the processing engine shared by worker.py and the standalone
+folder processor. A document passes through the stages in PIPELINE_STAGES,
+and each stage can be swapped for another registered implementation, or
+turned off where that makes sense, per processor or through COREDOC_STAGES.
 """
 
+import codecs
+import gzip
+import heapq
+import io
 import json
+import math
+import mmap
 import re
 import hashlib
-from typing import List, Dict, Tuple, Optional, Set
+import os
+import signal
+import sys
+import time
+import tracemalloc
+from array import array
+from typing import List, Dict, Tuple, Optional, Set, Iterable, Iterator, Callable, NamedTuple
 from collections import defaultdict
-import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords
+from collections.abc import Sequence
+from contextlib import contextmanager, nullcontext
+from itertools import chain, count
+from functools import lru_cache, partial
+from operator import itemgetter
 import argparse
 
-# Download required NLTK data
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+# Characters of input held at once by the streaming pipeline
+DEFAULT_STREAM_WINDOW = 1 << 20
+
+# With COREDOC_OFFLINE=1 missing NLTK data is an error instead of a download
+OFFLINE = os.environ.get('COREDOC_OFFLINE', '') not in ('', '0')
+
+# Stages a document passes through, in order. Summaries are made while
+# chunking, one call per chunk, and are timed as part of 'chunks'.
+PIPELINE_STAGES = ('clean', 'sections', 'chunks', 'summaries', 'duplicates', 'keywords', 'links', 'structure')
+
+# Stages that a document can do without. Once a processor's time budget is
+# spent they are cut short or skipped, so a document degrades instead of
+# holding its worker.
+OPTIONAL_STAGES = ('duplicates', 'keywords', 'links')
+
+# Seconds between progress events within a stage
+PROGRESS_INTERVAL = 0.1
+
+# Stage name -> implementation name -> function(processor, stage input)
+_STAGE_IMPLEMENTATIONS = {stage: {} for stage in PIPELINE_STAGES}
+
+# Stages that run another implementation than 'reference' unless configured
+DEFAULT_IMPLEMENTATIONS = {'duplicates': 'off'}
+
+
+def register_stage(stage: str, name: str):
+    """Decorator registering a function as an implementation of a pipeline stage.
+    
+    The function is called with the processor followed by the stage input,
+    in the same way as the reference method it replaces:
+    
+        clean(text) -> text                sections(text) -> sections
+        chunks(sections) -> chunks         summaries(first_sentence) -> summary
+        duplicates(chunks) -> chunks       keywords(chunks) -> chunks
+        links(chunks) -> chunks            structure(chunks, title) -> header record, then chunk records
+    
+    Chunks are lists of Chunk objects; duplicates may drop chunks, keywords
+    fills in each chunk's keywords and links its links.
+    """
+    if stage not in _STAGE_IMPLEMENTATIONS:
+        raise ValueError(f"Unknown pipeline stage: {stage}")
+    
+    def register(function: Callable) -> Callable:
+        _STAGE_IMPLEMENTATIONS[stage][name] = function
+        return function
+    
+    return register
+
+
+def stage_implementations(stage: str) -> List[str]:
+    """Names of the registered implementations of a stage"""
+    return sorted(_STAGE_IMPLEMENTATIONS[stage])
+
+
+def parse_stage_config(spec: str) -> Dict[str, str]:
+    """Parse a stage selection such as 'keywords=fast,links=off'"""
+    config = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        stage, separator, name = item.partition('=')
+        if not separator or not name.strip():
+            raise ValueError(f"Invalid stage setting '{item}', expected STAGE=IMPLEMENTATION")
+        config[stage.strip()] = name.strip()
+    return config
+
+
+def _fixed_clock() -> str:
+    return '2024-01-01T00:00:00Z'
+
+# NLTK's English stopword list, frozen so processors never read it from disk
+ENGLISH_STOP_WORDS = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your yours
+yourself yourselves he him his himself she she's her hers herself it it's its
+itself they them their theirs themselves what which who whom this that that'll
+these those am is are was were be been being have has had having do does did
+doing a an the and but if or because as until while of at by for with about
+against between into through during before after above below to from up down
+in out on off over under again further then once here there when where why how
+all any both each few more most other some such no nor not only own same so
+than too very s t can will just don don't should should've now d ll m o re ve
+y ain aren aren't couldn couldn't didn didn't doesn doesn't hadn hadn't hasn
+hasn't haven haven't isn isn't ma mightn mightn't mustn mustn't needn needn't
+shan shan't shouldn shouldn't wasn wasn't weren weren't won won't wouldn
+wouldn't
+""".split())
+
+
+def _require_nltk_data(resource: str, package: str):
+    """Make sure an NLTK data package is installed, downloading it unless offline"""
+    import nltk
+    
+    try:
+        nltk.data.find(resource)
+    except LookupError:
+        if OFFLINE:
+            raise LookupError(f"NLTK data '{package}' is not installed and offline mode is on. "
+                              f"Install it with: python -m nltk.downloader {package}") from None
+        print(f"Downloading NLTK {package}...", file=sys.stderr)
+        nltk.download(package, quiet=True)
+
+
+@lru_cache(maxsize=None)
+def _sentence_tokenizer():
+    """The Punkt tokenizer used by nltk.sent_tokenize(), loaded on first use"""
+    try:
+        from nltk.tokenize import PunktTokenizer
+    except ImportError:
+        # NLTK before 3.8.2 ships pickled Punkt models
+        import nltk
+        _require_nltk_data('tokenizers/punkt', 'punkt')
+        return nltk.data.load('tokenizers/punkt/english.pickle')
+    
+    _require_nltk_data('tokenizers/punkt_tab', 'punkt_tab')
+    return PunktTokenizer('english')
+
+
+@lru_cache(maxsize=None)
+def _word_tokenizer():
+    """nltk.word_tokenize(), imported on first use"""
+    # Word tokenization splits sentences with Punkt first
+    _sentence_tokenizer()
+    
+    from nltk.tokenize import word_tokenize
+    return word_tokenize
+
+
+@lru_cache(maxsize=None)
+def _numpy_backend():
+    """numpy, which only the minhash duplicates stage and MinHashIndex need"""
+    try:
+        import numpy
+    except ImportError as error:
+        raise ImportError(f"MinHash duplicate detection needs numpy ({error}). "
+                          f"Install it with: pip install numpy") from None
+    return numpy
+
+
+@lru_cache(maxsize=None)
+def _sparse_backend():
+    """numpy and scipy.sparse, which only the batch keyword stages need"""
+    try:
+        import numpy
+        import scipy.sparse
+    except ImportError as error:
+        raise ImportError(f"The tfidf keyword stages need numpy and scipy ({error}). "
+                          f"Install them with: pip install numpy scipy") from None
+    return numpy, scipy.sparse
+
+
+@lru_cache(maxsize=None)
+def _msgpack_backend():
+    """msgpack, which only the msgpack output format needs"""
+    try:
+        import msgpack
+    except ImportError as error:
+        raise ImportError(f"The msgpack format needs msgpack ({error}). "
+                          f"Install it with: pip install msgpack") from None
+    return msgpack
+
+
+@lru_cache(maxsize=None)
+def _zstd_backend():
+    """zstandard, which only zstd compression needs"""
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError(f"zstd compression needs zstandard ({error}). "
+                          f"Install it with: pip install zstandard") from None
+    return zstandard
+
+
+# Characters nltk.word_tokenize() always splits off as tokens of their own:
+# those split off before its rules look at the character after a quote, the
+# dashes split off with them since NLTK 3.8.2, and those split off later
+_EARLY_SEPARATORS = '«“‘„`;@#$%&?!'
+_WORD_DASHES = '\u2012\u2013\u2014\u2015'
+_LATE_SEPARATORS = '»”’"*()[]{}<>'
+
+# Words nltk.word_tokenize() splits into two short tokens, such as 'can' 'not'
+_SPLIT_WORDS = frozenset(['cannot', 'gimme', 'gonna', 'gotta', 'lemme', 'wanna'])
+
+# Tokens Punkt treats apart when deciding a sentence break: numbers and
+# initials, punctuation, which never starts a sentence, and ellipses
+_PUNKT_NUMBER = re.compile(r'^-?[\.,]?\d[\d,\.-]*\.?$')
+_PUNKT_INITIAL = re.compile(r'^[^\W\d]\.$')
+_PUNKT_PUNCTUATION = frozenset(';:,.!?')
+_PUNKT_ELLIPSIS = re.compile(r'\.\.+$')
+
+# The case a Punkt model has seen a word type in, as nltk.tokenize.punkt stores it
+_ORTHO_MID_UC = 1 << 2
+_ORTHO_BEG_LC = 1 << 4
+_ORTHO_UC = (1 << 1) + (1 << 2) + (1 << 3)
+_ORTHO_LC = (1 << 4) + (1 << 5) + (1 << 6)
+
+# Periods whose sentence end depends on the text around them, for any word
+_PERIOD_CONTEXT = re.compile(r'\.(?:\s+["\')\]}«»“”‘’]|[«»“”‘’„`";@#$%&?!*()\[\]{}<>\u2012-\u2015])')
+
+_SPACE = re.compile(r'\s*')
+_NON_SPACE = re.compile(r'\S*')
+
+# Periods in a word that may end a sentence: at its end, or before a quote or colon
+_SENTENCE_PERIODS = re.compile(r"\.(?=[':]|$)")
+_FINAL_PERIOD = re.compile(r"([^.])\.$")
+
+# What may follow the final period of a sentence for the word tokenizer to
+# split it off, unless a double quote after a space turns into an opening quote
+_FINAL_CLOSERS = re.compile(r"[\])}>\"'»”’ ]*\s*")
+_OPENING_QUOTE = re.compile(r" (?:\"|'')")
+
+# The punctuation rules of NLTK's word tokenizer that apply within a run of
+# non-space, non-separator characters; its rules for quotes and contractions
+# are taken as they are, since they changed between NLTK versions
+_WORD_PUNCTUATION_RULES = [(re.compile(pattern), replacement) for pattern, replacement in [
+    (r"([:,])([^\d])", r" \1 \2"),
+    (r"([:,])$", r" \1 "),
+    (r"\.{2,}", r" \g<0> "),
+    (r"([^'])' ", r"\1 ' "),
+    (r"--", r" -- "),
+]]
+
+# Words without a match here have nothing for the word rules to split
+_WORD_RULE_TRIGGER = re.compile(r"(?i)['.:,]|--|\b(?:cannot|d'ye|gimme|gonna|gotta|lemme|more'n|wanna)\b")
+
+
+class _PunktModel(NamedTuple):
+    """A Punkt model, and the patterns of the installed NLTK it finds sentence ends with"""
+    params: object
+    collocation_starts: Set[str]
+    tokens: re.Pattern
+    non_word: re.Pattern
+    later_end: re.Pattern
+    realigned: re.Pattern
+
+
+class _WordRules(NamedTuple):
+    """The separators and rules of the installed NLTK's word tokenizer"""
+    separators: Dict[int, str]
+    early_separators: str
+    rules: List[Tuple[re.Pattern, str]]
+    ending_rules: List[Tuple[re.Pattern, str]]
+
+
+@lru_cache(maxsize=None)
+def _punkt_model() -> _PunktModel:
+    """The Punkt model of nltk.word_tokenize(), loaded on first use"""
+    tokenizer = _sentence_tokenizer()
+    params, language = tokenizer._params, tokenizer._lang_vars
+    return _PunktModel(
+        params=params,
+        collocation_starts=frozenset(first for first, _ in params.collocations),
+        tokens=language._word_tokenizer_re(),
+        non_word=re.compile(language._re_non_word_chars),
+        # A later potential sentence end in the same run of non-space characters
+        later_end=re.compile(rf'\S*?{language._re_sent_end_chars}(?:{language._re_non_word_chars}|\s+\S)'),
+        # Closing brackets and quotes moved from the start of a sentence to the previous one
+        realigned=language.re_boundary_realignment
+    )
+
+
+@lru_cache(maxsize=None)
+def _word_rules() -> _WordRules:
+    """The word tokenizer rules of the installed NLTK.
+    
+    NLTK 3.8.2 changed the rule for a quote before a word, splits off
+    dashes, and turns all whitespace into spaces before the rules for
+    closing quotes and contractions, which before only matched a space.
+    """
+    from nltk.tokenize import NLTKWordTokenizer
+    tokenizer = NLTKWordTokenizer()
+    dashes = _WORD_DASHES if len(tokenizer.tokenize('a\u2014b')) == 3 else ''
+    contractions = [(pattern, r' \1 \2 ') for pattern in tokenizer.CONTRACTIONS2 + tokenizer.CONTRACTIONS3]
+    return _WordRules(
+        separators=str.maketrans(dict.fromkeys(_EARLY_SEPARATORS + dashes + _LATE_SEPARATORS, ' ')),
+        early_separators=_EARLY_SEPARATORS + dashes,
+        rules=tokenizer.STARTING_QUOTES + _WORD_PUNCTUATION_RULES,
+        ending_rules=tokenizer.ENDING_QUOTES + contractions
+    )
+
+
+def _punkt_type(token: str) -> str:
+    """Punkt's word type of a token: lowercased, with every number alike"""
+    lowered = token.lower()
+    return '##number##' if _PUNKT_NUMBER.match(lowered) else lowered
+
+
+def _punkt_first_pass(token: str, abbreviations: Set[str]) -> Tuple[bool, bool]:
+    """(sentence break, abbreviation) as Punkt marks a token on its own"""
+    if token in ('.', '?', '!'):
+        return True, False
+    if not token.endswith('.') or token.endswith('..') or _PUNKT_ELLIPSIS.match(token):
+        return False, False
+    body = token[:-1].lower()
+    if body in abbreviations or body.split('-')[-1] in abbreviations:
+        return False, True
+    return True, False
+
 
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
+def _punkt_sentence_starter(token: str, ortho: int) -> Optional[bool]:
+    """Punkt's orthographic evidence on whether a token starts a sentence, None if unsure"""
+    if token in _PUNKT_PUNCTUATION:
+        return False
+    if token[0].isupper() and ortho & _ORTHO_LC and not ortho & _ORTHO_MID_UC:
+        return True
+    if token[0].islower() and (ortho & _ORTHO_UC or not ortho & _ORTHO_BEG_LC):
+        return False
+    return None
+
+
+def _punkt_sentence_break(tokens: List[str], index: int) -> bool:
+    """Whether Punkt marks tokens[index] as a sentence break.
+    
+    Follows both annotation passes of nltk.tokenize.punkt with the model
+    nltk.word_tokenize() uses: its abbreviations, collocations, frequent
+    sentence starters and the case each word type was seen in.
+    """
+    params = _punkt_model().params
+    token = tokens[index]
+    sentence_break, abbreviation = _punkt_first_pass(token, params.abbrev_types)
+    if not token.endswith('.') or index + 1 == len(tokens):
+        return sentence_break
+    
+    following = tokens[index + 1]
+    token_type = _punkt_type(token)
+    if len(token_type) > 1 and token_type.endswith('.'):
+        token_type = token_type[:-1]
+    following_type = _punkt_type(following)
+    if len(following_type) > 1 and following_type.endswith('.') and _punkt_first_pass(following, params.abbrev_types)[0]:
+        following_type = following_type[:-1]
+    
+    if (token_type, following_type) in params.collocations:
+        return False
+    
+    initial = _PUNKT_INITIAL.match(token) is not None
+    ortho = params.ortho_context.get(following_type, 0)
+    starter = _punkt_sentence_starter(following, ortho)
+    if (abbreviation or _PUNKT_ELLIPSIS.match(token)) and not initial:
+        if starter or (following[0].isupper() and following_type in params.sent_starters):
+            return True
+    
+    if initial or token_type == '##number##':
+        if starter is False:
+            return False
+        if starter is None and initial and following[0].isupper() and not ortho & _ORTHO_LC:
+            return False
+    return sentence_break
+
+
+def _final_period_split(text: str, end: int, stop: int) -> bool:
+    """Whether the word tokenizer splits off the period before text[end] of a sentence ending at stop"""
+    return _FINAL_CLOSERS.match(text, end, stop).end() == stop and not _OPENING_QUOTE.search(text, end, stop)
+
+
+def _punkt_period_split(text: str, end: int) -> bool:
+    """Whether nltk.word_tokenize() splits off the period before text[end].
+    
+    Mirrors how Punkt decides a sentence break there: the non-space run up
+    to the period and what follows it, either one punctuation character or
+    whitespace and the next run, are split into Punkt tokens, and a break
+    at any but the last of them ends the sentence at the period. The word
+    tokenizer then splits off the sentence's final period, unless closing
+    brackets or quotes moved back from the next sentence keep it attached.
+    Without a break, the period is only split off at the end of the text.
+    """
+    punkt = _punkt_model()
+    if _final_period_split(text, end, len(text)):
+        return True
+    following = _SPACE.match(text, end).end()
+    if following == end:
+        # Punkt only considers the last potential sentence end of a run
+        if not punkt.non_word.match(text, end) or punkt.later_end.match(text, end):
+            return False
+        after = text[end]
+    else:
+        after = text[end:following] + _NON_SPACE.match(text, following).group()
+    
+    start = end - 1
+    while start and not text[start - 1].isspace():
+        start -= 1
+    tokens = punkt.tokens.findall(text[start:end] + after)
+    if not any(_punkt_sentence_break(tokens, index) for index in range(len(tokens) - 1)):
+        return False
+    
+    realigned = punkt.realigned.match(text, following)
+    return not realigned or _final_period_split(text, end, realigned.end())
+
+
+def _word_rule_tokens(word: str, rules: _WordRules, following: str = ' ') -> List[str]:
+    """The alphanumeric tokens NLTK's word tokenizer rules split a word into.
+    
+    following is the character after the word, or '' at the end of the
+    sentence, which the rules for quotes look at.
+    """
+    if not _WORD_RULE_TRIGGER.search(word):
+        return [token for token in word.split() if token.isalnum()]
+    
+    if following and following in rules.early_separators:
+        following = ' '
+    padded = f" {word}{following}"
+    for pattern, replacement in rules.rules:
+        padded = pattern.sub(replacement, padded)
+    # Then the other separators and the sentence are padded with spaces
+    padded = padded.translate(rules.separators) + ' '
+    for pattern, replacement in rules.ending_rules:
+        padded = pattern.sub(replacement, padded)
+    return [token for token in padded.split() if token.isalnum()]
+
+
+def alnum_word_tokenize(text: str) -> List[str]:
+    """The alphanumeric tokens nltk.word_tokenize() finds in text, without calling it.
+    
+    Punctuation tokens, and tokens with punctuation inside them, are left
+    out, since keyword extraction discards them. Runs of non-space
+    characters are split like NLTK's word tokenizer does; only the rare runs
+    containing punctuation go through its rules. A word before a period is
+    split off where Punkt ends a sentence, decided with the same English
+    model, so abbreviations such as 'e.g.' and 'Dr.' and initials as in
+    'J. S. Bach' stay whole like they do in NLTK.
+    """
+    punkt = _punkt_model()
+    abbreviations = punkt.params.abbrev_types
+    rules = _word_rules()
+    spaced = text.translate(rules.separators)
+    words = spaced.split()
+    tokens = []
+    cursor = 0
+    context_periods = _PERIOD_CONTEXT.search(text) is not None
+    
+    for word in words:
+        if word.isalnum() and word not in _SPLIT_WORDS:
+            tokens.append(word)
+            continue
+        
+        body = word[:-1]
+        split_body = body.isalnum() and body not in _SPLIT_WORDS
+        if split_body and word[-1] in ',:':
+            tokens.append(body)
+            continue
+        
+        periods = [period.end() for period in _SENTENCE_PERIODS.finditer(word)]
+        check_periods = bool(periods) and (
+            context_periods or len(periods) > 1 or periods[0] < len(word) or not split_body
+            or _PUNKT_NUMBER.match(word) or _PUNKT_INITIAL.match(word)
+            or body.lower() in abbreviations or body.lower() in punkt.collocation_starts)
+        # Some rules for closing quotes only match before a space, not other whitespace
+        check_following = "'" in word
+        following = ' '
+        if check_periods or check_following:
+            # Find the word as a whole; identical words before it were found already
+            start = spaced.find(word, cursor)
+            while not ((start == 0 or spaced[start - 1].isspace())
+                       and (start + len(word) == len(spaced) or spaced[start + len(word)].isspace())):
+                start = spaced.find(word, start + 1)
+            cursor = start + len(word)
+            following = text[cursor] if _SPACE.match(text, cursor).end() < len(text) else ''
+        
+        if check_periods:
+            # Look at the raw text after each period, which may start with a separator
+            periods = [end for end in periods if _punkt_period_split(text, start + end)]
+        
+        if split_body and periods:
+            tokens.append(body)
+            continue
+        
+        # Otherwise apply the tokenizer rules to this word, or to the sentences it is split into
+        sentence_start = 0
+        for end in periods:
+            tokens.extend(_word_rule_tokens(_FINAL_PERIOD.sub(r'\1 .', word[sentence_start:end]), rules))
+            sentence_start = end
+        tokens.extend(_word_rule_tokens(word[sentence_start:], rules, following))
+    
+    return tokens
+
+
+class ProcessingStats:
+    """Per-stage timings and pipeline counters of one processed document"""
+    
+    def __init__(self):
+        self.stages = {}
+        self.counters = defaultdict(int)
+    
+    @contextmanager
+    def stage(self, name: str):
+        """Measure a stage; a stage entered several times accumulates"""
+        tracing = tracemalloc.is_tracing()
+        # tracemalloc.reset_peak() needs Python 3.9; before that only the memory a stage keeps is known
+        resets_peak = hasattr(tracemalloc, 'reset_peak')
+        if tracing:
+            if resets_peak:
+                tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_bytes': 0})
+            stage['wall_seconds'] += time.perf_counter() - wall_start
+            stage['cpu_seconds'] += time.process_time() - cpu_start
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = (peak if resets_peak else current) - memory_before
+                stage['peak_bytes'] = max(stage['peak_bytes'], peak)
+    
+    def as_dict(self) -> Dict:
+        return {
+            'total_wall_seconds': sum(stage['wall_seconds'] for stage in self.stages.values()),
+            'stages': {name: dict(stage) for name, stage in self.stages.items()},
+            'counters': dict(self.counters)
+        }
+    
+    def to_prometheus(self, labels: Optional[Dict[str, str]] = None) -> str:
+        """Render the stats in the Prometheus text exposition format"""
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        base = ''.join(f'{key}="{escape(value)}",' for key, value in (labels or {}).items())
+        lines = []
+        
+        metrics = [
+            ('wall_seconds', 'coredoc_stage_wall_seconds', 'Wall time spent in each pipeline stage'),
+            ('cpu_seconds', 'coredoc_stage_cpu_seconds', 'CPU time spent in each pipeline stage'),
+            ('peak_bytes', 'coredoc_stage_peak_bytes', 'Peak traced memory allocated by each pipeline stage'),
+        ]
+        for key, metric, description in metrics:
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} gauge")
+            for name, stage in self.stages.items():
+                lines.append(f'{metric}{{{base}stage="{name}"}} {stage[key]}')
+        
+        lines.append("# HELP coredoc_pipeline_items Items handled by the pipeline, such as chunks or links")
+        lines.append("# TYPE coredoc_pipeline_items gauge")
+        for name, value in self.counters.items():
+            lines.append(f'coredoc_pipeline_items{{{base}item="{name}"}} {value}')
+        
+        return '\n'.join(lines) + '\n'
+
+
+class ProcessingCancelled(Exception):
+    """Raised at the next checkpoint of a document whose processor was cancelled"""
+
+
+class ProgressEvent(NamedTuple):
+    """Progress of a document: done of total items of a stage, and the
+    fraction of the whole document finished. total is None where the
+    number of items is not known in advance."""
+    stage: str
+    done: int
+    total: Optional[int]
+    fraction: float
+    
+    def to_dict(self) -> Dict:
+        return {'stage': self.stage, 'done': self.done, 'total': self.total, 'fraction': round(self.fraction, 4)}
+
+
+class Keyword(NamedTuple):
+    """A keyword of a chunk; positions index the chunk's filtered words"""
+    term: str
+    importance_score: float
+    positions: array
+
+
+class Link(NamedTuple):
+    """An embedded link to the chunk at index target of the document.
+    
+    anchors holds the start and end offsets of each occurrence of the
+    keyword in the chunk content, flattened into one array.
+    """
+    keyword: str
+    target: int
+    anchors: array
+
+
+class Duplicate(NamedTuple):
+    """A near-duplicate chunk collapsed into the chunk that holds this record.
+    
+    parent is the index of the parent the copy had, and similarity the
+    estimated Jaccard similarity of their word shingles.
+    """
+    title: str
+    parent: Optional[int]
+    similarity: float
+
+
+class Chunk:
+    """A chunk of a document as it moves through the pipeline.
+    
+    Chunks refer to each other by their index in the document's chunk list,
+    and keyword terms are interned, so a document costs little more than
+    its text. The structure stage converts chunks to the output shape.
+    duplicates lists the near-duplicate copies collapsed into this chunk.
+    
+    The text of a chunk is source[start:end]. By default a chunk owns its
+    source; chunks from the 'offsets' chunks stage share the document's
+    normalized text instead, and content is sliced only when it is read.
+    """
+    __slots__ = ('title', 'source', 'start', 'end', 'level', 'parent', 'summary', 'keywords', 'links',
+                 'duplicates')
+    
+    def __init__(self, title: str, source: str, level: int = 0, parent: Optional[int] = None,
+                 summary: Optional[str] = None, start: int = 0, end: Optional[int] = None):
+        self.title = title
+        self.source = source
+        self.start = start
+        self.end = len(source) if end is None else end
+        self.level = level
+        self.parent = parent
+        self.summary = summary
+        self.keywords = ()
+        self.links = ()
+        self.duplicates = ()
+    
+    @property
+    def content(self) -> str:
+        return self.source[self.start:self.end]
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton that finds many phrases in one pass over a text"""
+    
+    def __init__(self, phrases: Iterable[str]):
+        self.phrases = list(dict.fromkeys(phrases))
+        
+        # Trie of phrase characters; state 0 is the root
+        self._goto = [{}]
+        self._output = [[]]
+        for index, phrase in enumerate(self.phrases):
+            state = 0
+            for char in phrase:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(index)
+        
+        # Failure links, built breadth first
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+                queue.append(next_state)
+    
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield (end offset, phrase index) of every occurrence, overlaps included"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                yield end, index
+    
+    def count(self, text: str) -> Dict[str, int]:
+        """Count non-overlapping occurrences of each phrase, like str.count()"""
+        counts = [0] * len(self.phrases)
+        free_from = [0] * len(self.phrases)
+        
+        for end, index in self.iter_matches(text):
+            if end - len(self.phrases[index]) >= free_from[index]:
+                counts[index] += 1
+                free_from[index] = end
+        
+        return dict(zip(self.phrases, counts))
 
 
 class CoredocProcessor:
-    def __init__(self, min_chunk_size: int = 500, max_chunk_size: int = 2000):
+    # Common heading patterns in priority order, one per normalized line.
+    # Each style's named group captures the heading title.
+    HEADING_SCANNER = re.compile(r'''
+        ^(?:
+            \#{1,6}\ +(?P<markdown>.+)
+          | (?P<caps>[A-Z][A-Z\ ]+)
+          | (?P<numbered>\d+\.?\ +.+)
+          | (?P<roman>[IVX]+\.\ +.+)
+        )$
+    ''', re.MULTILINE | re.VERBOSE)
+    
+    # Whitespace within lines, spaces at line edges, and runs of blank lines
+    INLINE_SPACE = re.compile(r'[^\S\n]+')
+    LINE_EDGE_SPACE = re.compile(r' ?\n ?')
+    BLANK_LINES = re.compile(r'\n{3,}')
+    
+    # A line holding nothing but whitespace, with the line break before it,
+    # and one at the start or end of the text with its line break, if any
+    EMPTY_LINE = re.compile(r'\n[^\S\n]*(?=\n)')
+    EDGE_EMPTY_LINE = re.compile(r'[^\S\n]*(?:\n|\Z)')
+    
+    # Above this many distinct phrases per chunk, one automaton pass beats str.count()
+    PHRASE_MATCHER_THRESHOLD = 32
+    
+    def __init__(self, min_chunk_size: int = 500, max_chunk_size: int = 2000,
+                 stop_words: Optional[Iterable[str]] = None, profile: bool = False,
+                 on_stats: Optional[Callable[[ProcessingStats], None]] = None,
+                 stages: Optional[Dict[str, str]] = None,
+                 clock: Callable[[], str] = _fixed_clock,
+                 duplicate_threshold: float = 0.9,
+                 on_progress: Optional[Callable[[ProgressEvent], None]] = None,
+                 time_budget: Optional[float] = None):
+        """Create a processor.
+        
+        stages maps stage names to registered implementation names, on top
+        of any selection in the COREDOC_STAGES environment variable; every
+        other stage runs its 'reference' implementation, or the one named in
+        DEFAULT_IMPLEMENTATIONS. clock returns the created_at timestamp of
+        each document. duplicate_threshold is the estimated similarity above
+        which the 'minhash' duplicates stage collapses two chunks.
+        
+        With profile set, or an on_stats callback given, every document is
+        measured stage by stage. Its stats are added to the document metadata
+        as 'processing_stats', kept in last_stats and passed to on_stats.
+        
+        on_progress is called with a ProgressEvent as each stage starts and
+        then at most every PROGRESS_INTERVAL seconds. With a time_budget in
+        seconds, the OPTIONAL_STAGES of a document are cut short or skipped
+        once it is spent, and the document metadata lists them under
+        'degraded_stages'. The required stages (cleaning, sections, chunks,
+        summaries and structure) always run to the end, so the budget does
+        not bound the total time; a large document can take well over it.
+        cancel() stops the current document instead.
+        """
         self.min_chunk_size = min_chunk_size
         self.max_chunk_size = max_chunk_size
-        self.stop_words = set(stopwords.words('english'))
+        self.stop_words = ENGLISH_STOP_WORDS if stop_words is None else frozenset(stop_words)
+        self.clock = clock
+        if not 0 < duplicate_threshold <= 1:
+            raise ValueError(f"Duplicate threshold must be in (0, 1], got {duplicate_threshold}")
+        self.duplicate_threshold = duplicate_threshold
+        self.profile = profile or on_stats is not None
+        self.on_stats = on_stats
+        self.last_stats = None
+        self._stats = None
+        self._started_tracing = False
+        self.on_progress = on_progress
+        self.time_budget = time_budget
+        self._cancelled = False
+        self._deadline = None
+        self._degraded = []
+        self._progress_stages = ()
+        self._progress_stage = None
+        self._next_progress = 0.0
         
+        config = parse_stage_config(os.environ.get('COREDOC_STAGES', ''))
+        config.update(stages or {})
+        unknown = set(config) - set(PIPELINE_STAGES)
+        if unknown:
+            raise ValueError(f"Unknown pipeline stage: {', '.join(sorted(unknown))}")
+        
+        # Implementation name of every stage, and the stage functions bound to this processor
+        self.stage_config = {stage: config.get(stage, DEFAULT_IMPLEMENTATIONS.get(stage, 'reference'))
+                             for stage in PIPELINE_STAGES}
+        self.pipeline = {stage: partial(self._stage_implementation(stage, name), self)
+                         for stage, name in self.stage_config.items()}
+    
+    @staticmethod
+    def _stage_implementation(stage: str, name: str) -> Callable:
+        try:
+            return _STAGE_IMPLEMENTATIONS[stage][name]
+        except KeyError:
+            raise ValueError(f"Unknown implementation '{name}' of stage '{stage}', "
+                             f"expected one of: {', '.join(stage_implementations(stage))}") from None
+    
     def process_text(self, text: str, title: str = "Untitled Document") -> Dict:
         """Process text into a Coredoc format"""
-        # Clean and preprocess text
-        text = self._clean_text(text)
+        return collect_document(self.iter_document(text, title))
+    
+    def iter_document(self, text: str, title: str = "Untitled Document") -> Iterator[Dict]:
+        """Process text, yielding the document header and then each finished chunk.
+        
+        The first record is ``{'document': {...}}``; every following record
+        is one chunk in its final output shape.
+        """
+        self._start_stats()
+        self._start_document(('clean', 'sections', 'chunks', 'duplicates', 'keywords', 'links', 'structure'))
+        try:
+            # Clean, extract hierarchical structure, chunk, then find keywords and links
+            value = text
+            for stage in ('clean', 'sections', 'chunks', 'duplicates', 'keywords', 'links'):
+                value = self._run_stage(stage, value)
+            
+            # Build document structure
+            yield from self._finish_document(value, title)
+        finally:
+            self._finish_document_progress()
+            self._stop_stats()
+    
+    def process_stream(self, stream: Iterable[str], title: str = "Untitled Document",
+                       window: int = DEFAULT_STREAM_WINDOW) -> Dict:
+        """Process a text stream into a Coredoc format.
+        
+        The input is read incrementally by iter_chunks(), so apart from the
+        finished chunks no more than ``window`` characters are held at once.
+        """
+        return collect_document(self.iter_stream_document(stream, title, window))
+    
+    def iter_stream_document(self, stream: Iterable[str], title: str = "Untitled Document",
+                             window: int = DEFAULT_STREAM_WINDOW) -> Iterator[Dict]:
+        """Process a text stream, yielding records like iter_document().
+        
+        The streaming chunker takes the place of the clean, sections and
+        chunks stages; the remaining stages run as configured. Only the
+        input is read with bounded memory: every chunk is kept until the
+        document is finished, since duplicates, keywords and links compare
+        each chunk with the others.
+        """
+        self._start_stats()
+        self._start_document(('chunks', 'duplicates', 'keywords', 'links', 'structure'))
+        try:
+            # Clean, find sections and chunk in one streaming pass
+            chunks = []
+            with self._stage('chunks'):
+                for chunk in self.iter_chunks(stream, window):
+                    # Progress through a mapped file is counted in bytes decoded
+                    if isinstance(stream, MappedTextFile):
+                        self._checkpoint('chunks', stream.position, stream.size)
+                    else:
+                        self._checkpoint('chunks', len(chunks))
+                    chunks.append(chunk)
+            
+            # Collapse duplicates, extract keywords and create links
+            for stage in ('duplicates', 'keywords', 'links'):
+                chunks = self._run_stage(stage, chunks)
+            
+            # Build document structure
+            yield from self._finish_document(chunks, title)
+        finally:
+            self._finish_document_progress()
+            self._stop_stats()
+    
+    def cancel(self):
+        """Stop the document being processed at its next checkpoint.
         
-        # Extract hierarchical structure
-        sections = self._extract_sections(text)
+        Processing then raises ProcessingCancelled. Safe to call from another
+        thread or a signal handler; when no document is being processed, the
+        next one is cancelled.
+        """
+        self._cancelled = True
+    
+    def _start_document(self, stages: Tuple[str, ...]):
+        """Start the time budget and progress of a document passing through stages"""
+        self._deadline = time.monotonic() + self.time_budget if self.time_budget is not None else None
+        self._degraded = []
+        self._progress_stages = stages
+        self._progress_stage = None
+    
+    def _finish_document_progress(self):
+        self._deadline = None
+        self._cancelled = False
+    
+    def _run_stage(self, stage: str, value):
+        """Run a pipeline stage, skipping an optional one once the time budget is spent"""
+        optional = stage in OPTIONAL_STAGES and self.stage_config[stage] != 'off'
+        if not self._checkpoint(stage, 0, optional=optional):
+            return value
+        with self._stage(stage):
+            return self.pipeline[stage](value)
+    
+    def _checkpoint(self, stage: str, done: int, total: Optional[int] = None, optional: bool = False) -> bool:
+        """Report progress and honour cancellation and the time budget.
         
-        # Create chunks from sections
-        chunks = self._create_chunks(sections)
+        Called as a stage starts and between the items of its long loops.
+        Raises ProcessingCancelled once cancel() has been called. Returns
+        False when an optional stage should stop because the time budget is
+        spent; required stages always carry on.
+        """
+        self._raise_if_cancelled(stage)
+        if self._deadline is None and self.on_progress is None:
+            return True
         
-        # Extract keywords and create links
-        chunks = self._extract_keywords_and_links(chunks)
+        now = time.monotonic()
+        if self.on_progress is not None and (stage != self._progress_stage or now >= self._next_progress):
+            self._progress_stage = stage
+            self._next_progress = now + PROGRESS_INTERVAL
+            self.on_progress(ProgressEvent(stage, done, total, self._fraction(stage, done, total)))
         
-        # Build document structure
-        document = self._build_document_structure(chunks, title)
+        if not optional or self._deadline is None or now < self._deadline:
+            return True
+        if stage not in self._degraded:
+            self._degraded.append(stage)
+            self._count(f'degraded_{stage}')
+        return False
+    
+    def _raise_if_cancelled(self, stage: str):
+        if self._cancelled:
+            raise ProcessingCancelled(f"Processing cancelled during {stage}")
+    
+    def _fraction(self, stage: str, done: int, total: Optional[int]) -> float:
+        """Fraction of the document finished, counting every stage alike"""
+        stages = self._progress_stages
+        if stage not in stages:
+            return 0.0
+        within = min(done / total, 1.0) if total else 0.0
+        return (stages.index(stage) + within) / len(stages)
+    
+    def _start_stats(self):
+        """Begin collecting stats for a document if profiling is on"""
+        if not self.profile:
+            return
+        
+        self._stats = ProcessingStats()
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+    
+    def _stop_stats(self):
+        """Publish the stats of the current document"""
+        stats = self._stats
+        if stats is None:
+            return
+        
+        self._stats = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        
+        self.last_stats = stats
+        if self.on_stats:
+            self.on_stats(stats)
+    
+    def _stage(self, name: str):
+        """Context manager measuring a stage, or a no-op when not profiling"""
+        if self._stats is None:
+            return nullcontext()
+        return self._stats.stage(name)
+    
+    def _count(self, name: str, amount: int = 1):
+        if self._stats is not None:
+            self._stats.counters[name] += amount
+    
+    def _finish_document(self, chunks: List[Chunk], title: str) -> Iterator[Dict]:
+        """Yield the document records, followed by a stats record when profiling"""
+        self._count('chunks', len(chunks))
+        self._checkpoint('structure', 0, len(chunks))
+        records = self.pipeline['structure'](chunks, title)
+        
+        if self._stats is None:
+            yield from records
+            return
+        
+        # Time only the structure work, not the consumer of each record
+        while True:
+            with self._stage('structure'):
+                record = next(records, None)
+            if record is None:
+                break
+            yield record
+        
+        yield {'processing_stats': self._stats.as_dict()}
+    
+    def iter_chunks(self, stream: Iterable[str], window: int = DEFAULT_STREAM_WINDOW) -> Iterator[Chunk]:
+        """Yield chunks from a text stream as soon as their section closes.
+        
+        ``stream`` is a text file or any iterable of lines. Headings are
+        detected line by line, and sections longer than ``window`` characters
+        are split into sentences block by block.
+        """
+        window = max(window, self.max_chunk_size)
+        chunk_indexes = count()
+        
+        # (heading level, first chunk index) of the enclosing sections
+        stack = []
+        emitted = False
+        
+        sections = self._iter_sections(self._iter_lines(stream, window), window)
+        
+        for section_title, heading_level, text, final in sections:
+            def blocks(text=text, final=final):
+                yield text, final
+                while not final:
+                    _, _, text, final = next(sections)
+                    yield text, final
+            
+            # Find parent
+            while stack and stack[-1][0] >= heading_level:
+                stack.pop()
+            parent_id = stack[-1][1] if stack else None
+            level = len(stack)
+            
+            first_chunk = None
+            for chunk_title, content, first_sentence in self._iter_section_parts(section_title, blocks(), window):
+                index = next(chunk_indexes)
+                if first_chunk is None:
+                    first_chunk = index
+                emitted = True
+                yield Chunk(chunk_title, content, level, parent_id, self.pipeline['summaries'](first_sentence))
+            
+            stack.append((heading_level, first_chunk))
+            self._count('sections')
+        
+        # If no sections found, create one empty chunk
+        if not emitted:
+            yield Chunk('Main Content', '', summary=self.pipeline['summaries'](None))
+    
+    def _iter_lines(self, stream: Iterable[str], window: int) -> Iterator[Tuple[str, str]]:
+        """Yield (line, separator) pairs of whitespace-normalized lines.
+        
+        At most ``window`` characters are read at a time, so longer lines are
+        cut, at whitespace where possible. The separator joins a piece to the
+        text before it as _clean_text() would: a line break before a new line,
+        and a space or nothing before the rest of a cut line. Pieces of a cut
+        line that hold only whitespace are skipped.
+        """
+        readline = getattr(stream, 'readline', None)
+        pieces = iter(lambda: readline(window), '') if readline else stream
+        rest = ''
+        separator = '\n'
+        
+        for piece in pieces:
+            partial = readline is not None and len(piece) == window and not piece.endswith('\n')
+            piece = rest + piece
+            rest = ''
+            
+            if partial:
+                # Keep a word cut at the read boundary for the next piece
+                match = re.search(r'\S+$', piece)
+                if match and match.start() > 0:
+                    rest = match.group()
+                    piece = piece[:match.start()]
+            
+            line = ' '.join(piece.split())
+            if separator != '\n' and piece[:1].isspace():
+                separator = ' '
+            if line or not partial:
+                yield line, separator
+            
+            if not partial:
+                separator = '\n'
+            elif line:
+                separator = ' ' if piece[-1].isspace() else ''
         
-        return document
+        if rest:
+            yield rest, separator
+    
+    def _iter_sections(self, lines: Iterable[Tuple[str, str]], window: int) -> Iterator[Tuple[str, int, str, bool]]:
+        """Yield (title, heading level, text, final) content blocks of each section.
+        
+        A section longer than ``window`` is yielded as several blocks, and only
+        its last block is final. Every block after the first starts with the
+        separator that joins it to the one before. Sections without content
+        are dropped; when no section has content, the headings themselves
+        become the content of one 'Main Content' section, as in batch mode.
+        """
+        title, heading_level = 'Introduction', 0
+        block = []
+        size = 0
+        continued = False
+        
+        # Normalized lines, kept only until some section has content
+        outline = []
+        
+        for line, separator in lines:
+            heading = self._match_heading(line) if separator == '\n' else None
+            if heading:
+                if block:
+                    yield title, heading_level, ''.join(block[0 if continued else 1:]), True
+                title, heading_level = heading
+                block = []
+                size = 0
+                continued = False
+            
+            if outline is not None:
+                if heading or not line:
+                    outline.append(line)
+                    continue
+                outline = None
+            
+            if heading or not line:
+                continue
+            
+            if block and size + len(line) > window:
+                yield title, heading_level, ''.join(block[0 if continued else 1:]), False
+                block = []
+                size = 0
+                continued = True
+            
+            block += (separator, line)
+            size += len(line) + 1
+        
+        if block:
+            yield title, heading_level, ''.join(block[0 if continued else 1:]), True
+        elif outline:
+            text = self.BLANK_LINES.sub('\n\n', '\n'.join(outline)).strip()
+            if text:
+                yield 'Main Content', 0, text, True
+    
+    def _match_heading(self, line: str) -> Optional[Tuple[str, int]]:
+        """Return the title and level of a normalized heading line, or None"""
+        match = self.HEADING_SCANNER.match(line)
+        if match:
+            style = match.lastgroup
+            return match.group(style).strip(), self._determine_heading_level(line, style)
+        return None
+    
+    def _iter_section_parts(self, title: str, blocks: Iterator[Tuple[str, bool]],
+                            window: int) -> Iterator[Tuple[str, str, Optional[str]]]:
+        """Yield (title, content, first sentence) of each chunk of one streamed section"""
+        content, final = next(blocks)
+        
+        if final and len(content) <= self.max_chunk_size:
+            yield title, content, self._first_sentence(content)
+            return
+        
+        # Split large sections into smaller chunks
+        texts = chain([(content, final)], blocks)
+        parts = self._pack_sentences(self._iter_sentences(texts, window))
+        
+        # Hold one chunk back to know whether the section has several parts
+        pending = next(parts)
+        part = 0
+        for next_part in parts:
+            part += 1
+            yield (f"{title} (Part {part})",) + pending
+            pending = next_part
+        
+        yield ((f"{title} (Part {part + 1})" if part else title),) + pending
+    
+    def _iter_sentences(self, texts: Iterable[Tuple[str, bool]], window: int) -> Iterator[str]:
+        """Yield the sentences of consecutive text blocks.
+        
+        The last sentence of a non-final block may continue in the next one,
+        so it is carried over unless it has already reached ``window``. Each
+        block after the first starts with its separator from the one before.
+        """
+        carry = ''
+        
+        for text, final in texts:
+            text = carry + text if carry else text.lstrip()
+            carry = ''
+            
+            # Hold back the last sentence while the section goes on
+            last = None
+            for sentence in self._iter_block_sentences(text):
+                if last is not None:
+                    yield last
+                last = sentence
+            
+            if last is None:
+                continue
+            if not final and len(last) < window:
+                carry = last
+            else:
+                yield last
+        
+        if carry:
+            yield carry
+    
+    def _iter_block_sentences(self, text: str) -> Iterator[str]:
+        """Yield the sentences of text, slicing them from their spans one at a time"""
+        for start, end in self._sentence_spans(text):
+            yield text[start:end]
+    
+    def _sentence_spans(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield (start, end) offsets of the sentences in text.
+        
+        Punkt finds boundaries lazily, so taking only the first span does not
+        segment the rest of the text.
+        """
+        return _sentence_tokenizer().span_tokenize(text)
+    
+    def _first_sentence(self, text: str) -> Optional[str]:
+        """Return the first sentence of text, or None if it has none"""
+        span = next(iter(self._sentence_spans(text)), None)
+        return text[span[0]:span[1]] if span else None
     
     def _clean_text(self, text: str) -> str:
-        """Clean and normalize text"""
+        """Clean and normalize text.
+        
+        Whitespace runs within a line become one space and lines are stripped,
+        but line breaks are kept so headings stay on lines of their own.
+        """
         # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        text = self.INLINE_SPACE.sub(' ', text)
+        text = self.LINE_EDGE_SPACE.sub('\n', text)
+        text = self.BLANK_LINES.sub('\n\n', text)
         return text.strip()
     
     def _extract_sections(self, text: str) -> List[Dict]:
-        """Extract hierarchical sections from text"""
-        sections = []
+        """Extract hierarchical sections from text.
         
-        # Common heading patterns
-        heading_patterns = [
-            (r'^#{1,6}\s+(.+)$', 'markdown'),
-            (r'^([A-Z][A-Z\s]+)$', 'caps'),
-            (r'^(\d+\.?\s+.+)$', 'numbered'),
-            (r'^([IVX]+\.\s+.+)$', 'roman'),
-        ]
+        All headings are found in one scan of the text without its blank
+        lines, so the content of a section is the single span of that
+        source between its heading and the next one.
+        """
+        sections = []
+        source = self._drop_empty_lines(text)
         
-        lines = text.split('\n')
         current_section = {
             'title': 'Introduction',
-            'content': [],
+            'source': source,
+            'start': 0,
+            'end': 0,
             'level': 0,
             'children': []
         }
+        position = 0
         
-        for i, line in enumerate(lines):
-            is_heading = False
-            
-            for pattern, style in heading_patterns:
-                match = re.match(pattern, line.strip())
-                if match:
-                    # Save current section if it has content
-                    if current_section['content']:
-                        sections.append(current_section)
-                    
-                    # Determine level based on style
-                    level = self._determine_heading_level(line, style)
-                    
-                    current_section = {
-                        'title': match.group(1).strip(),
-                        'content': [],
-                        'level': level,
-                        'children': []
-                    }
-                    is_heading = True
-                    break
-            
-            if not is_heading and line.strip():
-                current_section['content'].append(line)
+        for match in self.HEADING_SCANNER.finditer(source):
+            self._set_content_span(current_section, position, match.start())
+            position = match.end()
+            
+            # Save current section if it has content
+            if current_section['end'] > current_section['start']:
+                sections.append(current_section)
+            
+            # Determine level based on style
+            style = match.lastgroup
+            level = self._determine_heading_level(match.group(0), style)
+            
+            current_section = {
+                'title': match.group(style).strip(),
+                'source': source,
+                'start': 0,
+                'end': 0,
+                'level': level,
+                'children': []
+            }
+        
+        self._set_content_span(current_section, position, len(source))
         
         # Add last section
-        if current_section['content']:
+        if current_section['end'] > current_section['start']:
             sections.append(current_section)
         
         # If no sections found, create one from the entire text
         if not sections:
             sections = [{
                 'title': 'Main Content',
-                'content': lines,
+                'source': text,
+                'start': 0,
+                'end': len(text),
                 'level': 0,
                 'children': []
             }]
         
+        self._count('sections', len(sections))
         return self._build_hierarchy(sections)
     
+    def _drop_empty_lines(self, text: str) -> str:
+        """Remove the lines of text that hold nothing but whitespace"""
+        source = self.EMPTY_LINE.sub('', text)
+        
+        last_break = source.rfind('\n')
+        if last_break >= 0 and self.EDGE_EMPTY_LINE.match(source, last_break + 1):
+            source = source[:last_break]
+        
+        first_line = self.EDGE_EMPTY_LINE.match(source)
+        if first_line:
+            source = source[first_line.end():]
+        return source
+    
+    @staticmethod
+    def _set_content_span(section: Dict, start: int, end: int):
+        """Set a section's content to source[start:end] without its edge line breaks"""
+        source = section['source']
+        while start < end and source[start] == '\n':
+            start += 1
+        while end > start and source[end - 1] == '\n':
+            end -= 1
+        section['start'] = start
+        section['end'] = end
+    
     def _determine_heading_level(self, line: str, style: str) -> int:
         """Determine heading level based on style"""
         if style == 'markdown':
@@ -158,76 +1342,102 @@ class CoredocProcessor:
         
         return root_sections
     
-    def _create_chunks(self, sections: List[Dict]) -> List[Dict]:
-        """Create chunks from sections"""
+    def _create_chunks(self, sections: List[Dict], offsets: bool = False) -> List[Chunk]:
+        """Create chunks from sections.
+        
+        With offsets, chunks keep (start, end) offsets into the sections'
+        source instead of copies of their text. Parts of a split section
+        then span their sentences with the line breaks between them, where
+        copied parts join their sentences with spaces.
+        """
         chunks = []
-        chunk_id = 0
         
-        def process_section(section: Dict, parent_id: Optional[str] = None, level: int = 0):
-            nonlocal chunk_id
-            
-            content = '\n'.join(section['content'])
+        # Progress is counted in characters of section content
+        def section_characters(section: Dict) -> int:
+            return section['end'] - section['start'] + sum(map(section_characters, section['children']))
+        
+        total = sum(map(section_characters, sections))
+        done = 0
+        
+        def process_section(section: Dict, parent_id: Optional[int] = None, level: int = 0):
+            nonlocal done
+            source, start, end = section['source'], section['start'], section['end']
+            content = source[start:end]
             
             # Split large sections into smaller chunks
             if len(content) > self.max_chunk_size:
-                sub_chunks = self._split_into_chunks(content)
+                if offsets:
+                    parts = ((source, start + sub_start, start + sub_end, first_sentence)
+                             for sub_start, sub_end, first_sentence in self._split_into_spans(content))
+                else:
+                    parts = ((sub_content, 0, len(sub_content), first_sentence)
+                             for sub_content, first_sentence in self._split_into_chunks(content))
                 
-                for i, sub_content in enumerate(sub_chunks):
-                    chunk = {
-                        'id': f'chunk_{chunk_id}',
-                        'title': f"{section['title']} (Part {i+1})" if len(sub_chunks) > 1 else section['title'],
-                        'content': sub_content,
-                        'level': level,
-                        'parent_id': parent_id,
-                        'character_count': len(sub_content),
-                        'keywords': [],
-                        'embedded_links': []
-                    }
-                    chunks.append(chunk)
-                    
-                    if i == 0:
-                        first_chunk_id = chunk['id']
-                    
-                    chunk_id += 1
+                # A section without headings can be the whole document
+                sub_chunks = []
+                split = 0
+                for part in parts:
+                    sub_chunks.append(part)
+                    split += part[2] - part[1]
+                    self._checkpoint('chunks', done + min(split, len(content)), total)
+                first_chunk_id = len(chunks)
+                
+                for i, (sub_source, sub_start, sub_end, first_sentence) in enumerate(sub_chunks):
+                    chunk_title = f"{section['title']} (Part {i+1})" if len(sub_chunks) > 1 else section['title']
+                    chunks.append(Chunk(chunk_title, sub_source, level, parent_id,
+                                        self.pipeline['summaries'](first_sentence), sub_start, sub_end))
                 
                 parent_id = first_chunk_id
             else:
-                chunk = {
-                    'id': f'chunk_{chunk_id}',
-                    'title': section['title'],
-                    'content': content,
-                    'level': level,
-                    'parent_id': parent_id,
-                    'character_count': len(content),
-                    'keywords': [],
-                    'embedded_links': []
-                }
-                chunks.append(chunk)
-                parent_id = chunk['id']
-                chunk_id += 1
+                if not offsets:
+                    source, start, end = content, 0, len(content)
+                chunks.append(Chunk(section['title'], source, level, parent_id,
+                                    self.pipeline['summaries'](self._first_sentence(content)), start, end))
+                parent_id = len(chunks) - 1
+            
+            done += len(content)
+            self._checkpoint('chunks', done, total)
             
             # Process children
             for child in section['children']:
                 process_section(child, parent_id, level + 1)
         
         # Process all root sections
+        self._checkpoint('chunks', 0, total)
         for section in sections:
             process_section(section)
         
         return chunks
     
-    def _split_into_chunks(self, text: str) -> List[str]:
-        """Split text into chunks of appropriate size"""
-        sentences = sent_tokenize(text)
-        chunks = []
+    def _split_into_chunks(self, text: str) -> Iterator[Tuple[str, str]]:
+        """Split text into (content, first sentence) chunks of appropriate size"""
+        return self._pack_sentences(self._iter_block_sentences(text))
+    
+    def _split_into_spans(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """Split text into (start, end, first sentence) chunks of appropriate size"""
+        for group in self._group_sentences(self._sentence_spans(text), lambda span: span[1] - span[0]):
+            yield group[0][0], group[-1][1], text[group[0][0]:group[0][1]]
+    
+    def _pack_sentences(self, sentences: Iterable[str]) -> Iterator[Tuple[str, str]]:
+        """Join consecutive sentences into chunks of at most max_chunk_size.
+        
+        Each chunk is yielded with its first sentence, which becomes its summary.
+        """
+        for group in self._group_sentences(sentences, len):
+            yield ' '.join(group), group[0]
+    
+    def _group_sentences(self, sentences: Iterable, size: Callable[..., int]) -> Iterator[List]:
+        """Group consecutive sentences whose sizes add up to at most max_chunk_size"""
         current_chunk = []
         current_size = 0
+        sentence_count = 0
         
         for sentence in sentences:
-            sentence_size = len(sentence)
+            sentence_count += 1
+            sentence_size = size(sentence)
             
             if current_size + sentence_size > self.max_chunk_size and current_chunk:
-                chunks.append(' '.join(current_chunk))
+                yield current_chunk
                 current_chunk = [sentence]
                 current_size = sentence_size
             else:
@@ -235,91 +1445,358 @@ class CoredocProcessor:
                 current_size += sentence_size
         
         if current_chunk:
-            chunks.append(' '.join(current_chunk))
+            yield current_chunk
+        
+        self._count('sentences', sentence_count)
+    
+    def _collapse_duplicates(self, chunks: List[Chunk]) -> List[Chunk]:
+        """Collapse near-duplicate chunks into the first chunk like them.
+        
+        Each dropped copy is recorded in the duplicates of the chunk it
+        matched, and references to it, as a parent, move to that chunk.
+        """
+        index = MinHashIndex(self.duplicate_threshold)
+        signatures = index.signatures(chunk.content for chunk in chunks)
+        
+        kept = []
+        # New index of every chunk, or of the chunk it collapsed into
+        new_index = []
+        matching = True
+        for number, (chunk, signature) in enumerate(zip(chunks, signatures)):
+            parent = new_index[chunk.parent] if chunk.parent is not None else None
+            
+            # Past the time budget the remaining chunks are all kept
+            matching = matching and self._checkpoint('duplicates', number, len(chunks), optional=True)
+            match = index.add(len(kept), signature) if matching and signature is not None else None
+            
+            if match is None:
+                chunk.parent = parent
+                new_index.append(len(kept))
+                kept.append(chunk)
+                continue
+            
+            canonical, similarity = match
+            kept[canonical].duplicates += (Duplicate(chunk.title, parent, similarity),)
+            new_index.append(canonical)
+        
+        self._count('duplicates', len(chunks) - len(kept))
+        return kept
+    
+    def _extract_chunk_keywords(self, chunks: List[Chunk],
+                                tokenize: Optional[Callable[[str], List[str]]] = None) -> List[Chunk]:
+        """Extract the keywords of each chunk"""
+        for number, chunk in enumerate(chunks):
+            if not self._checkpoint('keywords', number, len(chunks), optional=True):
+                break
+            chunk.keywords = self._extract_keywords(chunk.content, tokenize)
         
         return chunks
     
-    def _extract_keywords_and_links(self, chunks: List[Dict]) -> List[Dict]:
-        """Extract keywords and create embedded links between chunks"""
-        # Extract keywords from each chunk
-        chunk_keywords = {}
+    def _extract_batch_keywords(self, chunks: List[Chunk],
+                                tokenize: Optional[Callable[[str], List[str]]] = None,
+                                limit: int = 10) -> List[Chunk]:
+        """Extract the keywords of all chunks at once, scored by TF-IDF.
+        
+        Candidates are chosen as in _extract_keywords(): words used more than
+        once in a chunk, and the chunk's noun phrases. Their term frequencies
+        are weighted by the smoothed inverse document frequency over the
+        chunks of this document, so terms used throughout the document rank
+        below those particular to a chunk. The chunk x term count matrix is
+        scored and each chunk's top terms are picked with array operations.
+        """
+        np, sparse = _sparse_backend()
+        tokenize = tokenize or _word_tokenizer()
+        
+        # Number every distinct token and phrase; phrases are keyed lowercased
+        vocabulary = defaultdict(count().__next__)
+        phrase_terms = {}
+        token_ids = array('I')
+        token_counts = array('I')
+        phrase_rows = array('I')
+        phrase_ids = array('I')
+        phrase_weights = array('d')
+        
+        for row, chunk in enumerate(chunks):
+            if not self._checkpoint('keywords', row, len(chunks), optional=True):
+                # Past the time budget the remaining chunks get no keywords
+                token_counts.extend([0] * (len(chunks) - row))
+                break
+            content = chunk.content
+            lowered = content.lower()
+            tokens = tokenize(lowered)
+            token_ids.extend(map(vocabulary.__getitem__, tokens))
+            token_counts.append(len(tokens))
+            
+            phrases = self._extract_noun_phrases(content)
+            for phrase, phrase_count in self._count_phrases(lowered, phrases).items():
+                if phrase_count:
+                    phrase_rows.append(row)
+                    phrase_ids.append(vocabulary[phrase])
+                    phrase_weights.append(phrase_count * len(phrase.split()))
+            for phrase in phrases:
+                phrase_terms.setdefault(phrase.lower(), phrase)
+        
+        rows_count = len(chunks)
+        terms = list(vocabulary)
+        names = [phrase_terms.get(term, term) for term in terms]
+        is_phrase = np.array([term in phrase_terms for term in terms], dtype=bool)
+        keep = np.array([term.isalnum() and term not in self.stop_words and len(term) > 3 for term in terms],
+                        dtype=bool)
+        
+        # Filtered words of every chunk, with the chunk boundaries among them
+        raw_ids = np.frombuffer(token_ids, dtype=np.uint32).astype(np.int64)
+        raw_bounds = np.zeros(rows_count + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(token_counts, dtype=np.uint32), out=raw_bounds[1:])
+        kept = keep[raw_ids] if len(raw_ids) else np.zeros(0, dtype=bool)
+        ids = raw_ids[kept]
+        kept_before = np.zeros(len(kept) + 1, dtype=np.int64)
+        np.cumsum(kept, out=kept_before[1:])
+        bounds = kept_before[raw_bounds]
+        word_counts = np.diff(bounds)
+        token_rows = np.repeat(np.arange(rows_count), word_counts)
+        self._count('tokens', len(ids))
+        
+        # Chunk x term counts; a phrase counts once per word it spans
+        matrix = sparse.coo_matrix(
+            (np.concatenate((np.ones(len(ids)), np.frombuffer(phrase_weights, dtype=np.float64))),
+             (np.concatenate((token_rows, np.frombuffer(phrase_rows, dtype=np.uint32))),
+              np.concatenate((ids, np.frombuffer(phrase_ids, dtype=np.uint32))))),
+            shape=(rows_count, len(terms))).tocsr()
+        matrix.sort_indices()
+        
+        rows = np.repeat(np.arange(rows_count), np.diff(matrix.indptr))
+        cols = matrix.indices.astype(np.int64)
+        counts = matrix.data
+        
+        document_frequency = np.bincount(cols, minlength=len(terms))
+        idf = np.log((1 + rows_count) / (1 + document_frequency)) + 1
+        
+        candidate = is_phrase[cols] | (counts > 1)
+        rows, cols = rows[candidate], cols[candidate]
+        scores = counts[candidate] / np.maximum(word_counts[rows], 1) * idf[cols]
+        
+        rows, cols, scores = self._top_per_row(np, rows, cols, scores, rows_count, limit)
+        
+        # Word positions of the selected word terms, grouped by (chunk, term)
+        keys = rows * len(terms) + cols
+        token_keys = token_rows * len(terms) + ids
+        found = np.isin(token_keys, keys)
+        found_keys = token_keys[found]
+        positions = (np.flatnonzero(found) - bounds[token_rows[found]]).astype(np.uint32)
+        order = np.argsort(found_keys, kind='stable')
+        found_keys, positions = found_keys[order], positions[order]
+        starts = np.searchsorted(found_keys, keys, 'left')
+        ends = np.searchsorted(found_keys, keys, 'right')
         
         for chunk in chunks:
-            keywords = self._extract_keywords(chunk['content'])
-            chunk['keywords'] = keywords
-            chunk_keywords[chunk['id']] = set(kw['term'] for kw in keywords)
+            chunk.keywords = []
+        for row, col, score, start, end in zip(rows.tolist(), cols.tolist(), scores.tolist(),
+                                               starts.tolist(), ends.tolist()):
+            word_positions = array('I', positions[start:end].tobytes()) if not is_phrase[col] else array('I')
+            chunks[row].keywords.append(Keyword(sys.intern(names[col]), score, word_positions))
+        
+        return chunks
+    
+    @staticmethod
+    def _top_per_row(np, rows, cols, scores, rows_count: int, limit: int):
+        """Keep the limit best scores of every row, best first.
+        
+        Entries must be grouped by row. Each row's limit-th best score is
+        found by a partial sort of the rows padded to equal width; only the
+        entries reaching it are fully sorted, by score and then by column.
+        """
+        lengths = np.bincount(rows, minlength=rows_count)
+        width = int(lengths.max()) if len(rows) else 0
+        
+        if width > limit:
+            rank = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            padded = np.full((rows_count, width), -np.inf)
+            padded[rows, rank] = scores
+            threshold = np.partition(padded, width - limit, axis=1)[:, width - limit]
+            reaching = scores >= threshold[rows]
+            rows, cols, scores = rows[reaching], cols[reaching], scores[reaching]
+        
+        order = np.lexsort((cols, -scores, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        
+        # Ties at the threshold can leave more than limit entries in a row
+        lengths = np.bincount(rows, minlength=rows_count)
+        rank = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        best = rank < limit
+        return rows[best], cols[best], scores[best]
+    
+    def _create_links(self, chunks: List[Chunk]) -> List[Chunk]:
+        """Create embedded links between chunks that share keywords"""
+        chunk_terms = []
+        chunk_scores = []
+        postings = defaultdict(list)
+        
+        for index, chunk in enumerate(chunks):
+            keywords = chunk.keywords
+            
+            terms = set(kw.term for kw in keywords)
+            scores = {}
+            for kw in keywords:
+                scores.setdefault(kw.term, kw.importance_score)
+            
+            chunk_terms.append(terms)
+            chunk_scores.append(scores)
+            
+            for term in terms:
+                postings[term].append(index)
+        
+        # One automaton over every keyword term of the document
+        matcher = PhraseMatcher(term.lower() for term in postings)
         
         # Create links between chunks based on keyword overlap
-        for i, chunk in enumerate(chunks):
-            links = []
-            chunk_terms = chunk_keywords[chunk['id']]
+        for index, chunk in enumerate(chunks):
+            if not self._checkpoint('links', index, len(chunks), optional=True):
+                break
+            anchors = self._locate_terms(chunk.content, chunk_terms[index], matcher)
+            chunk.links = self._select_links(index, chunk_terms, chunk_scores, postings, anchors)
+            self._count('links', len(chunk.links))
+        
+        return chunks
+    
+    def _locate_terms(self, content: str, terms: Set[str], matcher: PhraseMatcher) -> Dict[str, array]:
+        """Find the word-bounded, case-insensitive occurrences of terms in content.
+        
+        Returns the flattened start and end offsets of each term found, from
+        a single pass of the document's matcher over the chunk.
+        """
+        wanted = {term.lower(): term for term in terms}
+        anchors = defaultdict(lambda: array('I'))
+        lowered = content.lower()
+        
+        if len(lowered) != len(content):
+            # Lowercasing moved offsets; fall back to one regex per term
+            for term in terms:
+                pattern = re.compile(r'\b' + re.escape(term) + r'\b', re.IGNORECASE)
+                anchors[term] = array('I', chain.from_iterable(match.span() for match in pattern.finditer(content)))
+            return {term: spans for term, spans in anchors.items() if spans}
+        
+        for end, phrase_index in matcher.iter_matches(lowered):
+            term = wanted.get(matcher.phrases[phrase_index])
+            if term is None:
+                continue
             
-            for j, other_chunk in enumerate(chunks):
-                if i == j:
+            start = end - len(term)
+            if start > 0 and self._is_word_char(content[start - 1]):
+                continue
+            if end < len(content) and self._is_word_char(content[end]):
+                continue
+            
+            # Occurrences of one term never overlap, as with re.finditer()
+            spans = anchors[term]
+            if spans and start < spans[-1]:
+                continue
+            spans.append(start)
+            spans.append(end)
+        
+        return dict(anchors)
+    
+    @staticmethod
+    def _is_word_char(char: str) -> bool:
+        return char.isalnum() or char == '_'
+    
+    def _select_links(self, index: int, chunk_terms: List[Set[str]],
+                      chunk_scores: List[Dict[str, float]], postings: Dict[str, List[int]],
+                      anchors: Dict[str, array], limit: int = 5) -> List[Link]:
+        """Select the embedded links of one chunk from the term postings.
+        
+        A chunk sharing terms with this one links through its most important
+        common term, and links are ranked by keyword length, then by position.
+        Candidates are visited in that order by lazily merging the sorted
+        posting lists, so the scan stops after ``limit`` links instead of
+        comparing against every other chunk. Only terms found in ``anchors``
+        can link, and each link carries their offsets.
+        """
+        terms = chunk_terms[index]
+        scores = chunk_scores[index]
+        terms_by_score = defaultdict(list)
+        terms_by_length = defaultdict(list)
+        for term in terms:
+            terms_by_score[scores[term]].append(term)
+            terms_by_length[len(term)].append(term)
+        
+        def appears(term: str) -> bool:
+            # Check if this term appears in the current chunk's content
+            return term in anchors
+        
+        links = []
+        
+        for length in sorted(terms_by_length, reverse=True):
+            # Ties on importance are settled per chunk below
+            sources = [postings[term] for term in terms_by_length[length]
+                       if len(terms_by_score[scores[term]]) > 1 or appears(term)]
+            
+            previous = None
+            for other in heapq.merge(*sources):
+                if other == previous or other == index:
+                    continue
+                previous = other
+                self._count('candidate_link_pairs')
+                
+                # Find the most important common term
+                common_terms = terms.intersection(chunk_terms[other])
+                best_term = max(common_terms, key=scores.__getitem__)
+                
+                # Chunks linked through a shorter term are ranked in a later pass
+                if len(best_term) != length or not appears(best_term):
                     continue
                 
-                other_terms = chunk_keywords[other_chunk['id']]
-                common_terms = chunk_terms.intersection(other_terms)
+                links.append(Link(best_term, other, anchors[best_term]))
                 
-                if common_terms:
-                    # Find the most important common term
-                    best_term = max(common_terms, key=lambda t: 
-                        next(kw['importance_score'] for kw in chunk['keywords'] if kw['term'] == t))
-                    
-                    # Check if this term appears in the current chunk's content
-                    if re.search(r'\b' + re.escape(best_term) + r'\b', chunk['content'], re.IGNORECASE):
-                        links.append({
-                            'keyword': best_term,
-                            'target_page_id': other_chunk['id'],
-                            'context_hint': f"Related content about {best_term}"
-                        })
-            
-            # Limit links per chunk
-            chunk['embedded_links'] = sorted(links, 
-                key=lambda l: len(l['keyword']), reverse=True)[:5]
+                # Limit links per chunk
+                if len(links) == limit:
+                    return links
         
-        return chunks
+        return links
     
-    def _extract_keywords(self, text: str) -> List[Dict]:
-        """Extract keywords from text"""
-        # Tokenize and filter
-        words = word_tokenize(text.lower())
-        words = [w for w in words if w.isalnum() and w not in self.stop_words and len(w) > 3]
+    def _extract_keywords(self, text: str, tokenize: Optional[Callable[[str], List[str]]] = None) -> List[Keyword]:
+        """Extract keywords from text, tokenized with nltk.word_tokenize() unless tokenize is given"""
+        lowered = text.lower()
+        tokenize = tokenize or _word_tokenizer()
         
-        # Count frequency
-        word_freq = defaultdict(int)
-        for word in words:
-            word_freq[word] += 1
+        # Tokenize, filter and record frequency and positions in one pass
+        word_positions = defaultdict(list)
+        word_count = 0
+        for w in tokenize(lowered):
+            if w.isalnum() and w not in self.stop_words and len(w) > 3:
+                word_positions[w].append(word_count)
+                word_count += 1
+        self._count('tokens', word_count)
         
         # Extract noun phrases (simple approach)
         noun_phrases = self._extract_noun_phrases(text)
+        phrase_counts = self._count_phrases(lowered, noun_phrases)
         
         # Combine and score
         keywords = []
         
         # Add single words
-        for word, freq in word_freq.items():
-            if freq > 1:  # Appears more than once
-                keywords.append({
-                    'term': word,
-                    'importance_score': freq / len(words),
-                    'positions': [i for i, w in enumerate(words) if w == word]
-                })
+        for word, positions in word_positions.items():
+            if len(positions) > 1:  # Appears more than once
+                keywords.append((word, len(positions) / word_count, positions))
         
-        # Add noun phrases
+        # Add noun phrases, which a chunk of only stopwords and short words can still hold
         for phrase in noun_phrases:
-            phrase_lower = phrase.lower()
-            count = text.lower().count(phrase_lower)
+            count = phrase_counts[phrase.lower()]
             if count > 0:
-                keywords.append({
-                    'term': phrase,
-                    'importance_score': (count * len(phrase.split())) / len(words),
-                    'positions': []
-                })
+                keywords.append((phrase, (count * len(phrase.split())) / max(word_count, 1), ()))
         
-        # Sort by importance and return top keywords
-        keywords.sort(key=lambda k: k['importance_score'], reverse=True)
-        return keywords[:10]
+        # Sort by importance and return top keywords, with terms shared across chunks
+        keywords.sort(key=lambda k: k[1], reverse=True)
+        return [Keyword(sys.intern(term), score, array('I', positions)) for term, score, positions in keywords[:10]]
+    
+    def _count_phrases(self, lowered: str, phrases: List[str]) -> Dict[str, int]:
+        """Count occurrences of each lowercased phrase in the lowercased text"""
+        unique = list(dict.fromkeys(phrase.lower() for phrase in phrases))
+        
+        if len(unique) <= self.PHRASE_MATCHER_THRESHOLD:
+            return {phrase: lowered.count(phrase) for phrase in unique}
+        
+        return PhraseMatcher(unique).count(lowered)
     
     def _extract_noun_phrases(self, text: str) -> List[str]:
         """Extract simple noun phrases from text"""
@@ -333,99 +1810,1059 @@ class CoredocProcessor:
         
         return phrases
     
-    def _build_document_structure(self, chunks: List[Dict], title: str) -> Dict:
+    def _build_document_structure(self, chunks: List[Chunk], title: str) -> Dict:
         """Build final document structure"""
+        return collect_document(self._iter_document_structure(chunks, title))
+    
+    def _iter_document_structure(self, chunks: List[Chunk], title: str, offsets: bool = False) -> Iterator[Dict]:
+        """Yield the document header, then each chunk converted to its output shape.
+        
+        With offsets, the header carries the chunks' shared source as 'text'
+        and each chunk a [start, end] 'span' of it in place of its content.
+        """
+        chunk_id = 'chunk_{}'.format
+        
+        source = chunks[0].source if chunks else ''
+        if offsets and any(chunk.source is not source for chunk in chunks):
+            raise ValueError("Offset output needs chunks from the 'offsets' chunks stage")
+        
         # Find root chunk (first chunk with no parent)
-        root_chunk = next((c for c in chunks if c['parent_id'] is None), chunks[0])
+        root_index = next((index for index, c in enumerate(chunks) if c.parent is None), 0)
         
-        # Calculate coverage
-        total_chars = sum(c['character_count'] for c in chunks)
+        # Group chunk indexes by parent, in document order
+        children_by_parent = defaultdict(list)
+        for index, chunk in enumerate(chunks):
+            children_by_parent[chunk.parent].append(index)
+        
+        # Position of each chunk among its siblings
+        sibling_index = {}
+        for siblings in children_by_parent.values():
+            for j, index in enumerate(siblings):
+                sibling_index[index] = j
+        
+        document = {
+            'id': hashlib.md5(title.encode()).hexdigest()[:8],
+            'title': title,
+            'total_chunks': len(chunks),
+            'root_chunk_id': chunk_id(root_index),
+            'created_at': self.clock(),
+            'max_depth': max(c.level for c in chunks),
+            'coverage_percentage': 100.0  # Since we process all content
+        }
+        if self._degraded:
+            document['degraded_stages'] = list(self._degraded)
+        if offsets:
+            document['text'] = source
+        yield {'document': document}
         
         # Build relationships
-        for i, chunk in enumerate(chunks):
-            # Find children
-            children = [c['id'] for c in chunks if c['parent_id'] == chunk['id']]
+        for index, chunk in enumerate(chunks):
+            self._checkpoint('structure', index, len(chunks))
+            parent_id = chunk_id(chunk.parent) if chunk.parent is not None else None
             
             # Find siblings
-            siblings = [c for c in chunks if c['parent_id'] == chunk['parent_id'] and c['id'] != chunk['id']]
-            prev_chunk = None
-            next_chunk = None
-            
-            if siblings:
-                # Sort siblings by their order in the chunks list
-                siblings.sort(key=lambda c: chunks.index(c))
-                current_index = next(j for j, s in enumerate(siblings) if s['id'] == chunk['id'])
-                
-                if current_index > 0:
-                    prev_chunk = siblings[current_index - 1]['id']
-                if current_index < len(siblings) - 1:
-                    next_chunk = siblings[current_index + 1]['id']
-            
-            # Add relationships
-            chunk['relationships'] = {
-                'parent': chunk['parent_id'],
-                'children': children,
-                'prev': prev_chunk,
-                'next': next_chunk,
-                'references': [link['target_page_id'] for link in chunk['embedded_links']]
-            }
+            siblings = children_by_parent[chunk.parent]
+            current_index = sibling_index[index]
+            prev_chunk = chunk_id(siblings[current_index - 1]) if current_index > 0 else None
+            next_chunk = chunk_id(siblings[current_index + 1]) if current_index < len(siblings) - 1 else None
             
-            # Generate summary
-            chunk['summary'] = self._generate_summary(chunk['content'])
+            links = [{
+                'keyword': link.keyword,
+                'target_page_id': chunk_id(link.target),
+                'context_hint': f"Related content about {link.keyword}",
+                'anchors': [list(link.anchors[i:i + 2]) for i in range(0, len(link.anchors), 2)]
+            } for link in chunk.links]
             
-            # Add context
-            chunk['context'] = f"Part of {title}, section on {chunk['title']}"
+            if offsets:
+                content_key, content = 'span', [chunk.start, chunk.end]
+            else:
+                content_key, content = 'content', chunk.content
             
-            # Convert to match expected format
-            chunk['parent_page_id'] = chunk.pop('parent_id', None)
-        
-        document = {
-            'document': {
-                'id': hashlib.md5(title.encode()).hexdigest()[:8],
-                'title': title,
-                'total_chunks': len(chunks),
-                'root_chunk_id': root_chunk['id'],
-                'created_at': '2024-01-01T00:00:00Z',
-                'max_depth': max(c['level'] for c in chunks),
-                'coverage_percentage': 100.0  # Since we process all content
-            },
-            'chunks': chunks
-        }
-        
-        return document
+            record = {
+                'id': chunk_id(index),
+                'title': chunk.title,
+                content_key: content,
+                'level': chunk.level,
+                'character_count': chunk.end - chunk.start,
+                'keywords': [{
+                    'term': kw.term,
+                    'importance_score': kw.importance_score,
+                    'positions': list(kw.positions)
+                } for kw in chunk.keywords],
+                'embedded_links': links,
+                'relationships': {
+                    'parent': parent_id,
+                    'children': [chunk_id(child) for child in children_by_parent.get(index, [])],
+                    'prev': prev_chunk,
+                    'next': next_chunk,
+                    'references': [link['target_page_id'] for link in links]
+                },
+                'summary': chunk.summary if chunk.summary is not None else self._generate_summary(chunk.content),
+                'context': f"Part of {title}, section on {chunk.title}",
+                'parent_page_id': parent_id
+            }
+            
+            # Back-references to the copies collapsed into this chunk
+            if chunk.duplicates:
+                record['duplicates'] = [{
+                    'title': duplicate.title,
+                    'parent': chunk_id(duplicate.parent) if duplicate.parent is not None else None,
+                    'similarity': duplicate.similarity
+                } for duplicate in chunk.duplicates]
+            
+            yield record
     
     def _generate_summary(self, content: str) -> str:
         """Generate a simple summary of the content"""
-        sentences = sent_tokenize(content)
-        if sentences:
+        return self.pipeline['summaries'](self._first_sentence(content))
+    
+    def _summarize(self, first_sentence: Optional[str]) -> str:
+        """Turn a chunk's first sentence into its summary"""
+        if first_sentence:
             # Return first sentence as summary (can be improved)
-            return sentences[0][:200] + '...' if len(sentences[0]) > 200 else sentences[0]
+            return first_sentence[:200] + '...' if len(first_sentence) > 200 else first_sentence
         return "No summary available"
 
 
+# Reference implementations are the processor's own stage methods
+register_stage('clean', 'reference')(CoredocProcessor._clean_text)
+register_stage('sections', 'reference')(CoredocProcessor._extract_sections)
+register_stage('chunks', 'reference')(CoredocProcessor._create_chunks)
+register_stage('summaries', 'reference')(CoredocProcessor._summarize)
+register_stage('duplicates', 'minhash')(CoredocProcessor._collapse_duplicates)
+register_stage('keywords', 'reference')(CoredocProcessor._extract_chunk_keywords)
+register_stage('links', 'reference')(CoredocProcessor._create_links)
+register_stage('structure', 'reference')(CoredocProcessor._iter_document_structure)
+
+
+@register_stage('chunks', 'offsets')
+def _create_offset_chunks(processor: CoredocProcessor, sections: List[Dict]) -> List[Chunk]:
+    """Chunk stage keeping offsets into the normalized text instead of copies"""
+    return processor._create_chunks(sections, offsets=True)
+
+
+@register_stage('structure', 'offsets')
+def _iter_offset_document_structure(processor: CoredocProcessor, chunks: List[Chunk], title: str) -> Iterator[Dict]:
+    """Structure stage writing chunk spans of the document text instead of content"""
+    return processor._iter_document_structure(chunks, title, offsets=True)
+
+
+@register_stage('keywords', 'regex')
+def _extract_chunk_keywords_regex(processor: CoredocProcessor, chunks: List[Chunk]) -> List[Chunk]:
+    """Keyword stage tokenizing with alnum_word_tokenize() instead of NLTK"""
+    return processor._extract_chunk_keywords(chunks, alnum_word_tokenize)
+
+
+@register_stage('keywords', 'tfidf')
+def _extract_chunk_keywords_tfidf(processor: CoredocProcessor, chunks: List[Chunk]) -> List[Chunk]:
+    """Keyword stage scoring all chunks together by TF-IDF"""
+    return processor._extract_batch_keywords(chunks)
+
+
+@register_stage('keywords', 'tfidf-regex')
+def _extract_chunk_keywords_tfidf_regex(processor: CoredocProcessor, chunks: List[Chunk]) -> List[Chunk]:
+    """TF-IDF keyword stage tokenizing with alnum_word_tokenize()"""
+    return processor._extract_batch_keywords(chunks, alnum_word_tokenize)
+
+
+@register_stage('clean', 'off')
+def _keep_text(processor: CoredocProcessor, text: str) -> str:
+    return text
+
+
+@register_stage('summaries', 'off')
+def _no_summary(processor: CoredocProcessor, first_sentence: Optional[str]) -> str:
+    return ''
+
+
+@register_stage('duplicates', 'off')
+def _keep_duplicates(processor: CoredocProcessor, chunks: List[Chunk]) -> List[Chunk]:
+    return chunks
+
+
+@register_stage('keywords', 'off')
+def _no_keywords(processor: CoredocProcessor, chunks: List[Chunk]) -> List[Chunk]:
+    for chunk in chunks:
+        chunk.keywords = ()
+    return chunks
+
+
+@register_stage('links', 'off')
+def _no_links(processor: CoredocProcessor, chunks: List[Chunk]) -> List[Chunk]:
+    for chunk in chunks:
+        chunk.links = ()
+    return chunks
+
+
+def collect_document(records: Iterator[Dict]) -> Dict:
+    """Assemble header and chunk records into one document.
+    
+    A trailing processing_stats record is folded into the document metadata.
+    """
+    document = next(records)
+    document['chunks'] = list(records)
+    if document['chunks'] and 'processing_stats' in document['chunks'][-1]:
+        document['document']['processing_stats'] = document['chunks'].pop()['processing_stats']
+    return document
+
+
+def dump_ndjson(records: Iterable[Dict], f) -> int:
+    """Write document records as compact JSON lines, one per record.
+    
+    Each line is flushed as soon as it is written so readers can consume
+    chunks while the rest of the document is still being produced.
+    Returns the number of chunks written.
+    """
+    chunk_count = -1
+    for record in records:
+        f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        f.flush()
+        if 'processing_stats' not in record:
+            chunk_count += 1
+    return chunk_count
+
+
+def load_ndjson(f) -> Dict:
+    """Read a document written by dump_ndjson() back into the Coredoc format"""
+    records = (json.loads(line) for line in f if line.strip())
+    
+    header = next(records, None)
+    if not header or 'document' not in header:
+        raise ValueError("NDJSON input does not start with a document header")
+    
+    return collect_document(chain([header], records))
+
+
+# Layout written by encode_compact(), recorded in each compact document
+COMPACT_FORMAT = 'coredoc-compact'
+COMPACT_VERSION = 1
+
+# Fields of each chunk of a compact document, in the order of its list
+COMPACT_FIELDS = ('title', 'level', 'parent', 'content', 'summary', 'keyword_terms', 'keyword_scores',
+                  'keyword_positions', 'link_terms', 'link_targets', 'link_anchors', 'duplicates')
+
+OUTPUT_FORMATS = ('json', 'ndjson', 'compact', 'msgpack')
+COMPRESSIONS = ('gzip', 'zstd')
+
+# zlib's default level; zstd's level 10 compresses about 4% better than its default at half the speed
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _deltas(values: Iterable[int]) -> List[int]:
+    previous = 0
+    deltas = []
+    for value in values:
+        deltas.append(value - previous)
+        previous = value
+    return deltas
+
+
+def _undeltas(deltas: Iterable[int]) -> List[int]:
+    value = 0
+    values = []
+    for delta in deltas:
+        value += delta
+        values.append(value)
+    return values
+
+
+def encode_compact(document: Dict) -> Dict:
+    """Encode a Coredoc document in the compact layout.
+    
+    Each chunk becomes a list of COMPACT_FIELDS. Keyword terms are stored
+    once in a string table, and positions and anchors as deltas. What the
+    structure stage derives from other fields is left out: chunk ids, the
+    children, siblings and references of each chunk, its context, link
+    context hints, and a summary that is a prefix of the content, which is
+    kept as its length. decode_compact() restores the document exactly.
+    Raises ValueError for documents whose derived fields do not match.
+    """
+    header = document['document']
+    chunks = document['chunks']
+    text = header.get('text')
+    title = header['title']
+    
+    strings = {}
+    intern = lambda term: strings.setdefault(term, len(strings))
+    parents = [_compact_chunk_index(chunk['parent_page_id'], len(chunks)) for chunk in chunks]
+    relationships = _compact_relationships(parents)
+    
+    encoded = []
+    for index, chunk in enumerate(chunks):
+        content = chunk['content'] if 'content' in chunk else chunk['span']
+        text_content = content if isinstance(content, str) else text[content[0]:content[1]]
+        links = chunk['embedded_links']
+        
+        expected = {
+            'id': f"chunk_{index}",
+            'character_count': len(text_content),
+            'context': f"Part of {title}, section on {chunk['title']}",
+            'relationships': dict(relationships[index], references=[link['target_page_id'] for link in links]),
+        }
+        if any(chunk[key] != value for key, value in expected.items()) or any(
+                link['context_hint'] != f"Related content about {link['keyword']}" for link in links):
+            raise ValueError(f"Chunk {chunk['id']} was not made by the structure stage and cannot be compacted")
+        
+        summary = chunk['summary']
+        if summary and text_content.startswith(summary):
+            summary = len(summary)
+        
+        keywords = chunk['keywords']
+        encoded.append([
+            chunk['title'],
+            chunk['level'],
+            parents[index],
+            content,
+            summary,
+            [intern(keyword['term']) for keyword in keywords],
+            [keyword['importance_score'] for keyword in keywords],
+            [_deltas(keyword['positions']) for keyword in keywords],
+            [intern(link['keyword']) for link in links],
+            [_compact_chunk_index(link['target_page_id'], len(chunks)) for link in links],
+            [_deltas(chain.from_iterable(link['anchors'])) for link in links],
+            [[duplicate['title'], _compact_chunk_index(duplicate['parent'], len(chunks)), duplicate['similarity']]
+             for duplicate in chunk.get('duplicates', ())],
+        ])
+    
+    return {
+        'format': COMPACT_FORMAT,
+        'version': COMPACT_VERSION,
+        'document': header,
+        'strings': list(strings),
+        'fields': list(COMPACT_FIELDS),
+        'chunks': encoded
+    }
+
+
+def _compact_chunk_index(chunk_id: Optional[str], count: int) -> Optional[int]:
+    if chunk_id is None:
+        return None
+    if chunk_id.startswith('chunk_') and chunk_id[6:].isdigit() and int(chunk_id[6:]) < count:
+        return int(chunk_id[6:])
+    raise ValueError(f"Unknown chunk id: {chunk_id}")
+
+
+def _compact_relationships(parents: List[Optional[int]]) -> List[Dict]:
+    """Parent, children and siblings of every chunk, as the structure stage derives them"""
+    chunk_id = 'chunk_{}'.format
+    children_by_parent = defaultdict(list)
+    for index, parent in enumerate(parents):
+        children_by_parent[parent].append(index)
+    
+    relationships = [None] * len(parents)
+    for parent, siblings in children_by_parent.items():
+        for position, index in enumerate(siblings):
+            relationships[index] = {
+                'parent': chunk_id(parent) if parent is not None else None,
+                'children': [chunk_id(child) for child in children_by_parent.get(index, [])],
+                'prev': chunk_id(siblings[position - 1]) if position > 0 else None,
+                'next': chunk_id(siblings[position + 1]) if position < len(siblings) - 1 else None,
+            }
+    return relationships
+
+
+class CompactChunks(Sequence):
+    """The chunks of a compact document, each decoded when it is read.
+    
+    Reading a chunk builds its full output shape, so a viewer that shows a
+    few chunks of a large document never expands the rest.
+    """
+    
+    def __init__(self, compact: Dict):
+        if compact.get('format') != COMPACT_FORMAT or compact.get('version') != COMPACT_VERSION:
+            raise ValueError(f"Not a {COMPACT_FORMAT} document of version {COMPACT_VERSION}")
+        
+        header = compact['document']
+        self._title = header['title']
+        self._text = header.get('text')
+        self._strings = compact['strings']
+        self._fields = [COMPACT_FIELDS.index(field) for field in compact['fields']]
+        self._chunks = compact['chunks']
+        self._relationships = _compact_relationships([self._field(chunk, 'parent') for chunk in self._chunks])
+    
+    def _field(self, chunk: List, name: str):
+        return chunk[self._fields.index(COMPACT_FIELDS.index(name))]
+    
+    def __len__(self) -> int:
+        return len(self._chunks)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        
+        values = dict(zip((COMPACT_FIELDS[field] for field in self._fields), self._chunks[index]))
+        chunk_id = 'chunk_{}'.format
+        strings = self._strings
+        content = values['content']
+        text_content = content if isinstance(content, str) else self._text[content[0]:content[1]]
+        summary = values['summary']
+        
+        links = [{
+            'keyword': strings[term],
+            'target_page_id': chunk_id(target),
+            'context_hint': f"Related content about {strings[term]}",
+            'anchors': [anchors[i:i + 2] for i in range(0, len(anchors), 2)]
+        } for term, target, anchors in zip(values['link_terms'], values['link_targets'],
+                                           map(_undeltas, values['link_anchors']))]
+        parent_id = chunk_id(values['parent']) if values['parent'] is not None else None
+        
+        record = {
+            'id': chunk_id(index),
+            'title': values['title'],
+            'content' if isinstance(content, str) else 'span': content,
+            'level': values['level'],
+            'character_count': len(text_content),
+            'keywords': [{
+                'term': strings[term],
+                'importance_score': score,
+                'positions': _undeltas(positions)
+            } for term, score, positions in zip(values['keyword_terms'], values['keyword_scores'],
+                                                values['keyword_positions'])],
+            'embedded_links': links,
+            'relationships': dict(self._relationships[index],
+                                  references=[link['target_page_id'] for link in links]),
+            'summary': text_content[:summary] if isinstance(summary, int) else summary,
+            'context': f"Part of {self._title}, section on {values['title']}",
+            'parent_page_id': parent_id
+        }
+        
+        if values['duplicates']:
+            record['duplicates'] = [{
+                'title': title,
+                'parent': chunk_id(parent) if parent is not None else None,
+                'similarity': similarity
+            } for title, parent, similarity in values['duplicates']]
+        return record
+
+
+def decode_compact(compact: Dict, lazy: bool = False) -> Dict:
+    """Turn a compact document back into the Coredoc format.
+    
+    With lazy set, chunks is a CompactChunks sequence that decodes each
+    chunk when it is read.
+    """
+    chunks = CompactChunks(compact)
+    return {'document': compact['document'], 'chunks': chunks if lazy else list(chunks)}
+
+
+def write_document(records: Iterable[Dict], f, output_format: str = 'json',
+                   compression: Optional[str] = None) -> int:
+    """Write document records to the binary file f in one of OUTPUT_FORMATS.
+    
+    'json' is the indented Coredoc document, 'ndjson' one compact line per
+    record, 'compact' the encode_compact() layout as compact JSON, and
+    'msgpack' the same layout as MessagePack. compression is None or one of
+    COMPRESSIONS. Returns the number of chunks written.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of: {', '.join(OUTPUT_FORMATS)}")
+    
+    if output_format == 'msgpack':
+        # Fail before any processing when the package is missing
+        msgpack = _msgpack_backend()
+    
+    if compression == 'gzip':
+        out = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
+    elif compression == 'zstd':
+        out = _zstd_backend().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(f, closefd=False)
+    elif compression is None:
+        out = f
+    else:
+        raise ValueError(f"Unknown compression '{compression}', expected one of: {', '.join(COMPRESSIONS)}")
+    
+    try:
+        if output_format == 'ndjson':
+            text = io.TextIOWrapper(out, encoding='utf-8', write_through=True)
+            try:
+                return dump_ndjson(records, text)
+            finally:
+                text.detach()
+        
+        document = collect_document(iter(records))
+        if output_format == 'msgpack':
+            out.write(msgpack.packb(encode_compact(document), use_bin_type=True))
+            return len(document['chunks'])
+        
+        # Streamed through the wrapper rather than built up as one string
+        text = io.TextIOWrapper(out, encoding='utf-8')
+        try:
+            if output_format == 'json':
+                json.dump(document, text, indent=2)
+            else:
+                json.dump(encode_compact(document), text, ensure_ascii=False, separators=(',', ':'))
+        finally:
+            text.detach()
+        return len(document['chunks'])
+    finally:
+        if out is not f:
+            out.close()
+
+
+def load_document(source, lazy: bool = False) -> Dict:
+    """Read a document in any format written by write_document().
+    
+    source is a path or a binary file. The format and compression are
+    detected from the content. With lazy set, the chunks of compact and
+    msgpack documents are decoded as they are read; see decode_compact().
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            data = f.read()
+    else:
+        data = source.read()
+    
+    if data.startswith(GZIP_MAGIC):
+        data = gzip.decompress(data)
+    elif data.startswith(ZSTD_MAGIC):
+        data = _zstd_backend().ZstdDecompressor().decompressobj().decompress(data)
+    
+    if data.lstrip()[:1] == b'{':
+        text = data.decode('utf-8')
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            # More than one record: NDJSON
+            return load_ndjson(io.StringIO(text))
+        if 'document' in value and 'chunks' not in value:
+            return load_ndjson(io.StringIO(text))
+    else:
+        value = _msgpack_backend().unpackb(data, raw=False, strict_map_key=False)
+    
+    if value.get('format') == COMPACT_FORMAT:
+        return decode_compact(value, lazy)
+    return value
+
+
+class CorpusLinker:
+    """Cross-document links between the chunks of many Coredoc documents.
+    
+    The keywords of every chunk go into one term -> chunk postings index.
+    Terms are weighted by their smoothed inverse document frequency across
+    the corpus. Only the max_postings strongest chunks of each term are
+    candidates, so finding the top_k links of a chunk costs at most
+    max_postings steps per keyword, whatever the size of the corpus.
+    """
+    
+    def __init__(self, top_k: int = 5, max_postings: int = 32):
+        self.top_k = top_k
+        self.max_postings = max_postings
+        self.documents = []
+        
+        # Document index and id of every chunk, by global chunk number
+        self._chunk_documents = array('I')
+        self._chunk_ids = []
+        
+        # Keyword term ids and weights of each chunk, flattened
+        self._chunk_starts = array('I', [0])
+        self._chunk_terms = array('I')
+        self._chunk_weights = array('d')
+        
+        self._terms = {}
+        self._term_names = []
+        self._document_frequency = array('I')
+        self._last_document = array('i')
+        self._posting_chunks = []
+        self._posting_weights = []
+    
+    def add_document(self, name: str, document: Dict):
+        """Index the chunk keywords of a document in the Coredoc format"""
+        document_index = len(self.documents)
+        self.documents.append(name)
+        
+        for chunk in document['chunks']:
+            chunk_number = len(self._chunk_ids)
+            self._chunk_documents.append(document_index)
+            self._chunk_ids.append(chunk['id'])
+            
+            # Terms match case-insensitively; keep the best score of each
+            weights = {}
+            for keyword in chunk.get('keywords', ()):
+                term = self._term_id(keyword['term'])
+                weights[term] = max(weights.get(term, 0.0), keyword['importance_score'])
+            
+            for term, weight in weights.items():
+                if self._last_document[term] != document_index:
+                    self._last_document[term] = document_index
+                    self._document_frequency[term] += 1
+                self._posting_chunks[term].append(chunk_number)
+                self._posting_weights[term].append(weight)
+                self._chunk_terms.append(term)
+                self._chunk_weights.append(weight)
+            self._chunk_starts.append(len(self._chunk_terms))
+    
+    def _term_id(self, term: str) -> int:
+        key = term.lower()
+        term_id = self._terms.get(key)
+        if term_id is None:
+            term_id = self._terms[key] = len(self._term_names)
+            self._term_names.append(term)
+            self._document_frequency.append(0)
+            self._last_document.append(-1)
+            self._posting_chunks.append(array('I'))
+            self._posting_weights.append(array('d'))
+        return term_id
+    
+    def stats(self) -> Dict:
+        return {
+            'documents': len(self.documents),
+            'chunks': len(self._chunk_ids),
+            'terms': len(self._term_names),
+        }
+    
+    def iter_links(self) -> Iterator[Dict]:
+        """Yield the links of each chunk that has any, document by document.
+        
+        A chunk's score for another document's chunk is the sum, over their
+        shared terms, of both keyword weights times the squared IDF. Each
+        link names the shared term that contributes most.
+        """
+        document_count = len(self.documents)
+        idf = [math.log((1 + document_count) / (1 + df)) + 1 for df in self._document_frequency]
+        
+        chunk_documents = self._chunk_documents
+        starts = self._chunk_starts
+        
+        # Strongest postings of each term found in more than one document,
+        # as (chunk, document, weight times IDF)
+        candidates = []
+        for term, (chunks, weights) in enumerate(zip(self._posting_chunks, self._posting_weights)):
+            if self._document_frequency[term] < 2:
+                candidates.append({})
+                continue
+            strongest = heapq.nsmallest(self.max_postings, range(len(chunks)), key=lambda i: (-weights[i], i))
+            candidates.append({chunks[i]: (chunk_documents[chunks[i]], weights[i] * idf[term]) for i in strongest})
+        
+        for chunk_number, document_index in enumerate(chunk_documents):
+            scores = defaultdict(float)
+            terms = []
+            
+            for position in range(starts[chunk_number], starts[chunk_number + 1]):
+                term = self._chunk_terms[position]
+                query_weight = self._chunk_weights[position] * idf[term]
+                terms.append((query_weight, term))
+                
+                for other, (other_document, weight) in candidates[term].items():
+                    if other_document != document_index:
+                        scores[other] += query_weight * weight
+            
+            if not scores:
+                continue
+            
+            # Highest scores first, ties in the order the candidates were found
+            top = sorted(scores.items(), key=itemgetter(1), reverse=True)[:self.top_k]
+            links = []
+            for other, score in top:
+                # The shared term contributing most names the link
+                _, term = max((query_weight * candidates[term][other][1], term)
+                              for query_weight, term in terms if other in candidates[term])
+                links.append({
+                    'target_document': self.documents[chunk_documents[other]],
+                    'target_page_id': self._chunk_ids[other],
+                    'keyword': self._term_names[term],
+                    'score': round(score, 6)
+                })
+            
+            yield {
+                'document': self.documents[document_index],
+                'chunk': self._chunk_ids[chunk_number],
+                'links': links
+            }
+
+
+class MinHashIndex:
+    """Near-duplicate detection over MinHash signatures of word shingles.
+    
+    A signature holds the minimum of num_perm hash functions over a text's
+    word shingles; the share of equal entries in two signatures estimates
+    the Jaccard similarity of their shingle sets. Signatures are split into
+    bands, and only texts sharing a whole band are compared, so each lookup
+    touches a few candidates however many texts the index holds. The band
+    shape is the narrowest that still finds pairs at the threshold with
+    probability RECALL.
+    """
+    
+    RECALL = 0.99
+    WORD = re.compile(r'\w+')
+    
+    # Words hashed at once by signatures(), bounding its temporary arrays
+    BLOCK_WORDS = 1 << 18
+    
+    def __init__(self, threshold: float = 0.9, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        np = _numpy_backend()
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        
+        # Random odd multipliers combining word ids into shingles, and
+        # multiply-shift hash functions of the shingles
+        rng = np.random.default_rng(seed)
+        odd = np.uint64(1)
+        self._word_multipliers = rng.integers(0, 1 << 64, shingle_size, dtype=np.uint64) | odd
+        self._multipliers = rng.integers(0, 1 << 64, num_perm, dtype=np.uint64) | odd
+        self._increments = rng.integers(0, 1 << 64, num_perm, dtype=np.uint64)
+        
+        self.rows = max(rows for rows in range(1, num_perm + 1)
+                        if rows == 1 or 1 - (1 - threshold ** rows) ** (num_perm // rows) >= self.RECALL)
+        self.bands = num_perm // self.rows
+        
+        # Word ids start at 1; 0 pads texts shorter than one shingle
+        self._vocabulary = defaultdict(count(1).__next__)
+        
+        self.keys = []
+        self._signatures = np.empty((64, num_perm), dtype=np.uint32)
+        
+        # Per band: band hash -> last text indexed with it, and for each
+        # text the previous one with the same band hash, or -1
+        self._buckets = [{} for _ in range(self.bands)]
+        self._previous = [array('i') for _ in range(self.bands)]
+    
+    def signatures(self, texts: Iterable[str]) -> List:
+        """Signature of every text, or None for texts without words.
+        
+        Texts are hashed in blocks of about BLOCK_WORDS words, and each hash
+        function is applied to all shingles of a block at once.
+        """
+        np = _numpy_backend()
+        size = self.shingle_size
+        word_id = self._vocabulary.__getitem__
+        
+        signatures = []
+        words = array('I')
+        lengths = []
+        for text in texts:
+            ids = list(map(word_id, self.WORD.findall(text.lower())))
+            if 0 < len(ids) < size:
+                ids += [0] * (size - len(ids))
+            words.extend(ids)
+            lengths.append(len(ids))
+            
+            if len(words) >= self.BLOCK_WORDS:
+                signatures += self._block_signatures(np, words, lengths)
+                words = array('I')
+                lengths = []
+        
+        if lengths:
+            signatures += self._block_signatures(np, words, lengths)
+        return signatures
+    
+    def _block_signatures(self, np, words: array, lengths: List[int]) -> List:
+        """Signatures of texts whose word ids are concatenated in words"""
+        size = self.shingle_size
+        lengths = np.array(lengths, dtype=np.intp)
+        windows = np.maximum(lengths - size + 1, 0)
+        has_words = windows > 0
+        if not has_words.any():
+            return [None] * len(lengths)
+        
+        # Shingle values at every word, then only those within one text
+        values = np.frombuffer(words, dtype=np.uint32).astype(np.uint64)
+        span = len(values) - size + 1
+        shingles = values[:span] * self._word_multipliers[0]
+        for offset in range(1, size):
+            shingles += values[offset:offset + span] * self._word_multipliers[offset]
+        shingles ^= shingles >> np.uint64(29)
+        
+        first_word = np.cumsum(lengths) - lengths
+        first_window = np.cumsum(windows) - windows
+        window_text_start = np.repeat(first_word - first_window, windows)
+        shingles = shingles[window_text_start + np.arange(int(windows.sum()))]
+        
+        starts = first_window[has_words]
+        block = np.empty((len(starts), self.num_perm), dtype=np.uint32)
+        shift = np.uint64(32)
+        for function, (multiplier, increment) in enumerate(zip(self._multipliers, self._increments)):
+            block[:, function] = np.minimum.reduceat((shingles * multiplier + increment) >> shift, starts)
+        
+        rows = iter(block)
+        return [next(rows) if words else None for words in has_words.tolist()]
+    
+    def add(self, key, signature) -> Optional[Tuple[object, float]]:
+        """Find the indexed text most similar to signature, or index it under key.
+        
+        Returns (key, similarity) of the match when its estimated similarity
+        reaches the threshold; ties go to the text indexed first. Otherwise
+        the signature is indexed and None is returned.
+        """
+        rows = self.rows
+        band_keys = [hash(signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+        
+        candidates = set()
+        for buckets, previous, band_key in zip(self._buckets, self._previous, band_keys):
+            number = buckets.get(band_key, -1)
+            while number >= 0:
+                candidates.add(number)
+                number = previous[number]
+        
+        if candidates:
+            numbers = sorted(candidates)
+            matches = (self._signatures[numbers] == signature).sum(axis=1)
+            best = int(matches.argmax())
+            similarity = int(matches[best]) / self.num_perm
+            if similarity >= self.threshold:
+                return self.keys[numbers[best]], similarity
+        
+        number = len(self.keys)
+        self.keys.append(key)
+        if number == len(self._signatures):
+            np = _numpy_backend()
+            self._signatures = np.concatenate((self._signatures, np.empty_like(self._signatures)))
+        self._signatures[number] = signature
+        
+        for buckets, previous, band_key in zip(self._buckets, self._previous, band_keys):
+            previous.append(buckets.get(band_key, -1))
+            buckets[band_key] = number
+        return None
+
+
+class MappedTextFile:
+    """A UTF-8 text file read through a memory map.
+    
+    The map is decoded incrementally, block_size bytes at a time, with the
+    universal newlines of open(). It reads like open(filename, encoding='utf-8')
+    without first copying the file into bytes objects, and read() of the
+    whole file decodes it in a single pass.
+    """
+    
+    def __init__(self, filename: str, block_size: int = DEFAULT_STREAM_WINDOW):
+        self.block_size = block_size
+        self._file = open(filename, 'rb')
+        try:
+            self.size = os.fstat(self._file.fileno()).st_size
+            # Empty files cannot be mapped
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        except BaseException:
+            self._file.close()
+            raise
+        
+        # Bytes are decoded straight from the map; an incomplete character at the
+        # end of a block is decoded again with the next one
+        self._newlines = io.IncrementalNewlineDecoder(None, translate=True)
+        self._position = 0
+        self._finished = False
+        
+        # Decoded text not yet returned starts at _cursor
+        self._text = ''
+        self._cursor = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.readline, '')
+    
+    @property
+    def position(self) -> int:
+        """Bytes of the file decoded so far"""
+        return self._position
+    
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+    
+    def _fill(self, size: Optional[int]) -> bool:
+        """Decode up to size more bytes, or the rest of the file; False once it is all decoded"""
+        if self._finished:
+            return False
+        
+        # A block of four bytes holds at least one whole character
+        end = self.size if size is None else min(self.size, self._position + max(size, 4))
+        final = end == self.size
+        view = memoryview(self._map)[self._position:end]
+        try:
+            decoded, consumed = codecs.utf_8_decode(view, 'strict', final)
+        finally:
+            # A decoding error must not keep the map exported
+            view.release()
+        self._position += consumed
+        self._finished = final
+        
+        self._text = self._text[self._cursor:] + self._newlines.decode(decoded, final)
+        self._cursor = 0
+        return True
+    
+    def read(self, size: int = -1) -> str:
+        """Read up to size characters, or the rest of the file"""
+        if size < 0:
+            self._fill(None)
+        else:
+            while len(self._text) - self._cursor < size and self._fill(self.block_size):
+                pass
+        
+        end = len(self._text) if size < 0 else min(len(self._text), self._cursor + size)
+        text = self._text[self._cursor:end]
+        self._cursor = end
+        return text
+    
+    def readline(self, size: int = -1) -> str:
+        """Read one line including its line break, or at most size characters of it"""
+        # Characters after the cursor known to hold no line break
+        searched = 0
+        
+        while True:
+            newline = self._text.find('\n', self._cursor + searched)
+            if newline >= 0:
+                end = newline + 1
+                break
+            searched = len(self._text) - self._cursor
+            if 0 <= size <= searched or not self._fill(self.block_size):
+                end = len(self._text)
+                break
+        
+        if 0 <= size < end - self._cursor:
+            end = self._cursor + size
+        line = self._text[self._cursor:end]
+        self._cursor = end
+        return line
+
+
+def has_min_length(filename: str, characters: int) -> bool:
+    """Whether a UTF-8 text file holds at least the given number of characters.
+    
+    Every character takes one to four bytes, so the file size decides
+    without reading the file unless it lies between those bounds.
+    """
+    size = os.path.getsize(filename)
+    if size < characters:
+        return False
+    if size >= 4 * characters:
+        return True
+    
+    with MappedTextFile(filename) as f:
+        return len(f.read()) >= characters
+
+
 def main():
     parser = argparse.ArgumentParser(description='Process documents into Coredoc format')
     parser.add_argument('input', help='Input text file path')
-    parser.add_argument('-o', '--output', help='Output JSON file path', default='output.json')
+    parser.add_argument('-o', '--output', help='Output JSON file path, or - for stdout', default='output.json')
     parser.add_argument('-t', '--title', help='Document title', default='Untitled Document')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read the input incrementally; the finished chunks are still held in memory')
+    parser.add_argument('--window', type=int, default=DEFAULT_STREAM_WINDOW,
+                        help='Characters held at once in streaming mode; a longer sentence or heading line '
+                             'is split where batch mode would keep it whole')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='json',
+                        help='Output format: indented JSON, a header line plus one compact line per chunk, '
+                             'or the compact layout with a string table as JSON or MessagePack')
+    parser.add_argument('--compress', choices=COMPRESSIONS,
+                        help='Compress the output')
+    parser.add_argument('--offline', action='store_true',
+                        help='Fail instead of downloading missing NLTK data')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record per-stage timings and counters in the output and print a summary')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='Write per-stage metrics in Prometheus text format (implies --profile)')
+    parser.add_argument('--stages', metavar='SPEC', type=parse_stage_config, default={},
+                        help='Stage implementations, e.g. links=off,summaries=off '
+                             f"(stages: {', '.join(PIPELINE_STAGES)})")
+    parser.add_argument('--duplicate-threshold', type=float, default=0.9,
+                        help='Similarity above which the duplicates=minhash stage collapses chunks')
+    parser.add_argument('--offsets', action='store_true',
+                        help='Keep chunks as offsets into the normalized text and write that text once '
+                             'in the header, with a [start, end] span per chunk instead of its content')
+    parser.add_argument('--progress', action='store_true',
+                        help='Write progress events to stderr as JSON lines')
+    parser.add_argument('--time-budget', type=float, metavar='SECONDS',
+                        help=f"Cut short or skip the optional stages ({', '.join(OPTIONAL_STAGES)}) "
+                             'once processing has taken this long; the other stages always finish')
     
     args = parser.parse_args()
     
-    # Read input file
-    with open(args.input, 'r', encoding='utf-8') as f:
-        text = f.read()
+    if args.offsets:
+        if args.stream:
+            parser.error('--offsets needs the whole text and cannot be combined with --stream')
+        args.stages = {'chunks': 'offsets', 'structure': 'offsets', **args.stages}
+    
+    if args.offline:
+        global OFFLINE
+        OFFLINE = True
+    
+    def report_progress(event: ProgressEvent):
+        sys.stderr.write(json.dumps(event.to_dict(), separators=(',', ':')) + '\n')
+        sys.stderr.flush()
+    
+    try:
+        processor = CoredocProcessor(profile=args.profile or bool(args.metrics), stages=args.stages,
+                                     duplicate_threshold=args.duplicate_threshold,
+                                     on_progress=report_progress if args.progress else None,
+                                     time_budget=args.time_budget)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    # The first SIGINT or SIGTERM stops processing at the next checkpoint,
+    # a second one at once, also outside the stage loops
+    interrupted = []
+    
+    def interrupt(signum, frame):
+        if interrupted:
+            raise KeyboardInterrupt
+        interrupted.append(signum)
+        processor.cancel()
+    
+    handlers = {signum: signal.signal(signum, interrupt) for signum in (signal.SIGINT, signal.SIGTERM)}
+    
+    to_stdout = args.output == '-'
+    out = sys.stdout.buffer if to_stdout else open(args.output, 'wb')
+    
+    try:
+        with MappedTextFile(args.input) as f:
+            if args.stream:
+                records = processor.iter_stream_document(f, args.title, args.window)
+            else:
+                # Read input file
+                records = processor.iter_document(f.read(), args.title)
+            
+            # Write output
+            total_chunks = write_document(records, out, args.format, args.compress)
+        
+        # Interrupted after the last checkpoint
+        if interrupted:
+            raise KeyboardInterrupt
+    except BaseException as e:
+        # Leave no partial output behind, whatever stopped processing
+        if not to_stdout:
+            out.close()
+            os.remove(args.output)
+        if not isinstance(e, (ProcessingCancelled, KeyboardInterrupt)):
+            raise
+        print(str(e) or "Processing interrupted", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        if not to_stdout:
+            out.close()
+    
+    # Keep stdout clean when it carries the document
+    log = sys.stderr if to_stdout else sys.stdout
+    print(f"Document processed successfully!", file=log)
+    print(f"Total chunks: {total_chunks}", file=log)
+    print(f"Output saved to: {args.output}", file=log)
     
-    # Process document
-    processor = CoredocProcessor()
-    document = processor.process_text(text, args.title)
+    stats = processor.last_stats
+    if stats is None:
+        return
     
-    # Write output
-    with open(args.output, 'w', encoding='utf-8') as f:
-        json.dump(document, f, indent=2)
+    if args.metrics:
+        with open(args.metrics, 'w', encoding='utf-8') as f:
+            f.write(stats.to_prometheus({'document': args.title}))
+        print(f"Metrics saved to: {args.metrics}", file=log)
     
-    print(f"Document processed successfully!")
-    print(f"Total chunks: {document['document']['total_chunks']}")
-    print(f"Output saved to: {args.output}")
+    print(f"\n{'stage':<12} {'wall s':>10} {'cpu s':>10} {'peak KiB':>10}", file=log)
+    for name, stage in stats.stages.items():
+        print(f"{name:<12} {stage['wall_seconds']:>10.4f} {stage['cpu_seconds']:>10.4f} "
+              f"{stage['peak_bytes'] / 1024:>10.1f}", file=log)
+    print(', '.join(f"{name}: {value}" for name, value in stats.counters.items()), file=log)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Coredoc Worker
+
+Long-lived Coredoc processor used by the web app's /api/process route.
+NLTK, the tokenizer models and the stopword set are loaded once when the
+worker starts, and documents are then exchanged as JSON lines:
+
+    stdin:  {"id": "42", "text": "...", "title": "My Document", "time_budget": 30}
+    stdout: {"id": "42", "document": {...}}
+            {"id": "42", "error": "..."}
+
+A single {"ready": true} line is written once the worker is warm. With a
+time_budget in seconds, the optional stages of a long document are cut
+short once it is spent, so the job finishes before the caller gives up on
+the worker.
+"""
+
+import json
+import sys
+
+WARMUP_TEXT = "Coredoc worker warm-up. The tokenizer models are loaded here."
+
+
+def serve(requests, responses):
+    """Answer one JSON job per input line until the input is closed"""
+    from coredoc import CoredocProcessor
+    
+    processor = CoredocProcessor()
+    
+    # Load the tokenizer models before taking jobs
+    processor.process_text(WARMUP_TEXT)
+    
+    def send(message):
+        responses.write(json.dumps(message, separators=(',', ':')) + '\n')
+        responses.flush()
+    
+    send({'ready': True})
+    
+    for line in requests:
+        if not line.strip():
+            continue
+        
+        job_id = None
+        try:
+            job = json.loads(line)
+            job_id = job.get('id')
+            processor.time_budget = job.get('time_budget')
+            document = processor.process_text(job['text'], job.get('title') or 'Untitled Document')
+            send({'id': job_id, 'document': document})
+        except Exception as e:
+            send({'id': job_id, 'error': str(e)})
+
+
+def main():
+    # Keep stray output (such as NLTK download messages) off the protocol stream
+    responses = sys.stdout
+    sys.stdout = sys.stderr
+    
+    serve(sys.stdin, responses)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import { CoredocDocument, DocumentChunk, DocumentMetadata, ProcessingStats } from "@/types/document";
+
+// Reader for the NDJSON output of `coredoc.py --format ndjson`: a
+// {"document": {...}} header line followed by one compact line per chunk,
+// and with --profile a final {"processing_stats": {...}} line. With --offsets
+// chunks carry a span of the header's text, which is resolved into content.
+
+interface HeaderRecord {
+  document: DocumentMetadata;
+}
+
+interface StatsRecord {
+  processing_stats: ProcessingStats;
+}
+
+const isHeader = (record: unknown): record is HeaderRecord =>
+  typeof record === "object" && record !== null && "document" in record;
+
+const isStats = (record: unknown): record is StatsRecord =>
+  typeof record === "object" && record !== null && "processing_stats" in record;
+
+// Spans count code points, which only differ from string indexes when the
+// text has characters outside the Basic Multilingual Plane
+const contentResolver = (metadata: DocumentMetadata) => {
+  const text = metadata.text;
+  const codePoints = text !== undefined && /[\uD800-\uDFFF]/.test(text) ? Array.from(text) : null;
+
+  return (chunk: DocumentChunk): DocumentChunk => {
+    if (!chunk.span || text === undefined) {
+      return chunk;
+    }
+    const [start, end] = chunk.span;
+    const content = codePoints ? codePoints.slice(start, end).join("") : text.slice(start, end);
+    return { ...chunk, content };
+  };
+};
+
+// Parse a complete NDJSON document into the regular CoredocDocument shape
+export const parseCoredocNdjson = (text: string): CoredocDocument => {
+  const records = text
+    .split("\n")
+    .filter((line) => line.trim())
+    .map((line) => JSON.parse(line) as unknown);
+
+  const [header, ...chunks] = records;
+  if (!isHeader(header)) {
+    throw new Error("NDJSON input does not start with a document header");
+  }
+
+  const resolve = contentResolver(header.document);
+  const last = chunks[chunks.length - 1];
+  if (isStats(last)) {
+    chunks.pop();
+    return {
+      document: { ...header.document, processing_stats: last.processing_stats },
+      chunks: (chunks as DocumentChunk[]).map(resolve),
+    };
+  }
+
+  return { document: header.document, chunks: (chunks as DocumentChunk[]).map(resolve) };
+};
+
+// Read NDJSON progressively, reporting the header and each chunk as its line arrives
+export const readCoredocNdjson = async (
+  stream: ReadableStream<Uint8Array>,
+  onChunk?: (chunk: DocumentChunk, document: DocumentMetadata) => void
+): Promise<CoredocDocument> => {
+  const reader = stream.pipeThrough(new TextDecoderStream()).getReader();
+  let metadata: DocumentMetadata | null = null;
+  let resolve: (chunk: DocumentChunk) => DocumentChunk = (chunk) => chunk;
+  const chunks: DocumentChunk[] = [];
+  let buffered = "";
+
+  const handleLine = (line: string) => {
+    if (!line.trim()) {
+      return;
+    }
+
+    const record = JSON.parse(line) as unknown;
+    if (!metadata) {
+      if (!isHeader(record)) {
+        throw new Error("NDJSON input does not start with a document header");
+      }
+      metadata = record.document;
+      resolve = contentResolver(metadata);
+      return;
+    }
+
+    if (isStats(record)) {
+      metadata.processing_stats = record.processing_stats;
+      return;
+    }
+
+    const chunk = resolve(record as DocumentChunk);
+    chunks.push(chunk);
+    onChunk?.(chunk, metadata);
+  };
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) {
+      break;
+    }
+
+    buffered += value;
+    const lines = buffered.split("\n");
+    buffered = lines.pop()!;
+    lines.forEach(handleLine);
+  }
+  handleLine(buffered);
+
+  if (!metadata) {
+    throw new Error("NDJSON input is empty");
+  }
+
+  return { document: metadata, chunks };
+};
@@ -0,0 +1,260 @@
+import { spawn, ChildProcessWithoutNullStreams } from "child_process";
+import { createInterface } from "readline";
+import path from "path";
+import { CoredocDocument } from "@/types/document";
+
+// Pool of warm Python workers (coredoc-processor/worker.py) that process
+// documents over a JSON-lines protocol on stdin/stdout.
+
+const WORKER_SCRIPT = path.join(process.cwd(), "coredoc-processor", "worker.py");
+const RESPAWN_DELAY_MS = 1000;
+
+// Share of a job's remaining time given to the worker as its time budget.
+// Past the budget the worker skips optional stages such as links, leaving
+// the rest of the timeout to finish the document.
+const TIME_BUDGET_SHARE = 0.6;
+
+export interface ProcessorPoolOptions {
+  python: string;
+  size: number; // Number of warm workers
+  maxQueue: number; // Jobs allowed to wait for a free worker
+  jobTimeoutMs: number; // Covers both queueing and processing
+  maxJobsPerWorker: number; // Workers are recycled after this many jobs
+}
+
+const readNumber = (name: string, fallback: number): number => {
+  const value = Number(process.env[name]);
+  return Number.isFinite(value) && value > 0 ? value : fallback;
+};
+
+export const defaultPoolOptions = (): ProcessorPoolOptions => ({
+  python: process.env.COREDOC_PYTHON || "python3",
+  size: readNumber("COREDOC_POOL_SIZE", 2),
+  maxQueue: readNumber("COREDOC_POOL_QUEUE", 16),
+  jobTimeoutMs: readNumber("COREDOC_JOB_TIMEOUT_MS", 120000),
+  maxJobsPerWorker: readNumber("COREDOC_WORKER_MAX_JOBS", 100),
+});
+
+// Raised when every worker is busy and the queue is full
+export class PoolBusyError extends Error {
+  constructor() {
+    super("Processor pool is busy");
+    this.name = "PoolBusyError";
+  }
+}
+
+export class JobTimeoutError extends Error {
+  constructor(timeoutMs: number) {
+    super(`Processing timed out after ${timeoutMs}ms`);
+    this.name = "JobTimeoutError";
+  }
+}
+
+interface Job {
+  id: string;
+  text: string;
+  title?: string;
+  resolve: (document: CoredocDocument) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+  queuedAt: number;
+  worker?: Worker;
+}
+
+interface Worker {
+  child: ChildProcessWithoutNullStreams;
+  ready: boolean;
+  job: Job | null;
+  jobsDone: number;
+  retired: boolean;
+}
+
+interface WorkerMessage {
+  id?: string;
+  ready?: boolean;
+  document?: CoredocDocument;
+  error?: string;
+}
+
+export class ProcessorPool {
+  private workers = new Set<Worker>();
+  private queue: Job[] = [];
+  private nextJobId = 0;
+
+  constructor(private options: ProcessorPoolOptions = defaultPoolOptions()) {
+    for (let i = 0; i < options.size; i++) {
+      this.spawnWorker();
+    }
+  }
+
+  process(text: string, title?: string): Promise<CoredocDocument> {
+    const idle = this.idleWorker();
+
+    if (!idle && this.queue.length >= this.options.maxQueue) {
+      return Promise.reject(new PoolBusyError());
+    }
+
+    return new Promise((resolve, reject) => {
+      const job: Job = {
+        id: String(this.nextJobId++),
+        text,
+        title,
+        resolve,
+        reject,
+        timer: setTimeout(() => this.timeout(job), this.options.jobTimeoutMs),
+        queuedAt: Date.now(),
+      };
+
+      this.queue.push(job);
+      this.dispatch();
+    });
+  }
+
+  private idleWorker(): Worker | undefined {
+    for (const worker of this.workers) {
+      if (worker.ready && !worker.job && !worker.retired) {
+        return worker;
+      }
+    }
+    return undefined;
+  }
+
+  private dispatch() {
+    let worker = this.idleWorker();
+
+    while (worker && this.queue.length > 0) {
+      const job = this.queue.shift()!;
+      job.worker = worker;
+      worker.job = job;
+
+      const remainingMs = this.options.jobTimeoutMs - (Date.now() - job.queuedAt);
+      const timeBudget = (Math.max(remainingMs, 0) * TIME_BUDGET_SHARE) / 1000;
+      worker.child.stdin.write(
+        JSON.stringify({ id: job.id, text: job.text, title: job.title, time_budget: timeBudget }) + "\n"
+      );
+      worker = this.idleWorker();
+    }
+  }
+
+  private spawnWorker() {
+    const child = spawn(this.options.python, [WORKER_SCRIPT], {
+      cwd: path.dirname(WORKER_SCRIPT),
+    });
+    const worker: Worker = { child, ready: false, job: null, jobsDone: 0, retired: false };
+    this.workers.add(worker);
+
+    createInterface({ input: child.stdout }).on("line", (line) => {
+      this.handleMessage(worker, line);
+    });
+
+    // Writes to a dying worker fail with EPIPE; its "exit" handler cleans up
+    child.stdin.on("error", () => {});
+
+    child.stderr.on("data", (data) => {
+      console.error(`[coredoc worker ${child.pid}] ${data.toString().trimEnd()}`);
+    });
+
+    child.on("error", (error) => {
+      console.error("Failed to start coredoc worker:", error);
+
+      // A worker that never started does not emit "exit"
+      if (child.pid === undefined) {
+        this.workers.delete(worker);
+        setTimeout(() => this.spawnWorker(), RESPAWN_DELAY_MS).unref();
+      }
+    });
+
+    child.on("exit", () => {
+      this.workers.delete(worker);
+
+      if (worker.job) {
+        this.finish(worker.job, new Error("Coredoc worker exited unexpectedly"));
+      }
+
+      if (!worker.retired) {
+        // Crashed workers are replaced after a delay to avoid a spawn loop
+        const delay = worker.ready ? 0 : RESPAWN_DELAY_MS;
+        setTimeout(() => this.spawnWorker(), delay).unref();
+      }
+    });
+  }
+
+  private handleMessage(worker: Worker, line: string) {
+    let message: WorkerMessage;
+
+    try {
+      message = JSON.parse(line) as WorkerMessage;
+    } catch {
+      console.error("Invalid message from coredoc worker:", line.slice(0, 200));
+      return;
+    }
+
+    if (message.ready) {
+      worker.ready = true;
+      this.dispatch();
+      return;
+    }
+
+    const job = worker.job;
+    if (!job || message.id !== job.id) {
+      return;
+    }
+
+    worker.job = null;
+    worker.jobsDone++;
+
+    if (message.error || !message.document) {
+      this.finish(job, new Error(`Python processing failed: ${message.error}`));
+    } else {
+      this.finish(job, null, message.document);
+    }
+
+    if (worker.jobsDone >= this.options.maxJobsPerWorker) {
+      this.recycle(worker);
+    }
+
+    this.dispatch();
+  }
+
+  private timeout(job: Job) {
+    const queued = this.queue.indexOf(job);
+    if (queued !== -1) {
+      this.queue.splice(queued, 1);
+    }
+
+    const worker = job.worker;
+    this.finish(job, new JobTimeoutError(this.options.jobTimeoutMs));
+
+    // A worker stuck on a job is replaced rather than waited for
+    if (worker && worker.job === job) {
+      worker.job = null;
+      this.recycle(worker);
+    }
+  }
+
+  private recycle(worker: Worker) {
+    worker.retired = true;
+    worker.child.kill();
+    this.spawnWorker();
+  }
+
+  private finish(job: Job, error: Error | null, document?: CoredocDocument) {
+    clearTimeout(job.timer);
+
+    if (error) {
+      job.reject(error);
+    } else {
+      job.resolve(document!);
+    }
+  }
+}
+
+// Keep a single pool per server process, including across dev hot reloads
+const globalForPool = globalThis as unknown as { coredocPool?: ProcessorPool };
+
+export const getProcessorPool = (): ProcessorPool => {
+  if (!globalForPool.coredocPool) {
+    globalForPool.coredocPool = new ProcessorPool();
+  }
+  return globalForPool.coredocPool;
+};
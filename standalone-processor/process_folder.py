@@ -1,4 +1,3 @@
-#!/usr/bin/env python3
 """
 COREDOC Folder Processor
 
@@ -6,481 +5,515 @@ This script processes all .txt files in the current directory and converts them
 into COREDOC format. Each file is processed into a separate .json output file,
 and an index.json file is created listing all processed documents.
 
+Processing is done by the Coredoc engine in coredoc.py, found next to this
+script or in ../coredoc-processor.
+
 Usage:
-    python process_folder.py
+    python process_folder.py [--jobs N] [--force] [--stream] [--stages SPEC] [--corpus-links]
+                             [--duplicate-threshold T] [--corpus-duplicates]
 """
 
 import json
-import re
 import hashlib
 import os
 import sys
-from typing import List, Dict, Tuple, Optional, Set
-from collections import defaultdict
+from typing import List, Dict, Optional
 from datetime import datetime
-import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords
+from itertools import chain
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import argparse
 
-# Download required NLTK data
 try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    print("Downloading NLTK punkt tokenizer...")
-    nltk.download('punkt', quiet=True)
+    import coredoc
+except ImportError:
+    # Running from a checkout of the repository
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'coredoc-processor'))
+    import coredoc
 
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    print("Downloading NLTK stopwords...")
-    nltk.download('stopwords', quiet=True)
+from coredoc import (CoredocProcessor, CorpusLinker, MappedTextFile, MinHashIndex, PIPELINE_STAGES,
+                     dump_ndjson, has_min_length, parse_stage_config)
 
+# Bump when a processing change should invalidate previously generated outputs
+PROCESSOR_VERSION = 4
 
-class CoredocProcessor:
-    def __init__(self, min_chunk_size: int = 500, max_chunk_size: int = 2000):
-        self.min_chunk_size = min_chunk_size
-        self.max_chunk_size = max_chunk_size
-        self.stop_words = set(stopwords.words('english'))
-        
-    def process_text(self, text: str, title: str = "Untitled Document") -> Dict:
-        """Process text into a Coredoc format"""
-        # Clean and preprocess text
-        text = self._clean_text(text)
-        
-        # Extract hierarchical structure
-        sections = self._extract_sections(text)
-        
-        # Create chunks from sections
-        chunks = self._create_chunks(sections)
-        
-        # Extract keywords and create links
-        chunks = self._extract_keywords_and_links(chunks)
-        
-        # Build document structure
-        document = self._build_document_structure(chunks, title)
-        
-        return document
-    
-    def _clean_text(self, text: str) -> str:
-        """Clean and normalize text"""
-        # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        return text.strip()
-    
-    def _extract_sections(self, text: str) -> List[Dict]:
-        """Extract hierarchical sections from text"""
-        sections = []
-        
-        # Common heading patterns
-        heading_patterns = [
-            (r'^#{1,6}\s+(.+)$', 'markdown'),
-            (r'^([A-Z][A-Z\s]+)$', 'caps'),
-            (r'^(\d+\.?\s+.+)$', 'numbered'),
-            (r'^([IVX]+\.\s+.+)$', 'roman'),
-        ]
-        
-        lines = text.split('\n')
-        current_section = {
-            'title': 'Introduction',
-            'content': [],
-            'level': 0,
-            'children': []
-        }
-        
-        for i, line in enumerate(lines):
-            is_heading = False
-            
-            for pattern, style in heading_patterns:
-                match = re.match(pattern, line.strip())
-                if match:
-                    # Save current section if it has content
-                    if current_section['content']:
-                        sections.append(current_section)
-                    
-                    # Determine level based on style
-                    level = self._determine_heading_level(line, style)
-                    
-                    current_section = {
-                        'title': match.group(1).strip(),
-                        'content': [],
-                        'level': level,
-                        'children': []
-                    }
-                    is_heading = True
-                    break
-            
-            if not is_heading and line.strip():
-                current_section['content'].append(line)
-        
-        # Add last section
-        if current_section['content']:
-            sections.append(current_section)
-        
-        # If no sections found, create one from the entire text
-        if not sections:
-            sections = [{
-                'title': 'Main Content',
-                'content': lines,
-                'level': 0,
-                'children': []
-            }]
-        
-        return self._build_hierarchy(sections)
-    
-    def _determine_heading_level(self, line: str, style: str) -> int:
-        """Determine heading level based on style"""
-        if style == 'markdown':
-            return line.count('#') - 1
-        elif style == 'caps':
-            return 1
-        elif style == 'numbered':
-            # Count dots or indentation
-            dots = line.count('.')
-            return min(dots, 3)
-        elif style == 'roman':
-            return 2
-        return 0
-    
-    def _build_hierarchy(self, sections: List[Dict]) -> List[Dict]:
-        """Build hierarchical structure from flat sections"""
-        if not sections:
-            return []
-        
-        root_sections = []
-        stack = []
-        
-        for section in sections:
-            # Find parent
-            while stack and stack[-1]['level'] >= section['level']:
-                stack.pop()
-            
-            if stack:
-                # Add as child to parent
-                stack[-1]['children'].append(section)
-            else:
-                # Add as root section
-                root_sections.append(section)
-            
-            stack.append(section)
-        
-        return root_sections
+# Records input hashes and settings of processed files between runs
+MANIFEST_FILE = '.coredoc-manifest.json'
+
+# Documents listed for the viewer
+INDEX_FILE = 'index.json'
+
+# Shorter files are skipped
+MIN_CHARACTERS = 1000
+
+# Cross-document links between the chunks of all processed documents
+CORPUS_LINKS_FILE = 'corpus-links.ndjson'
+
+# Near-duplicate chunks found across all processed documents
+CORPUS_DUPLICATES_FILE = 'corpus-duplicates.ndjson'
+
+
+def _now() -> str:
+    return datetime.now().isoformat() + 'Z'
+
+
+def _create_processor(stages: Optional[Dict[str, str]] = None, duplicate_threshold: float = 0.9,
+                      time_budget: Optional[float] = None) -> CoredocProcessor:
+    """Processor stamping each document with the time it was processed"""
+    return CoredocProcessor(stages=stages, clock=_now, duplicate_threshold=duplicate_threshold,
+                            time_budget=time_budget)
+
+
+def process_file(processor: CoredocProcessor, filename: str, stream: bool = False,
+                 title: Optional[str] = None) -> Dict:
+    """Process one .txt file and write its .coredoc.json output.
     
-    def _create_chunks(self, sections: List[Dict]) -> List[Dict]:
-        """Create chunks from sections"""
-        chunks = []
-        chunk_id = 0
-        
-        def process_section(section: Dict, parent_id: Optional[str] = None, level: int = 0):
-            nonlocal chunk_id
-            
-            content = '\n'.join(section['content'])
-            
-            # Split large sections into smaller chunks
-            if len(content) > self.max_chunk_size:
-                sub_chunks = self._split_into_chunks(content)
-                
-                for i, sub_content in enumerate(sub_chunks):
-                    chunk = {
-                        'id': f'chunk_{chunk_id}',
-                        'title': f"{section['title']} (Part {i+1})" if len(sub_chunks) > 1 else section['title'],
-                        'content': sub_content,
-                        'level': level,
-                        'parent_id': parent_id,
-                        'character_count': len(sub_content),
-                        'keywords': [],
-                        'embedded_links': []
-                    }
-                    chunks.append(chunk)
-                    
-                    if i == 0:
-                        first_chunk_id = chunk['id']
-                    
-                    chunk_id += 1
-                
-                parent_id = first_chunk_id
-            else:
-                chunk = {
-                    'id': f'chunk_{chunk_id}',
-                    'title': section['title'],
-                    'content': content,
-                    'level': level,
-                    'parent_id': parent_id,
-                    'character_count': len(content),
-                    'keywords': [],
-                    'embedded_links': []
-                }
-                chunks.append(chunk)
-                parent_id = chunk['id']
-                chunk_id += 1
-            
-            # Process children
-            for child in section['children']:
-                process_section(child, parent_id, level + 1)
-        
-        # Process all root sections
-        for section in sections:
-            process_section(section)
-        
-        return chunks
-    
-    def _split_into_chunks(self, text: str) -> List[str]:
-        """Split text into chunks of appropriate size"""
-        sentences = sent_tokenize(text)
-        chunks = []
-        current_chunk = []
-        current_size = 0
-        
-        for sentence in sentences:
-            sentence_size = len(sentence)
-            
-            if current_size + sentence_size > self.max_chunk_size and current_chunk:
-                chunks.append(' '.join(current_chunk))
-                current_chunk = [sentence]
-                current_size = sentence_size
+    The file is memory-mapped and decoded from the map, incrementally when
+    stream is set. The title defaults to one made from the file name.
+    Returns a result dict whose 'status' is 'processed', 'skipped' or
+    'error', so failures stay isolated to the file that caused them.
+    """
+    try:
+        if not title:
+            title = os.path.splitext(os.path.basename(filename))[0].replace('-', ' ').replace('_', ' ').title()
+        
+        # Check minimum length, from the file size where possible
+        if not has_min_length(filename, MIN_CHARACTERS):
+            return {'status': 'skipped', 'filename': filename}
+        
+        with MappedTextFile(filename) as f:
+            if stream:
+                document = processor.process_stream(f, title)
             else:
-                current_chunk.append(sentence)
-                current_size += sentence_size
-        
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
+                document = processor.process_text(f.read(), title)
+        
+        # Save output
+        output_filename = os.path.splitext(filename)[0] + '.coredoc.json'
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2)
+        
+        return {
+            'status': 'processed',
+            'filename': filename,
+            'max_depth': document['document']['max_depth'],
+            'degraded': document['document'].get('degraded_stages', []),
+            'entry': {
+                'filename': output_filename,
+                'title': title,
+                'chunks': document['document']['total_chunks'],
+                'created': document['document']['created_at']
+            }
+        }
         
-        return chunks
+    except Exception as e:
+        return {'status': 'error', 'filename': filename, 'error': str(e)}
+
+
+# Processor owned by each worker of the parallel pool
+_worker_processor = None
+
+
+def _init_worker(stages: Optional[Dict[str, str]], duplicate_threshold: float,
+                 time_budget: Optional[float] = None):
+    """Create the processor once per worker process"""
+    global _worker_processor
+    _worker_processor = _create_processor(stages, duplicate_threshold, time_budget)
+
+
+def _process_file_in_worker(filename: str, stream: bool, title: Optional[str] = None) -> Dict:
+    return process_file(_worker_processor, filename, stream, title)
+
+
+def _report(result: Dict):
+    """Print the outcome of one processed file"""
+    filename = result['filename']
     
-    def _extract_keywords_and_links(self, chunks: List[Dict]) -> List[Dict]:
-        """Extract keywords and create embedded links between chunks"""
-        # Extract keywords from each chunk
-        chunk_keywords = {}
-        
-        for chunk in chunks:
-            keywords = self._extract_keywords(chunk['content'])
-            chunk['keywords'] = keywords
-            chunk_keywords[chunk['id']] = set(kw['term'] for kw in keywords)
-        
-        # Create links between chunks based on keyword overlap
-        for i, chunk in enumerate(chunks):
-            links = []
-            chunk_terms = chunk_keywords[chunk['id']]
+    if result['status'] == 'skipped':
+        print(f"  ⚠️  Skipping {filename} - too short (minimum {MIN_CHARACTERS} characters)")
+    elif result['status'] == 'error':
+        print(f"  ✗ Error processing {filename}: {result['error']}\n")
+    else:
+        entry = result['entry']
+        print(f"  ✓ Processed successfully!")
+        print(f"    - Total chunks: {entry['chunks']}")
+        print(f"    - Max depth: {result['max_depth']}")
+        if result['degraded']:
+            print(f"    - Cut short by the time budget: {', '.join(result['degraded'])}")
+        print(f"    - Output: {entry['filename']}\n")
+
+
+def _process_serial(processor: CoredocProcessor, txt_files: List[str], stream: bool):
+    """Yield file results one at a time in this process"""
+    for filename in txt_files:
+        print(f"Processing {filename}...")
+        yield process_file(processor, filename, stream)
+
+
+def _pool_results(files: deque, jobs: int, stream: bool, initargs: tuple):
+    """Yield file results from one process pool, with at most jobs files in flight.
+    
+    Files are taken from the front of files as workers free up. If a
+    worker crashes, the pool is broken and every file still in flight
+    fails with it; those files are returned, and the files not submitted
+    yet stay in files.
+    """
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=initargs) as executor:
+        futures = {}
+        crashed = []
+        while (files or futures) and not crashed:
+            while files and len(futures) < jobs:
+                filename = files.popleft()
+                futures[executor.submit(_process_file_in_worker, filename, stream)] = filename
             
-            for j, other_chunk in enumerate(chunks):
-                if i == j:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename = futures.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    crashed.append(filename)
                     continue
+                except Exception as e:
+                    result = {'status': 'error', 'filename': filename, 'error': str(e)}
                 
-                other_terms = chunk_keywords[other_chunk['id']]
-                common_terms = chunk_terms.intersection(other_terms)
-                
-                if common_terms:
-                    # Find the most important common term
-                    best_term = max(common_terms, key=lambda t: 
-                        next(kw['importance_score'] for kw in chunk['keywords'] if kw['term'] == t))
-                    
-                    # Check if this term appears in the current chunk's content
-                    if re.search(r'\b' + re.escape(best_term) + r'\b', chunk['content'], re.IGNORECASE):
-                        links.append({
-                            'keyword': best_term,
-                            'target_page_id': other_chunk['id'],
-                            'context_hint': f"Related content about {best_term}"
-                        })
-            
-            # Limit links per chunk
-            chunk['embedded_links'] = sorted(links, 
-                key=lambda l: len(l['keyword']), reverse=True)[:5]
+                print(f"Finished {filename}:")
+                yield result
         
-        return chunks
+        return crashed + list(futures.values())
+
+
+def _process_parallel(txt_files: List[str], jobs: int, stream: bool, stages: Optional[Dict[str, str]],
+                      duplicate_threshold: float, time_budget: Optional[float]):
+    """Yield file results from a process pool as each file finishes.
     
-    def _extract_keywords(self, text: str) -> List[Dict]:
-        """Extract keywords from text"""
-        # Tokenize and filter
-        words = word_tokenize(text.lower())
-        words = [w for w in words if w.isalnum() and w not in self.stop_words and len(w) > 3]
-        
-        # Count frequency
-        word_freq = defaultdict(int)
-        for word in words:
-            word_freq[word] += 1
-        
-        # Extract noun phrases (simple approach)
-        noun_phrases = self._extract_noun_phrases(text)
-        
-        # Combine and score
-        keywords = []
-        
-        # Add single words
-        for word, freq in word_freq.items():
-            if freq > 1:  # Appears more than once
-                keywords.append({
-                    'term': word,
-                    'importance_score': freq / len(words),
-                    'positions': [i for i, w in enumerate(words) if w == word]
-                })
-        
-        # Add noun phrases
-        for phrase in noun_phrases:
-            phrase_lower = phrase.lower()
-            count = text.lower().count(phrase_lower)
-            if count > 0:
-                keywords.append({
-                    'term': phrase,
-                    'importance_score': (count * len(phrase.split())) / len(words),
-                    'positions': []
-                })
-        
-        # Sort by importance and return top keywords
-        keywords.sort(key=lambda k: k['importance_score'], reverse=True)
-        return keywords[:10]
-    
-    def _extract_noun_phrases(self, text: str) -> List[str]:
-        """Extract simple noun phrases from text"""
-        # Simple pattern for noun phrases (can be improved with proper NLP)
-        pattern = r'\b([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)\b'
-        phrases = re.findall(pattern, text)
-        
-        # Filter out common titles
-        titles = {'Mr', 'Mrs', 'Dr', 'Ms', 'Prof'}
-        phrases = [p for p in phrases if p.split()[0] not in titles]
-        
-        return phrases
+    A worker that crashes, for example on a segfault or when it is killed
+    for running out of memory, breaks the pool. The files in flight at the
+    time are then retried one at a time to find the file that crashed it,
+    and the remaining files carry on in a new pool.
+    """
+    initargs = (stages, duplicate_threshold, time_budget)
+    files = deque(txt_files)
     
-    def _build_document_structure(self, chunks: List[Dict], title: str) -> Dict:
-        """Build final document structure"""
-        # Find root chunk (first chunk with no parent)
-        root_chunk = next((c for c in chunks if c['parent_id'] is None), chunks[0])
-        
-        # Calculate coverage
-        total_chars = sum(c['character_count'] for c in chunks)
+    while files:
+        crashed = yield from _pool_results(files, jobs, stream, initargs)
         
-        # Build relationships
-        for i, chunk in enumerate(chunks):
-            # Find children
-            children = [c['id'] for c in chunks if c['parent_id'] == chunk['id']]
-            
-            # Find siblings
-            siblings = [c for c in chunks if c['parent_id'] == chunk['parent_id'] and c['id'] != chunk['id']]
-            prev_chunk = None
-            next_chunk = None
-            
-            if siblings:
-                # Sort siblings by their order in the chunks list
-                siblings.sort(key=lambda c: chunks.index(c))
-                current_index = next(j for j, s in enumerate(siblings) if s['id'] == chunk['id'])
-                
-                if current_index > 0:
-                    prev_chunk = siblings[current_index - 1]['id']
-                if current_index < len(siblings) - 1:
-                    next_chunk = siblings[current_index + 1]['id']
-            
-            # Add relationships
-            chunk['relationships'] = {
-                'parent': chunk['parent_id'],
-                'children': children,
-                'prev': prev_chunk,
-                'next': next_chunk,
-                'references': [link['target_page_id'] for link in chunk['embedded_links']]
-            }
-            
-            # Generate summary
-            chunk['summary'] = self._generate_summary(chunk['content'])
-            
-            # Add context
-            chunk['context'] = f"Part of {title}, section on {chunk['title']}"
-            
-            # Convert to match expected format
-            chunk['parent_page_id'] = chunk.pop('parent_id', None)
-        
-        document = {
-            'document': {
-                'id': hashlib.md5(title.encode()).hexdigest()[:8],
-                'title': title,
-                'total_chunks': len(chunks),
-                'root_chunk_id': root_chunk['id'],
-                'created_at': datetime.now().isoformat() + 'Z',
-                'max_depth': max(c['level'] for c in chunks),
-                'coverage_percentage': 100.0  # Since we process all content
-            },
-            'chunks': chunks
-        }
+        for filename in crashed:
+            if (yield from _pool_results(deque([filename]), 1, stream, initargs)):
+                print(f"Finished {filename}:")
+                yield {'status': 'error', 'filename': filename, 'error': "The worker process crashed"}
+
+
+def _processor_config(processor: CoredocProcessor, stream: bool) -> Dict:
+    """Settings that change the output, used to invalidate the manifest"""
+    return {
+        'min_chunk_size': processor.min_chunk_size,
+        'max_chunk_size': processor.max_chunk_size,
+        'stream': stream,
+        'stages': processor.stage_config,
+        'duplicate_threshold': processor.duplicate_threshold,
+        'version': PROCESSOR_VERSION
+    }
+
+
+def _load_manifest() -> Dict:
+    """Load the incremental manifest, starting fresh if it is missing or unreadable"""
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        files = manifest.get('files', {})
+        # Records that are not objects are dropped like an unreadable manifest
+        return {filename: record for filename, record in files.items() if isinstance(record, dict)}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def _save_manifest(files: Dict):
+    """Write the manifest atomically so an interrupted run leaves the old one intact"""
+    temp_path = MANIFEST_FILE + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'files': files}, f)
+    os.replace(temp_path, MANIFEST_FILE)
+
+
+def _hash_file(filename: str) -> str:
+    """Hash file contents without loading the whole file"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _fingerprint(filename: str, previous: Optional[Dict]) -> Dict:
+    """Size, mtime and content hash of a file.
+    
+    The hash is reused when size and mtime match the previous run, so
+    unchanged files are not read at all.
+    """
+    stat = os.stat(filename)
+    
+    if (previous and previous.get('hash') and previous.get('size') == stat.st_size
+            and previous.get('mtime_ns') == stat.st_mtime_ns):
+        content_hash = previous['hash']
+    else:
+        content_hash = _hash_file(filename)
+    
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': content_hash}
+
+
+def _is_current(record: Optional[Dict], fingerprint: Dict, config: Dict) -> bool:
+    """Whether a manifest record still describes the file's output.
+    
+    Records with missing or malformed fields, such as hand-edited ones,
+    count as stale.
+    """
+    if not record or record.get('hash') != fingerprint['hash'] or record.get('config') != config:
+        return False
+    
+    # Documents cut short by the time budget get another chance
+    if record.get('degraded'):
+        return False
+    
+    # Outputs removed by hand are regenerated
+    if record.get('status') == 'skipped':
+        return True
+    entry = record.get('entry')
+    return (record.get('status') == 'processed' and isinstance(entry, dict)
+            and isinstance(entry.get('filename'), str) and os.path.exists(entry['filename']))
+
+
+def _remove_stale_outputs(manifest: Dict, txt_files: List[str]) -> int:
+    """Delete outputs of inputs that no longer exist"""
+    removed = 0
+    
+    for filename in set(manifest) - set(txt_files):
+        record = manifest.pop(filename)
+        entry = record.get('entry')
+        if record.get('status') != 'processed' or not isinstance(entry, dict) or 'filename' not in entry:
+            continue
         
-        return document
+        try:
+            os.remove(entry['filename'])
+            removed += 1
+        except FileNotFoundError:
+            pass
+    
+    return removed
+
+
+def write_index(entries: List[Dict], path: str = INDEX_FILE):
+    """Write the index of processed documents read by the viewer.
+    
+    The index is replaced atomically, so the viewer never reads a partial file.
+    """
+    index = {
+        'documents': entries,
+        'total': len(entries),
+        'created_at': _now()
+    }
+    
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def link_corpus(entries: List[Dict]) -> int:
+    """Write cross-document links between the documents of index entries.
     
-    def _generate_summary(self, content: str) -> str:
-        """Generate a simple summary of the content"""
-        sentences = sent_tokenize(content)
-        if sentences:
-            # Return first sentence as summary (can be improved)
-            return sentences[0][:200] + '...' if len(sentences[0]) > 200 else sentences[0]
-        return "No summary available"
+    The keywords of every output are indexed by one CorpusLinker, and each
+    chunk's top links into other documents are written to CORPUS_LINKS_FILE
+    as a corpus header line followed by one line per linked chunk.
+    Returns the number of linked chunks.
+    """
+    linker = CorpusLinker()
+    for entry in entries:
+        with open(entry['filename'], 'r', encoding='utf-8') as f:
+            linker.add_document(entry['filename'], json.load(f))
+    
+    header = {'corpus': dict(linker.stats(), created_at=_now())}
+    temp_path = CORPUS_LINKS_FILE + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        linked = dump_ndjson(chain([header], linker.iter_links()), f)
+    os.replace(temp_path, CORPUS_LINKS_FILE)
+    
+    return linked
 
 
-def process_folder():
-    """Process all .txt files in the current directory"""
-    processor = CoredocProcessor()
-    processed_files = []
+def find_corpus_duplicates(entries: List[Dict], threshold: float = 0.9) -> int:
+    """Write the near-duplicate chunks found across the documents of index entries.
+    
+    Chunks are compared by MinHash in one index, in document order, so each
+    group is reported under the first chunk seen. CORPUS_DUPLICATES_FILE
+    gets a corpus header line followed by one line per group.
+    Returns the number of duplicate chunks.
+    """
+    index = MinHashIndex(threshold)
+    groups = defaultdict(list)
+    chunk_count = 0
+    
+    for entry in entries:
+        with open(entry['filename'], 'r', encoding='utf-8') as f:
+            document = json.load(f)
+        
+        # Offset outputs keep chunk text in the header
+        text = document['document'].get('text')
+        contents = (chunk['content'] if 'content' in chunk else text[chunk['span'][0]:chunk['span'][1]]
+                    for chunk in document['chunks'])
+        
+        for chunk, signature in zip(document['chunks'], index.signatures(contents)):
+            chunk_count += 1
+            if signature is None:
+                continue
+            match = index.add((entry['filename'], chunk['id']), signature)
+            if match is not None:
+                canonical, similarity = match
+                groups[canonical].append({'document': entry['filename'], 'chunk': chunk['id'],
+                                          'similarity': similarity})
+    
+    duplicates = sum(len(group) for group in groups.values())
+    header = {'corpus': {'documents': len(entries), 'chunks': chunk_count, 'duplicates': duplicates,
+                         'threshold': threshold, 'created_at': _now()}}
+    records = ({'document': document, 'chunk': chunk_id, 'duplicates': group}
+               for (document, chunk_id), group in groups.items())
+    
+    temp_path = CORPUS_DUPLICATES_FILE + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        dump_ndjson(chain([header], records), f)
+    os.replace(temp_path, CORPUS_DUPLICATES_FILE)
+    
+    return duplicates
+
+
+def process_folder(jobs: int = 1, force: bool = False, stream: bool = False,
+                   stages: Optional[Dict[str, str]] = None, corpus_links: bool = False,
+                   duplicate_threshold: float = 0.9, corpus_duplicates: bool = False,
+                   time_budget: Optional[float] = None):
+    """Process all .txt files in the current directory.
+    
+    With jobs > 1 the files are spread over a pool of worker processes, and
+    with stream set each file is read incrementally, though its chunks are
+    still held in memory until its output is written.
+    stages selects pipeline stage implementations, as in CoredocProcessor,
+    and duplicate_threshold the similarity at which chunks count as
+    duplicates. Files whose content and processor settings match the
+    manifest from a previous run are skipped unless force is set. With
+    corpus_links set, links between the chunks of different documents are
+    written as well, and with corpus_duplicates the near-duplicate chunks
+    found across documents. time_budget bounds the seconds each document
+    spends in optional stages; documents it cuts short are reprocessed on
+    the next run.
+    """
+    processor = _create_processor(stages, duplicate_threshold, time_budget)
+    config = _processor_config(processor, stream)
     
     # Get all .txt files in current directory
-    txt_files = [f for f in os.listdir('.') if f.endswith('.txt')]
+    txt_files = sorted(f for f in os.listdir('.') if f.endswith('.txt'))
+    
+    manifest = _load_manifest()
+    removed = _remove_stale_outputs(manifest, txt_files)
+    if removed:
+        print(f"Removed {removed} output(s) of deleted file(s).")
     
     if not txt_files:
+        _save_manifest(manifest)
         print("No .txt files found in the current directory.")
         return
     
-    print(f"Found {len(txt_files)} text file(s) to process...\n")
-    
-    # Process each file
+    # Split files into unchanged and pending
+    fingerprints = {}
+    pending = []
     for filename in txt_files:
-        print(f"Processing {filename}...")
+        fingerprints[filename] = _fingerprint(filename, manifest.get(filename))
+        if force or not _is_current(manifest.get(filename), fingerprints[filename], config):
+            pending.append(filename)
+    
+    unchanged = len(txt_files) - len(pending)
+    print(f"Found {len(txt_files)} text file(s), {len(pending)} to process, {unchanged} unchanged...\n")
+    
+    # Process each changed file
+    if jobs > 1 and len(pending) > 1:
+        results = _process_parallel(pending, jobs, stream, stages, duplicate_threshold, time_budget)
+    else:
+        results = _process_serial(processor, pending, stream)
+    
+    for result in results:
+        _report(result)
+        filename = result['filename']
         
-        try:
-            # Read the file
-            with open(filename, 'r', encoding='utf-8') as f:
-                text = f.read()
-            
-            # Check minimum length
-            if len(text) < 1000:
-                print(f"  ⚠️  Skipping {filename} - too short (minimum 1000 characters)")
-                continue
-            
-            # Process the document
-            title = os.path.splitext(filename)[0].replace('-', ' ').replace('_', ' ').title()
-            document = processor.process_text(text, title)
-            
-            # Save output
-            output_filename = os.path.splitext(filename)[0] + '.coredoc.json'
-            with open(output_filename, 'w', encoding='utf-8') as f:
-                json.dump(document, f, indent=2)
-            
-            print(f"  ✓ Processed successfully!")
-            print(f"    - Total chunks: {document['document']['total_chunks']}")
-            print(f"    - Max depth: {document['document']['max_depth']}")
-            print(f"    - Output: {output_filename}\n")
-            
-            processed_files.append({
-                'filename': output_filename,
-                'title': title,
-                'chunks': document['document']['total_chunks'],
-                'created': document['document']['created_at']
-            })
-            
-        except Exception as e:
-            print(f"  ✗ Error processing {filename}: {str(e)}\n")
+        if result['status'] == 'error':
+            # Failed files are retried on the next run
+            manifest.pop(filename, None)
+            continue
+        
+        manifest[filename] = dict(fingerprints[filename], config=config, status=result['status'],
+                                  entry=result.get('entry'), degraded=result.get('degraded', []))
+    
+    _save_manifest(manifest)
+    
+    # Index in file order, regardless of which file finished first
+    processed_files = [manifest[filename]['entry'] for filename in txt_files
+                       if filename in manifest and manifest[filename]['status'] == 'processed']
     
     # Create index file
     if processed_files:
-        index = {
-            'documents': processed_files,
-            'total': len(processed_files),
-            'created_at': datetime.now().isoformat() + 'Z'
-        }
-        
-        with open('index.json', 'w', encoding='utf-8') as f:
-            json.dump(index, f, indent=2)
+        write_index(processed_files)
         
         print(f"\n✅ Processing complete!")
         print(f"   - Processed {len(processed_files)} document(s)")
-        print(f"   - Index created: index.json")
+        print(f"   - Index created: {INDEX_FILE}")
+        
+        if corpus_links:
+            linked = link_corpus(processed_files)
+            print(f"   - Cross-document links: {CORPUS_LINKS_FILE} ({linked} chunk(s) linked)")
+        if corpus_duplicates:
+            duplicates = find_corpus_duplicates(processed_files, duplicate_threshold)
+            print(f"   - Near-duplicate chunks: {CORPUS_DUPLICATES_FILE} ({duplicates} found)")
         print(f"\n📖 Open index.html in your browser to view the documents.")
     else:
         print("\n❌ No documents were processed successfully.")
 
 
+def main():
+    parser = argparse.ArgumentParser(description='Process all .txt files in the current directory into COREDOC format')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of worker processes (0 uses every CPU core)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='Reprocess every file, ignoring the incremental manifest')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read files incrementally; chunks are still held in memory')
+    parser.add_argument('--offline', action='store_true',
+                        help='Fail instead of downloading missing NLTK data')
+    parser.add_argument('--stages', metavar='SPEC', type=parse_stage_config, default={},
+                        help='Stage implementations, e.g. links=off,summaries=off '
+                             f"(stages: {', '.join(PIPELINE_STAGES)})")
+    parser.add_argument('--corpus-links', action='store_true',
+                        help=f'Link chunks across documents and write the links to {CORPUS_LINKS_FILE}')
+    parser.add_argument('--duplicate-threshold', type=float, default=0.9,
+                        help='Similarity above which chunks count as near duplicates '
+                             '(used by --stages duplicates=minhash and --corpus-duplicates)')
+    parser.add_argument('--corpus-duplicates', action='store_true',
+                        help=f'Find near-duplicate chunks across documents and write them to {CORPUS_DUPLICATES_FILE}')
+    parser.add_argument('--time-budget', type=float, metavar='SECONDS',
+                        help='Seconds per document after which optional stages such as links are cut short')
+    
+    args = parser.parse_args()
+    
+    if args.offline:
+        # Inherited by pool workers through the environment
+        os.environ['COREDOC_OFFLINE'] = '1'
+        coredoc.OFFLINE = True
+    
+    try:
+        _create_processor(args.stages, args.duplicate_threshold)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    process_folder(jobs, args.force, args.stream, args.stages, args.corpus_links,
+                   args.duplicate_threshold, args.corpus_duplicates, args.time_budget)
+
+
 if __name__ == '__main__':
-    process_folder()
\ No newline at end of file
+    main()
\ No newline at end of file
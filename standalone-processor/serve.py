@@ -0,0 +1,608 @@
+#!/usr/bin/env python3
+"""
+COREDOC Processing Server
+
+Serves the document viewer and accepts new documents while running, so
+a container no longer needs a restart to pick up uploads. Uploaded .txt
+files are saved to the documents folder and queued onto a bounded pool
+of CoredocProcessor worker processes; finished documents are added to
+index.json for the viewer.
+
+    POST /api/jobs                  upload a document (multipart 'file', JSON or text/plain)
+                                    -> 202 DocumentUploadResponse
+    GET  /api/jobs/<id>             -> ProcessingStatus
+    GET  /api/jobs/<id>/result      -> ProcessingResponse, with the document once completed
+    GET  /api/health                -> worker, queue and connection counts
+    GET  /<path>                    viewer and documents
+
+The response shapes match types/document.ts. Admission control keeps
+the server responsive under load: a job slot is reserved before an upload
+is read, and when every worker is busy and the queue is full, or too many
+connections are open, requests get 503 with Retry-After at once.
+JSON and text responses are gzipped for clients that accept it.
+
+Usage:
+    python serve.py [--port 8000] [--documents DIR] [--workers N] [--queue N]
+"""
+
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import functools
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import process_folder
+from process_folder import INDEX_FILE, MIN_CHARACTERS, _now, parse_stage_config
+
+# Viewer and other static files next to this script
+STATIC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Finished jobs remembered for status requests, oldest dropped first
+MAX_FINISHED_JOBS = 1000
+
+# Seconds allowed for a client to send its request
+REQUEST_TIMEOUT = 30
+
+# Suggested wait, in seconds, for clients turned away under load
+RETRY_AFTER = 5
+
+MAX_HEADER_BYTES = 64 * 1024
+
+# Responses at least this large are gzipped for clients that accept it
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.json': 'application/json',
+    '.ndjson': 'application/x-ndjson',
+    '.js': 'text/javascript',
+    '.css': 'text/css',
+    '.txt': 'text/plain; charset=utf-8',
+}
+
+
+class HTTPError(Exception):
+    """An error answered with a JSON {"error": ...} body"""
+    
+    def __init__(self, status: HTTPStatus, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+# Queue carrying (job id, stage, fraction done) from the workers to the server
+_progress_queue = None
+
+
+def _init_worker(stages: Optional[Dict[str, str]], duplicate_threshold: float, time_budget: Optional[float],
+                 progress_queue):
+    """Create the processor of a worker process, and keep the progress queue"""
+    global _progress_queue
+    process_folder._init_worker(stages, duplicate_threshold, time_budget)
+    _progress_queue = progress_queue
+
+
+def _process_job(job_id: str, filename: str, title: str) -> Dict:
+    processor = process_folder._worker_processor
+    processor.on_progress = lambda event: _progress_queue.put((job_id, event.stage, event.fraction))
+    return process_folder.process_file(processor, filename, title=title)
+
+
+class Job:
+    """A queued document and its ProcessingStatus"""
+    
+    def __init__(self, filename: str, title: str):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.title = title
+        self.status = 'pending'
+        self.stage = 'queued'
+        self.progress = 0
+        self.message = 'Waiting for a worker'
+        self.error = None
+        self.started_at = _now()
+        self.completed_at = None
+        self.entry = None
+    
+    def to_status(self) -> Dict:
+        status = {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'stage': self.stage,
+            'message': self.message,
+            'started_at': self.started_at,
+        }
+        if self.error is not None:
+            status['error'] = self.error
+        if self.completed_at is not None:
+            status['completed_at'] = self.completed_at
+        return status
+
+
+class ProcessingService:
+    """Job queue in front of a process pool of Coredoc workers.
+    
+    At most workers jobs run at once, and at most queue_size more wait;
+    reserve() refuses anything beyond that. Finished documents are written
+    next to their upload and listed in the index. Workers report the stage
+    and progress of their jobs through a queue read by a background thread.
+    """
+    
+    def __init__(self, workers: int, queue_size: int, stages: Optional[Dict[str, str]] = None,
+                 duplicate_threshold: float = 0.9, time_budget: Optional[float] = None):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.stages = stages
+        self.duplicate_threshold = duplicate_threshold
+        self.time_budget = time_budget
+        self.jobs = OrderedDict()
+        self.active = 0
+        self._reserved = 0
+        self._running = asyncio.Semaphore(workers)
+        self._progress = multiprocessing.SimpleQueue()
+        self._pool = self._create_pool()
+        self._tasks = set()
+        self._index = self._load_index()
+        
+        self._progress_reader = threading.Thread(target=self._read_progress, args=(asyncio.get_running_loop(),),
+                                                 daemon=True)
+        self._progress_reader.start()
+    
+    def _create_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                   initargs=(self.stages, self.duplicate_threshold, self.time_budget,
+                                             self._progress))
+    
+    def _read_progress(self, loop: asyncio.AbstractEventLoop):
+        while True:
+            event = self._progress.get()
+            if event is None:
+                return
+            loop.call_soon_threadsafe(self._update_progress, *event)
+    
+    def _update_progress(self, job_id: str, stage: str, fraction: float):
+        job = self.jobs.get(job_id)
+        if job is not None and job.status == 'processing':
+            job.stage = stage
+            job.progress = int(fraction * 100)
+    
+    @staticmethod
+    def _load_index() -> List[Dict]:
+        try:
+            with open(INDEX_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f).get('documents', [])
+        except (OSError, ValueError, AttributeError):
+            return []
+    
+    def reserve(self) -> bool:
+        """Claim a job slot before reading an upload; False when at capacity"""
+        if self.active + self._reserved >= self.capacity:
+            return False
+        self._reserved += 1
+        return True
+    
+    def release(self):
+        """Give back a reserved slot that was not used"""
+        self._reserved -= 1
+    
+    def submit(self, filename: str, title: str) -> Job:
+        """Queue a saved upload in a reserved slot"""
+        self._reserved -= 1
+        self.active += 1
+        
+        job = Job(filename, title)
+        self.jobs[job.id] = job
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+    
+    async def _run(self, job: Job):
+        try:
+            async with self._running:
+                job.status = 'processing'
+                job.stage = 'processing'
+                job.message = 'Processing document'
+                result = await self._execute(job)
+            
+            if result['status'] == 'processed':
+                job.entry = result['entry']
+                self._add_to_index(job.entry)
+                job.status = 'completed'
+                job.progress = 100
+                job.message = f"Processed into {job.entry['chunks']} chunks"
+                if result['degraded']:
+                    job.message += f"; {', '.join(result['degraded'])} cut short by the time budget"
+            elif result['status'] == 'skipped':
+                self._fail(job, f"Document is too short (minimum {MIN_CHARACTERS} characters)")
+            else:
+                self._fail(job, result['error'])
+        except Exception as e:
+            self._fail(job, str(e))
+        finally:
+            if job.status in ('completed', 'failed'):
+                job.stage = job.status
+            job.completed_at = _now()
+            self.active -= 1
+            self._forget_finished()
+    
+    async def _execute(self, job: Job) -> Dict:
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            return await loop.run_in_executor(pool, _process_job, job.id, job.filename, job.title)
+        except BrokenProcessPool:
+            # A crashed worker breaks the pool; later jobs get a new one
+            if self._pool is pool:
+                self._pool = self._create_pool()
+            raise RuntimeError("Worker process exited unexpectedly") from None
+    
+    @staticmethod
+    def _fail(job: Job, error: str):
+        job.status = 'failed'
+        job.error = error
+        job.message = 'Processing failed'
+    
+    def _add_to_index(self, entry: Dict):
+        self._index = [item for item in self._index if item['filename'] != entry['filename']]
+        self._index.append(entry)
+        process_folder.write_index(self._index)
+    
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.completed_at is not None]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+    
+    def stats(self) -> Dict:
+        return {
+            'workers': self.workers,
+            'running': min(self.active, self.workers),
+            'queued': max(0, self.active - self.workers),
+            'capacity': self.capacity,
+        }
+    
+    async def close(self):
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._pool.shutdown()
+        self._progress.put(None)
+        await _in_thread(self._progress_reader.join)
+
+
+def _save_upload(name: str, data: bytes) -> str:
+    """Save data under a new .txt file name made from name"""
+    stem = re.sub(r'[^A-Za-z0-9_-]+', '-', os.path.splitext(os.path.basename(name))[0]).strip('-') or 'document'
+    filename = f"{stem}.txt"
+    number = 1
+    while True:
+        try:
+            # Exclusive creation, so concurrent uploads never share a name
+            with open(filename, 'xb') as f:
+                f.write(data)
+            return filename
+        except FileExistsError:
+            number += 1
+            filename = f"{stem}-{number}.txt"
+
+
+def _parse_upload(content_type: str, body: bytes, query: Dict[str, List[str]]) -> Tuple[bytes, str, Optional[str]]:
+    """Text, source file name and title of an upload request"""
+    title = query.get('title', [None])[0]
+    
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if name:
+                fields[name] = part
+        
+        upload = fields.get('file')
+        if upload is None:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "No file provided")
+        name = upload.get_filename() or 'document.txt'
+        if not name.endswith('.txt'):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Only .txt files can be processed")
+        if 'title' in fields:
+            title = fields['title'].get_content().strip() or title
+        return upload.get_payload(decode=True), name, title
+    
+    if content_type.startswith('application/json'):
+        try:
+            request = json.loads(body)
+            text = request['text']
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid request") from None
+        if not isinstance(text, str) or not text:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid request")
+        title = request.get('title') or title
+        return text.encode('utf-8'), (title or 'document') + '.txt', title
+    
+    if content_type.startswith('text/plain'):
+        return body, (title or 'document') + '.txt', title
+    
+    raise HTTPError(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "Invalid content type")
+
+
+class Server:
+    """Minimal HTTP/1.1 front end; every response closes its connection"""
+    
+    def __init__(self, service: ProcessingService, max_connections: int, max_upload_bytes: int):
+        self.service = service
+        self.max_connections = max_connections
+        self.max_upload_bytes = max_upload_bytes
+        self.connections = 0
+    
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            if self.connections > self.max_connections:
+                raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Server is busy. Please try again shortly.",
+                                {'Retry-After': str(RETRY_AFTER)})
+            status, headers, body = await asyncio.wait_for(self._respond(reader), REQUEST_TIMEOUT)
+        except HTTPError as e:
+            status, headers, body = e.status, e.headers, _json_bytes({'error': str(e)})
+        except asyncio.TimeoutError:
+            status, headers, body = HTTPStatus.REQUEST_TIMEOUT, {}, _json_bytes({'error': "Request timed out"})
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            self.connections -= 1
+            return
+        except Exception as e:
+            print(f"Request failed: {e}", file=sys.stderr)
+            status, headers, body = HTTPStatus.INTERNAL_SERVER_ERROR, {}, _json_bytes({'error': "Internal error"})
+        
+        try:
+            headers = {'Content-Type': 'application/json', **headers}
+            head = f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            head += ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+            head += f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            writer.write(head.encode('latin-1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            self.connections -= 1
+    
+    async def _respond(self, reader: asyncio.StreamReader) -> Tuple[HTTPStatus, Dict[str, str], bytes]:
+        request_line, headers = await self._read_head(reader)
+        try:
+            method, target, _ = request_line.split(' ', 2)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line") from None
+        
+        status, response_headers, body = await self._route(reader, method, target, headers)
+        if len(body) >= COMPRESS_MIN_BYTES and _accepts_gzip(headers.get('accept-encoding', '')):
+            content_type = response_headers.get('Content-Type', 'application/json')
+            if content_type.startswith(('text/', 'application/json', 'application/x-ndjson')):
+                body = await _in_thread(_gzip, body)
+                response_headers = dict(response_headers, **{'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+        return status, response_headers, body
+    
+    async def _route(self, reader: asyncio.StreamReader, method: str, target: str,
+                     headers: Dict[str, str]) -> Tuple[HTTPStatus, Dict[str, str], bytes]:
+        url = urlsplit(target)
+        path = unquote(url.path)
+        query = parse_qs(url.query)
+        
+        if path == '/api/jobs':
+            if method != 'POST':
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "Use POST to upload documents")
+            return await self._upload(reader, headers, query)
+        
+        if method not in ('GET', 'HEAD'):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed")
+        
+        if path == '/api/health':
+            return HTTPStatus.OK, {}, _json_bytes(dict(self.service.stats(), connections=self.connections))
+        
+        match = re.fullmatch(r'/api/jobs/([0-9a-f]+)(/result)?', path)
+        if match:
+            job = self.service.jobs.get(match.group(1))
+            if job is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, "Unknown job")
+            if match.group(2):
+                return await self._result(job)
+            return HTTPStatus.OK, {}, _json_bytes(job.to_status())
+        
+        return await self._static(path)
+    
+    async def _read_head(self, reader: asyncio.StreamReader) -> Tuple[str, Dict[str, str]]:
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Request headers too large") from None
+        
+        lines = head.decode('latin-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(':')
+            if separator:
+                headers[name.strip().lower()] = value.strip()
+        return lines[0], headers
+    
+    async def _upload(self, reader: asyncio.StreamReader, headers: Dict[str, str],
+                      query: Dict[str, List[str]]) -> Tuple[HTTPStatus, Dict[str, str], bytes]:
+        try:
+            length = int(headers['content-length'])
+        except (KeyError, ValueError):
+            raise HTTPError(HTTPStatus.LENGTH_REQUIRED, "Content-Length is required") from None
+        if length > self.max_upload_bytes:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                            f"Uploads are limited to {self.max_upload_bytes} bytes")
+        
+        # Turn requests away before reading their upload
+        if not self.service.reserve():
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Processor is busy. Please try again shortly.",
+                            {'Retry-After': str(RETRY_AFTER)})
+        try:
+            body = await reader.readexactly(length)
+            data, name, title = _parse_upload(headers.get('content-type', ''), body, query)
+            filename = await _in_thread(_save_upload, name, data)
+        except BaseException:
+            self.service.release()
+            raise
+        
+        job = self.service.submit(filename, title)
+        response = {
+            'document_id': os.path.splitext(filename)[0] + '.coredoc.json',
+            'processing_id': job.id,
+            'message': "Document queued for processing",
+        }
+        return HTTPStatus.ACCEPTED, {'Location': f"/api/jobs/{job.id}"}, _json_bytes(response)
+    
+    async def _result(self, job: Job) -> Tuple[HTTPStatus, Dict[str, str], bytes]:
+        """ProcessingResponse of a job, splicing in the saved document unparsed"""
+        status = _json_bytes(job.to_status())
+        if job.status != 'completed':
+            code = HTTPStatus.OK if job.status == 'failed' else HTTPStatus.ACCEPTED
+            return code, {}, b'{"status":' + status + b'}'
+        
+        try:
+            document = await _in_thread(_read_file, job.entry['filename'])
+        except FileNotFoundError:
+            raise HTTPError(HTTPStatus.GONE, "The document has been removed") from None
+        return HTTPStatus.OK, {}, b'{"status":' + status + b',"document":' + document + b'}'
+    
+    async def _static(self, path: str) -> Tuple[HTTPStatus, Dict[str, str], bytes]:
+        """Documents from the documents folder, the viewer from STATIC_DIR"""
+        relative = os.path.normpath(path.lstrip('/') or 'index.html')
+        if relative.startswith('..') or os.path.isabs(relative):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Not found")
+        
+        for root in (os.getcwd(), STATIC_DIR):
+            filename = os.path.join(root, relative)
+            if os.path.isfile(filename):
+                content_type = CONTENT_TYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
+                return HTTPStatus.OK, {'Content-Type': content_type}, await _in_thread(_read_file, filename)
+        raise HTTPError(HTTPStatus.NOT_FOUND, "Not found")
+
+
+def _read_file(filename: str) -> bytes:
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def _gzip(data: bytes) -> bytes:
+    """Compress data with a fixed mtime, which gzip.compress() only accepts from Python 3.8"""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+async def _in_thread(function, *args):
+    """Run function(*args) in the default thread pool, like asyncio.to_thread() from Python 3.9"""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args))
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q=0"""
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            q = params.strip().lower()
+            return not re.fullmatch(r'q=0(\.0*)?', q)
+    return False
+
+
+def _json_bytes(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+async def serve(host: str, port: int, workers: int, queue_size: int, max_connections: int,
+                max_upload_bytes: int, stages: Optional[Dict[str, str]] = None, duplicate_threshold: float = 0.9,
+                time_budget: Optional[float] = None):
+    """Run the server in the current directory until cancelled"""
+    service = ProcessingService(workers, queue_size, stages, duplicate_threshold, time_budget)
+    server = Server(service, max_connections, max_upload_bytes)
+    
+    listener = await asyncio.start_server(server.handle, host, port, limit=MAX_HEADER_BYTES,
+                                          backlog=max_connections)
+    print(f"📖 Serving documents from {os.getcwd()} at http://{host}:{port}/ "
+          f"({workers} worker(s), queue of {queue_size})")
+    
+    try:
+        # Stop cleanly when a container is stopped
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, listener.close)
+    except NotImplementedError:
+        pass
+    
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the COREDOC viewer and process uploaded documents')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--documents', default='.', help='Folder holding documents and their outputs')
+    parser.add_argument('-j', '--workers', type=int, default=0,
+                        help='Worker processes (default: one per CPU core)')
+    parser.add_argument('--queue', type=int, default=32,
+                        help='Jobs allowed to wait for a worker before uploads are refused')
+    parser.add_argument('--max-connections', type=int, default=256,
+                        help='Open connections beyond which requests are refused')
+    parser.add_argument('--max-upload-mb', type=float, default=50)
+    parser.add_argument('--offline', action='store_true',
+                        help='Fail instead of downloading missing NLTK data')
+    parser.add_argument('--stages', metavar='SPEC', type=parse_stage_config, default={},
+                        help='Stage implementations, e.g. links=off,summaries=off')
+    parser.add_argument('--duplicate-threshold', type=float, default=0.9,
+                        help='Similarity above which chunks count as near duplicates')
+    parser.add_argument('--time-budget', type=float, metavar='SECONDS',
+                        help='Seconds per document after which optional stages such as links are cut short')
+    parser.add_argument('--skip-initial', action='store_true',
+                        help='Serve without first processing the .txt files already in the folder')
+    
+    args = parser.parse_args()
+    
+    if args.offline:
+        # Inherited by pool workers through the environment
+        os.environ['COREDOC_OFFLINE'] = '1'
+        process_folder.coredoc.OFFLINE = True
+    
+    try:
+        process_folder._create_processor(args.stages, args.duplicate_threshold)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    os.chdir(args.documents)
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    
+    if not args.skip_initial:
+        process_folder.process_folder(workers, stages=args.stages, duplicate_threshold=args.duplicate_threshold,
+                                      time_budget=args.time_budget)
+    
+    try:
+        asyncio.run(serve(args.host, args.port, workers, args.queue, args.max_connections,
+                          int(args.max_upload_mb * 1024 * 1024), args.stages, args.duplicate_threshold,
+                          args.time_budget))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -27,12 +27,21 @@ export interface EmbeddedLink {
   keyword: string;
   target_page_id: string;
   context_hint: string;
+  anchors?: [number, number][]; // [start, end] offsets of the keyword in the chunk content
+}
+
+// A near-duplicate chunk collapsed into the chunk listing it
+export interface ChunkDuplicate {
+  title: string;
+  parent: string | null;
+  similarity: number;
 }
 
 // V3 Chunk format (current)
 export interface DocumentChunk {
   id: string;
   content: string;
+  span?: [number, number]; // with --offsets: [start, end] code point offsets into DocumentMetadata.text
   summary: string;
   context: string;
   metadata?: ChunkMetadata;
@@ -44,6 +53,7 @@ export interface DocumentChunk {
   title?: string;
   embedded_links?: EmbeddedLink[];
   parent_page_id?: string | null;
+  duplicates?: ChunkDuplicate[]; // with the duplicates=minhash stage
 }
 
 // V2 Page format (legacy compatibility)
@@ -73,6 +83,24 @@ export interface DocumentMetadata {
   original_char_count?: number;
   preserved_char_count?: number;
   coverage_percentage?: number;
+  // Present when processed with --profile
+  processing_stats?: ProcessingStats;
+  // Present when processed with --offsets; chunk spans index this text
+  text?: string;
+  // Optional stages cut short or skipped because the time budget ran out
+  degraded_stages?: string[];
+}
+
+export interface StageStats {
+  wall_seconds: number;
+  cpu_seconds: number;
+  peak_bytes: number;
+}
+
+export interface ProcessingStats {
+  total_wall_seconds: number;
+  stages: Record<string, StageStats>;
+  counters: Record<string, number>;
 }
 
 export interface CoredocDocument {